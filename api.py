@@ -1,38 +1,46 @@
-from flask import Flask, request, jsonify, session, url_for, redirect, make_response, send_from_directory, abort
+from flask import Flask, current_app, request, jsonify, session, url_for, redirect, make_response, send_from_directory, abort, Response, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from flask_dance.contrib.google import make_google_blueprint, google
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin, SQLAlchemyStorage
 from flask_dance.consumer import oauth_authorized
 from functools import wraps
-from models import db, User, Calculation, ChatMessage, OAuthToken
+from models import db, User, Calculation, CalculationRollup, ChatMessage, OAuthToken
+from stats import (record_calculations, get_user_statistics, get_user_calculation_count, get_site_statistics,
+                   users_with_calculation_counts)
+from calculation_writer import calculation_writer
+from auth_claims import user_claims, claims_are_current
+from identity_cache import identity_cache
+from content import load_static_content
+from static_assets import AssetIndex
+from json_provider import make_json_provider
+from exports import ExportError, export_format, users_query, calculations_query, stream_export
+from rollups import rollup_history_query
+from usage import UsageQueryError, usage_series_from_request
+from migrate import apply_migrations
+from environment import get_environment
+from db_config import engine_options, pool_stats
+from http_client import PooledOAuth2Session, scope_session_per_request
+from metrics import request_metrics
+from query_inspector import query_inspector, query_budget
+from routing import RouteTable
 import os
+import base64
 import random
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
+# (before anything reads os.environ - several modules do at import time)
 load_dotenv()
 
-app = Flask(__name__)
-
 # ===================== ENVIRONMENT CONFIGURATION =====================
 
-def get_environment():
-    """Detect current environment"""
-    env = os.environ.get('ENVIRONMENT', 'local')
-    if env in ['local', 'development']:
-        return 'local'
-    elif env in ['staging', 'test']:
-        return 'staging'
-    else:
-        return 'production'
-
-def get_frontend_url():
+def get_frontend_url(env=None):
     """Get frontend URL based on environment"""
-    env = get_environment()
+    env = env or get_environment()
     
     if env == 'local':
         return 'http://localhost:3000'
@@ -43,82 +51,154 @@ def get_frontend_url():
         # Production
         return os.environ.get('FRONTEND_URL', 'https://pirateship.nl')
 
-# Environment-specific configuration
-current_env = get_environment()
-frontend_url = get_frontend_url()
-
-print(f"🌍 Environment: {current_env}")
-print(f"🌐 Frontend URL: {frontend_url}")
-
-# Allow OAuth over HTTP ONLY for local development
-if current_env == 'local':
-    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-    print("🔓 OAuth over HTTP enabled for local development")
-
-# Enable CORS for React frontend (environment-aware)
-cors_origins = [frontend_url]
-if current_env == 'local':
-    # Allow both localhost variations for local development
-    cors_origins.extend(['http://localhost:3000', 'http://127.0.0.1:3000'])
-
-CORS(app, origins=cors_origins, supports_credentials=True)
-print(f"🌐 CORS enabled for: {cors_origins}")
-
-# Database configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///amsterdam.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# JWT Configuration
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-change-in-production')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
-
-# Email configuration for MFA
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USE_SSL'] = False
-app.config['MAIL_USERNAME'] = os.environ.get('GMAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.environ.get('GMAIL_APP_PASSWORD')
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('GMAIL_USERNAME')
-
-# Google OAuth Configuration
-app.config['GOOGLE_OAUTH_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
-app.config['GOOGLE_OAUTH_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
-
-# Initialize extensions
-db.init_app(app)
-mail = Mail(app)
-jwt = JWTManager(app)
+def get_oauth_redirect_url(env=None):
+    """Get OAuth redirect URL based on environment"""
+    if (env or get_environment()) == 'local':
+        return 'http://localhost:5001/auth/google/authorized'
+    else:
+        # For staging/production, use the same domain
+        return None  # Flask-Dance will auto-generate from request
+
+# ===================== EXTENSIONS AND ROUTES =====================
+
+# Declared here, bound to an app by create_app() below
+routes = RouteTable()
+mail = Mail()
+jwt = JWTManager()
 
 # Flask-Login setup (for compatibility with existing auth)
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Create Google OAuth blueprint with environment-aware redirect URL
-def get_oauth_redirect_url():
-    """Get OAuth redirect URL based on environment"""
-    if current_env == 'local':
-        return 'http://localhost:5001/auth/google/authorized'
-    else:
-        # For staging/production, use the same domain
-        return None  # Flask-Dance will auto-generate from request
+    # Cached snapshot - user ids are UUID strings, not integers
+    return identity_cache.get(user_id)
 
+# Google OAuth blueprint (client id/secret come from GOOGLE_OAUTH_CLIENT_ID/SECRET
+# in app.config, the redirect URL is set per environment in create_app)
 google_bp = make_google_blueprint(
-    client_id=app.config['GOOGLE_OAUTH_CLIENT_ID'],
-    client_secret=app.config['GOOGLE_OAUTH_CLIENT_SECRET'],
     scope=['https://www.googleapis.com/auth/userinfo.profile', 
            'https://www.googleapis.com/auth/userinfo.email', 
            'openid'],
     storage=SQLAlchemyStorage(OAuthToken, db.session),
-    redirect_url=get_oauth_redirect_url()
+    session_class=PooledOAuth2Session  # Shared keep-alive pool with timeouts
 )
-app.register_blueprint(google_bp, url_prefix='/auth')
+scope_session_per_request(google_bp)  # One OAuth session per request, not per worker
+
+# ===================== APPLICATION FACTORY =====================
+
+def create_app(config=None):
+    """
+    Build the Flask app - `gunicorn api:app` serves the instance created
+    at the bottom of this module
+
+    Why a factory?
+    - Importing this module only declares routes and extensions; the app,
+      its database engine, the content/asset indexes and the startup
+      output are created here
+    - gunicorn can build it once in the master (preload_app) and fork
+      workers that share its memory; post_fork in gunicorn.conf.py
+      disposes the engine each worker inherits
+    - Scripts can build an app with their own settings:
+      create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///other.db'})
+      (FRONTEND_BUILD_PATH points it at another Next.js export)
+    """
+    app = Flask(__name__)
+    app.json = make_json_provider(app)  # orjson when installed, stdlib otherwise
+
+    # Database configuration
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///amsterdam.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # JWT Configuration
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-change-in-production')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+
+    # Email configuration for MFA
+    app.config['MAIL_SERVER'] = 'smtp.gmail.com'
+    app.config['MAIL_PORT'] = 587
+    app.config['MAIL_USE_TLS'] = True
+    app.config['MAIL_USE_SSL'] = False
+    app.config['MAIL_USERNAME'] = os.environ.get('GMAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.environ.get('GMAIL_APP_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('GMAIL_USERNAME')
+
+    # Google OAuth Configuration
+    app.config['GOOGLE_OAUTH_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
+    app.config['GOOGLE_OAUTH_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
+
+    app.config.update(config or {})
+    app.config.setdefault('ENVIRONMENT', get_environment())
+    app.config.setdefault('FRONTEND_BUILD_PATH', os.path.join(os.path.dirname(__file__), 'frontend', 'out'))
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config['ENVIRONMENT']))
+
+    # Environment-specific configuration
+    current_env = app.config['ENVIRONMENT']
+    frontend_url = get_frontend_url(current_env)
+
+    print(f"🌍 Environment: {current_env}")
+    print(f"🌐 Frontend URL: {frontend_url}")
+
+    # Allow OAuth over HTTP ONLY for local development
+    if current_env == 'local':
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        print("🔓 OAuth over HTTP enabled for local development")
+
+    # Enable CORS for React frontend (environment-aware)
+    cors_origins = [frontend_url]
+    if current_env == 'local':
+        # Allow both localhost variations for local development
+        cors_origins.extend(['http://localhost:3000', 'http://127.0.0.1:3000'])
+
+    CORS(app, origins=cors_origins, supports_credentials=True)
+    print(f"🌐 CORS enabled for: {cors_origins}")
+
+    # Initialize extensions
+    db.init_app(app)
+    mail.init_app(app)
+    jwt.init_app(app)
+    calculation_writer.init_app(app)
+
+    # N+1 / slow-query / query-budget checks (off unless QUERY_INSPECTOR=log|raise)
+    query_inspector.init_app(app)
+
+    # Request latency/DB histograms and component stats at /api/metrics
+    request_metrics.init_app(app)
+    request_metrics.add_stats_source('db_pool', lambda: pool_stats(db.engine),
+                                     counters={'checkouts', 'checkout_timeouts', 'checkout_wait_total_ms'})
+    request_metrics.add_stats_source('identity_cache', identity_cache.stats,
+                                     counters={'hits', 'misses', 'evictions', 'invalidations'})
+    request_metrics.add_stats_source('calculation_writer', calculation_writer.stats,
+                                     counters={'written', 'synchronous_writes', 'failed_flushes', 'dropped'})
+
+    login_manager.init_app(app)
+    google_bp.redirect_url = get_oauth_redirect_url(current_env)
+    app.register_blueprint(google_bp, url_prefix='/auth')
+    routes.register(app)
+
+    # Loaded and encoded once at startup (see content.py / data/content.json)
+    app.extensions['static_content'] = load_static_content()
+
+    # Serve the React export if it was built (frontend/out)
+    react_build_path = app.config['FRONTEND_BUILD_PATH']
+    if os.path.exists(react_build_path):
+        # Index every file of the export once (ETags + precompressed variants)
+        asset_index = app.extensions['asset_index'] = AssetIndex(react_build_path)
+        print(f"📦 Indexed {len(asset_index.assets)} frontend assets ({asset_index.total_bytes / 1024:.0f} KB in memory)")
+
+        # Catch-all for React pages - API routes are more specific, so they still win
+        app.add_url_rule('/', 'serve_react', serve_react, defaults={'path': ''})
+        app.add_url_rule('/<path:path>', 'serve_react', serve_react)
+
+    return app
+
+def create_user_token(user):
+
+    """Access token carrying the user's admin flag and role version as claims"""
+    return create_access_token(identity=user.id, additional_claims=user_claims(user))
 
 # ===================== GOOGLE OAUTH CALLBACK =====================
 
@@ -172,7 +252,7 @@ def google_logged_in(blueprint, token):
         print(f"Google OAuth error: {e}")
         return False
 
-@app.route('/auth/google/success')
+@routes.route('/auth/google/success')
 def google_success():
     """Redirect endpoint after successful OAuth"""
     user_id = session.get('oauth_user_id')
@@ -193,8 +273,12 @@ def google_success():
     # Clear the session
     session.pop('oauth_user_id', None)
     
+    user = db.session.get(User, user_id)
+    if not user:
+        return redirect('/login?error=oauth_failed')
+    
     # Create access token
-    access_token = create_access_token(identity=user_id)
+    access_token = create_user_token(user)
     
     # Create a Flask response with the token as a cookie and redirect
     response = make_response(f'''
@@ -218,7 +302,7 @@ def google_success():
         'access_token', 
         access_token, 
         max_age=86400,  # 1 day
-        secure=(current_env != 'local'),  # True for HTTPS in staging/production
+        secure=(current_app.config['ENVIRONMENT'] != 'local'),  # True for HTTPS in staging/production
         httponly=False, # Allow JavaScript access
         samesite='Lax'
     )
@@ -228,13 +312,13 @@ def google_success():
 # ===================== API ROUTES =====================
 
 # Health check endpoint
-@app.route('/api/health')
+@routes.route('/api/health')
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Amsterdam API is running!'})
 
 # ===================== AUTHENTICATION API =====================
 
-@app.route('/api/auth/register', methods=['POST'])
+@routes.route('/api/auth/register', methods=['POST'])
 def api_register():
     try:
         data = request.get_json()
@@ -265,7 +349,7 @@ def api_register():
         db.session.commit()
         
         # Create access token immediately for local testing
-        access_token = create_access_token(identity=user.id)
+        access_token = create_user_token(user)
         
         return jsonify({
             'message': 'Registration successful!',
@@ -284,7 +368,7 @@ def api_register():
         print(f"Registration error: {e}")  # Debug output
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
 
-@app.route('/api/auth/verify-email', methods=['POST'])
+@routes.route('/api/auth/verify-email', methods=['POST'])
 def api_verify_email():
     try:
         data = request.get_json()
@@ -311,7 +395,7 @@ def api_verify_email():
         db.session.commit()
         
         # Create access token
-        access_token = create_access_token(identity=user.id)
+        access_token = create_user_token(user)
         
         return jsonify({
             'message': 'Email verified successfully!',
@@ -328,7 +412,7 @@ def api_verify_email():
     except Exception as e:
         return jsonify({'error': 'Verification failed'}), 500
 
-@app.route('/api/auth/login', methods=['POST'])
+@routes.route('/api/auth/login', methods=['POST'])
 def api_login():
     try:
         data = request.get_json()
@@ -343,12 +427,17 @@ def api_login():
         if not user or not user.check_password(password):
             return jsonify({'error': 'Invalid email or password'}), 401
         
+        # Transparently upgrade hashes stored with outdated parameters
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
+        
         # For local development, skip email verification check
         # if not user.email_verified:
         #     return jsonify({'error': 'Please verify your email first'}), 401
         
         # Create access token
-        access_token = create_access_token(identity=user.id)
+        access_token = create_user_token(user)
         
         return jsonify({
             'message': 'Login successful',
@@ -369,17 +458,18 @@ def api_login():
 
 
 
-@app.route('/api/auth/logout', methods=['POST'])
+@routes.route('/api/auth/logout', methods=['POST'])
 @jwt_required()
 def api_logout():
     # With JWT, logout is handled client-side by removing the token
     return jsonify({'message': 'Logout successful'}), 200
 
-@app.route('/api/auth/profile')
+@routes.route('/api/auth/profile')
 @jwt_required()
+@query_budget(2)
 def api_profile():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = identity_cache.get(user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -394,14 +484,35 @@ def api_profile():
             'is_admin': user.is_admin,
             'profile_picture': user.profile_picture,
             'email_verified': user.email_verified,
-            'calculations_count': len(user.calculations)
+            'calculations_count': get_user_calculation_count(user.id)
         }
     }), 200
 
 # ===================== CALCULATOR API =====================
 
-@app.route('/api/calculator', methods=['POST'])
+def perform_calculation(num1, num2, operation):
+    """
+    Evaluate one `num1 operation num2`
+    
+    Returns (result, error) - exactly one of them is None.
+    Shared by the single and batch calculator endpoints.
+    """
+    if operation == '+':
+        return num1 + num2, None
+    elif operation == '-':
+        return num1 - num2, None
+    elif operation == '*':
+        return num1 * num2, None
+    elif operation == '/':
+        if num2 == 0:
+            return None, 'Cannot divide by zero'
+        return num1 / num2, None
+    else:
+        return None, 'Invalid operation'
+
+@routes.route('/api/calculator', methods=['POST'])
 @jwt_required()
+@query_budget(4)  # +1: identity cache miss for the usage cohort, once per IDENTITY_CACHE_TTL
 def api_calculator():
     try:
         user_id = get_jwt_identity()
@@ -412,93 +523,374 @@ def api_calculator():
         operation = data.get('operation', '+')
         
         # Perform calculation
-        if operation == '+':
-            result = num1 + num2
-        elif operation == '-':
-            result = num1 - num2
-        elif operation == '*':
-            result = num1 * num2
-        elif operation == '/':
-            if num2 == 0:
-                return jsonify({'error': 'Cannot divide by zero'}), 400
-            result = num1 / num2
-        else:
-            return jsonify({'error': 'Invalid operation'}), 400
-        
-        # Save calculation to database
-        calculation = Calculation(
-            user_id=user_id,
-            number1=num1,
-            number2=num2,
-            operation=operation,
-            result=result
+        result, error = perform_calculation(num1, num2, operation)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # Save calculation to database (buffered mode may defer the write -
+        # clients that need calculation_id send "return_id": true)
+        saved = calculation_writer.save(
+            user_id, num1, num2, operation, result,
+            need_id=bool(data.get('return_id'))
         )
-        db.session.add(calculation)
-        db.session.commit()
         
         return jsonify({
             'result': result,
             'expression': f"{num1} {operation} {num2} = {result}",
-            'calculation_id': calculation.id,
-            'timestamp': calculation.calculated_at.isoformat()
+            'calculation_id': saved['id'],
+            'timestamp': saved['calculated_at']
         }), 200
         
     except ValueError:
         return jsonify({'error': 'Invalid number format'}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': 'Calculation failed'}), 500
 
-@app.route('/api/calculator/history')
+CALCULATOR_BATCH_MAX_SIZE = int(os.environ.get('CALCULATOR_BATCH_MAX_SIZE', 1000))
+
+def insert_calculations(rows):
+    """
+    Insert rows with one statement and return their ids in row order
+    
+    Why RETURNING without sort_by_parameter_order?
+    - Ordered RETURNING needs a sentinel column to be batched; with the
+      plain autoincrement id SQLAlchemy falls back to one INSERT per row
+    - Unordered, insertmanyvalues sends the rows as one multi-row
+      INSERT ... RETURNING (per 1000 rows) on SQLite and PostgreSQL
+    - RETURNING only reports the rows this statement inserted, so another
+      batch saved in the same instant can't hand us its ids
+    
+    Ids are matched to rows by their values; rows with equal values are
+    interchangeable.
+    """
+    saved = db.session.execute(
+        db.insert(Calculation).returning(
+            Calculation.id, Calculation.number1, Calculation.operation, Calculation.number2
+        ),
+        rows
+    )
+    ids = {}
+    for calculation_id, number1, operation, number2 in saved:
+        ids.setdefault((number1, operation, number2), []).append(calculation_id)
+    for same_values in ids.values():
+        same_values.sort(reverse=True)  # pop() hands them out oldest first
+    return [ids[(row['number1'], row['operation'], row['number2'])].pop() for row in rows]
+
+@routes.route('/api/calculator/batch', methods=['POST'])
+@jwt_required()
+@query_budget(4)  # INSERT ... RETURNING, counters, usage; +1 identity cache miss once per IDENTITY_CACHE_TTL
+def api_calculator_batch():
+    """
+    Evaluate and save many calculations in one request
+    
+    Body:
+    - num1: list of numbers
+    - num2: list of numbers (same length as num1)
+    - operation: list of operations, or one operation for every element
+    
+    Every element gets its own entry in `results`, either a result or an
+    error (e.g. divide by zero). Successful elements are saved with one
+    bulk INSERT and a single commit.
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        
+        numbers1 = data.get('num1')
+        numbers2 = data.get('num2')
+        operations = data.get('operation', '+')
+        
+        if not isinstance(numbers1, list) or not isinstance(numbers2, list):
+            return jsonify({'error': 'num1 and num2 must be lists'}), 400
+        if isinstance(operations, str):
+            operations = [operations] * len(numbers1)
+        if not isinstance(operations, list):
+            return jsonify({'error': 'operation must be a string or a list'}), 400
+        if not len(numbers1) == len(numbers2) == len(operations):
+            return jsonify({'error': 'num1, num2 and operation must have the same length'}), 400
+        if len(numbers1) > CALCULATOR_BATCH_MAX_SIZE:
+            return jsonify({'error': f'Batch size is limited to {CALCULATOR_BATCH_MAX_SIZE} calculations'}), 400
+        
+        # Evaluate every element, collecting rows to insert and per-element errors
+        calculated_at = datetime.utcnow()
+        results = []
+        rows = []
+        for index, (raw1, raw2, operation) in enumerate(zip(numbers1, numbers2, operations)):
+            try:
+                num1 = float(raw1)
+                num2 = float(raw2)
+            except (TypeError, ValueError):
+                results.append({'index': index, 'error': 'Invalid number format'})
+                continue
+            
+            result, error = perform_calculation(num1, num2, operation)
+            if error:
+                results.append({'index': index, 'error': error})
+                continue
+            
+            results.append({
+                'index': index,
+                'result': result,
+                'expression': f"{num1} {operation} {num2} = {result}"
+            })
+            rows.append({
+                'user_id': user_id,
+                'number1': num1,
+                'number2': num2,
+                'operation': operation,
+                'result': result,
+                'calculated_at': calculated_at
+            })
+        
+        # One bulk INSERT ... RETURNING and one commit
+        if rows:
+            calculation_ids = insert_calculations(rows)
+            record_calculations(user_id, [row['operation'] for row in rows], calculated_at)
+            db.session.commit()
+            
+            saved = iter(calculation_ids)
+            for item in results:
+                if 'result' in item:
+                    item['calculation_id'] = next(saved)
+        
+        return jsonify({
+            'results': results,
+            'saved': len(rows),
+            'failed': len(results) - len(rows),
+            'timestamp': calculated_at
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Batch calculation failed'}), 500
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+def encode_history_cursor(calculated_at, calculation_id):
+    """
+    Encode the keyset position of the last row on a page
+
+    Why a keyset cursor instead of OFFSET?
+    - OFFSET makes the database walk every skipped row
+    - (calculated_at, id) is unique, so pages never overlap or skip rows
+    """
+    raw = f"{calculated_at.isoformat()}|{calculation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def encode_rollup_cursor(day=None, operation=None):
+    """Keyset position inside the daily rollups (None = start of the rollups)"""
+    raw = f"rollup|{day.isoformat()}|{operation}" if day else "rollup"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor):
+    """
+    Decode a cursor from encode_history_cursor / encode_rollup_cursor
+
+    Returns ('live', (calculated_at, id)) or ('rollup', (day, operation)
+    or None), raises ValueError if malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if raw == 'rollup':
+            return 'rollup', None
+        if raw.startswith('rollup|'):
+            _, day, operation = raw.split('|', 2)
+            return 'rollup', (date.fromisoformat(day), operation)
+        timestamp, calculation_id = raw.split('|')
+        return 'live', (datetime.fromisoformat(timestamp), int(calculation_id))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+@routes.route('/api/calculator/history')
 @jwt_required()
+@query_budget(3)
 def api_calculation_history():
+    """
+    Paginated calculation history, newest first
+
+    Query parameters:
+    - limit: page size (default 50, max 200)
+    - after: cursor from the previous page's next_cursor
+
+    The body is streamed row by row so memory stays flat
+    regardless of how large a page or a user's history is.
+
+    Calculations compacted by compact_calculations.py follow the live
+    rows as one item per day and operation (id null, `rollup` set).
+    """
     user_id = get_jwt_identity()
     
-    # Get user's calculations
-    calculations = Calculation.query.filter_by(user_id=user_id).order_by(Calculation.calculated_at.desc()).all()
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
     
-    calculations_data = []
-    for calc in calculations:
-        calculations_data.append({
-            'id': calc.id,
-            'expression': f"{calc.number1} {calc.operation} {calc.number2} = {calc.result}",
-            'result': calc.result,
-            'timestamp': calc.calculated_at.isoformat()
-        })
+    query = db.select(
+        Calculation.id,
+        Calculation.number1,
+        Calculation.number2,
+        Calculation.operation,
+        Calculation.result,
+        Calculation.calculated_at
+    ).where(Calculation.user_id == user_id)
+    rollup_query = rollup_history_query(user_id)
     
-    # Calculate statistics
-    total_calculations = len(calculations)
-    operations_count = {}
-    for calc in calculations:
-        operations_count[calc.operation] = operations_count.get(calc.operation, 0) + 1
+    section, position = 'live', None
+    after = request.args.get('after')
+    if after:
+        try:
+            section, position = decode_history_cursor(after)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    if section == 'live' and position:
+        after_timestamp, after_id = position
+        query = query.where(db.or_(
+            Calculation.calculated_at < after_timestamp,
+            db.and_(Calculation.calculated_at == after_timestamp, Calculation.id < after_id)
+        ))
+    if section == 'rollup' and position:
+        after_day, after_operation = position
+        rollup_query = rollup_query.where(db.or_(
+            CalculationRollup.day < after_day,
+            db.and_(CalculationRollup.day == after_day, CalculationRollup.operation < after_operation)
+        ))
     
-    return jsonify({
-        'calculations': calculations_data,
-        'statistics': {
-            'total': total_calculations,
-            'operations': operations_count
-        }
-    }), 200
+    # Fetch one extra row to know whether another page exists
+    query = query.order_by(Calculation.calculated_at.desc(), Calculation.id.desc()).limit(limit + 1)
+    
+    # Statistics come from the incrementally maintained counters
+    # (they include compacted calculations)
+    statistics = get_user_statistics(user_id)
+    
+    def generate():
+        yield '{"calculations":['
+        written = 0
+        next_cursor = None
+        
+        if section == 'live':
+            last = None
+            rows = db.session.execute(query.execution_options(yield_per=HISTORY_PAGE_SIZE))
+            for calc in rows:
+                if written == limit:
+                    next_cursor = encode_history_cursor(last.calculated_at, last.id)
+                    break
+                item = {
+                    'id': calc.id,
+                    'expression': f"{calc.number1} {calc.operation} {calc.number2} = {calc.result}",
+                    'result': calc.result,
+                    'timestamp': calc.calculated_at
+                }
+                yield (',' if written else '') + current_app.json.dumps(item)
+                written += 1
+                last = calc
+        
+        # Live rows ran out on this page: continue with the daily rollups
+        if next_cursor is None:
+            last = None
+            rows = db.session.execute(rollup_query.limit(limit - written + 1))
+            for rollup in rows:
+                if written == limit:
+                    next_cursor = encode_rollup_cursor(last.day, last.operation) if last else encode_rollup_cursor()
+                    break
+                item = {
+                    'id': None,
+                    'expression': f"{rollup.count} × {rollup.operation} on {rollup.day.isoformat()}",
+                    'result': None,
+                    'timestamp': datetime.combine(rollup.day, datetime.min.time()),
+                    'rollup': {
+                        'day': rollup.day.isoformat(),
+                        'operation': rollup.operation,
+                        'count': rollup.count,
+                        'result_sum': rollup.result_sum
+                    }
+                }
+                yield (',' if written else '') + current_app.json.dumps(item)
+                written += 1
+                last = rollup
+        
+        yield '],' + current_app.json.dumps({
+            'statistics': statistics,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })[1:]
+    
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
 
 # ===================== ADMIN API =====================
 
 def admin_required(f):
+    """
+    Protect admin-only API routes using the token's claims
+    
+    No database query per request:
+    - is_admin comes from the JWT claims set at login
+    - role_version is compared against the in-memory registry, so
+      tokens issued before a role change are rejected
+    """
     @wraps(f)
     @jwt_required()
     def decorated_function(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or user.role != 'admin':
+        claims = get_jwt()
+        if not claims_are_current(get_jwt_identity(), claims):
+            return jsonify({'error': 'Your permissions changed, please log in again'}), 401
+        if not claims.get('is_admin'):
             return jsonify({'error': 'Admin access required'}), 403
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/api/admin/users')
+ADMIN_USERS_PAGE_SIZE = 50
+ADMIN_USERS_MAX_PAGE_SIZE = 200
+
+@routes.route('/api/admin/users')
 @admin_required
+@query_budget(3)
 def api_admin_users():
-    users = User.query.all()
-    users_data = []
+    """
+    Paginated, sortable user listing for admins
+    
+    Query parameters:
+    - page: 1-based page number (default 1)
+    - per_page: page size (default 50, max 200)
+    - sort: created_at | email | calculations_count (default created_at)
+    - order: asc | desc (default desc)
+    
+    Calculation counts come from one grouped subquery joined onto the
+    page of users, so the number of queries does not grow with users.
+    """
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = int(request.args.get('per_page', ADMIN_USERS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+    per_page = max(1, min(per_page, ADMIN_USERS_MAX_PAGE_SIZE))
+    
+    # One row per user with their total number of calculations
+    users, calculations_count = users_with_calculation_counts()
+    
+    sort_columns = {
+        'created_at': User.created_at,
+        'email': User.email,
+        'calculations_count': calculations_count
+    }
+    sort = request.args.get('sort', 'created_at')
+    if sort not in sort_columns:
+        return jsonify({'error': f"sort must be one of: {', '.join(sort_columns)}"}), 400
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    
+    sort_column = sort_columns[sort]
+    sort_column = sort_column.desc() if order == 'desc' else sort_column.asc()
     
-    for user in users:
+    rows = db.session.execute(
+        users.order_by(sort_column, User.id).offset((page - 1) * per_page).limit(per_page)
+    ).all()
+    
+    users_data = []
+    for user, count in rows:
         users_data.append({
             'id': user.id,
             'email': user.email,
@@ -508,137 +900,141 @@ def api_admin_users():
             'is_admin': user.is_admin,
             'email_verified': user.email_verified,
             'google_id': user.google_id,
-            'calculations_count': len(user.calculations),
-            'created_at': user.timestamp.isoformat() if hasattr(user, 'timestamp') else None
+            'calculations_count': int(count),
+            'created_at': user.created_at
         })
     
+    # COUNT(*) in the database - no user rows are loaded
+    total_users = db.session.query(db.func.count(User.id)).scalar()
+    
     return jsonify({
         'users': users_data,
-        'total_users': len(users_data)
+        'total_users': total_users,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total_users + per_page - 1) // per_page
     }), 200
 
-@app.route('/api/admin/stats')
+@routes.route('/api/admin/stats')
 @admin_required
+@query_budget(2)
 def api_admin_stats():
-    total_users = User.query.count()
-    total_calculations = Calculation.query.count()
-    verified_users = User.query.filter_by(email_verified=True).count()
-    google_users = User.query.filter(User.google_id.isnot(None)).count()
+    # One aggregate query, cached and shared between concurrent requests
+    stats = get_site_statistics()
     
     return jsonify({
-        'total_users': total_users,
-        'total_calculations': total_calculations,
-        'verified_users': verified_users,
-        'google_users': google_users
+        'total_users': stats['total_users'],
+        'total_calculations': stats['total_calculations'],
+        'verified_users': stats['verified_users'],
+        'google_users': stats['google_users'],
+        'admin_users': stats['admin_users']
     }), 200
 
+@routes.route('/api/admin/analytics/usage')
+@admin_required
+@query_budget(1)
+def api_admin_usage_analytics():
+    """
+    Calculations per hour or day, by operation and new vs returning users
+
+    Query parameters: granularity (hour|day), days (default 30) or
+    from/to. Reads the hourly usage_buckets pre-aggregate, never the
+    calculations table.
+    """
+    try:
+        return jsonify(usage_series_from_request()), 200
+    except UsageQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+@routes.route('/api/admin/identity-cache')
+@admin_required
+def api_admin_identity_cache():
+    # Hit/miss counters for this worker process, for sizing IDENTITY_CACHE_SIZE/TTL
+    return jsonify(identity_cache.stats()), 200
+
+@routes.route('/api/admin/db-pool')
+@admin_required
+def api_admin_db_pool():
+    # Checkout wait times and pool utilisation for this worker process
+    return jsonify(pool_stats(db.engine)), 200
+
+@routes.route('/api/admin/export/users')
+@admin_required
+def api_admin_export_users():
+    """Stream users as CSV or NDJSON (?format=, created_from=, created_to=)"""
+    try:
+        return stream_export('users', users_query(), export_format())
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+@routes.route('/api/admin/export/calculations')
+@admin_required
+def api_admin_export_calculations():
+    """Stream calculations as CSV or NDJSON (?format=, from=, to=, user_id=, email=, operation=)"""
+    try:
+        return stream_export('calculations', calculations_query(), export_format())
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
 # ===================== CONTENT API =====================
 
-@app.route('/api/content/history')
+@routes.route('/api/content/history')
 def api_history_content():
     # Static content for Amsterdam history
-    facts = [
-        {
-            'title': 'Canal Ring UNESCO World Heritage',
-            'content': 'Amsterdam\'s 17th-century canal ring was designated a UNESCO World Heritage Site in 2010, recognizing its outstanding universal value as an example of hydraulic engineering and urban planning.'
-        },
-        {
-            'title': 'Golden Age Architecture', 
-            'content': 'The narrow houses along the canals were built during the Dutch Golden Age (17th century). Their distinctive gabled facades were designed to maximize space on expensive canal-front property.'
-        },
-        {
-            'title': 'Venice of the North',
-            'content': 'Amsterdam has 165 canals with a total length of over 100 kilometers, more than Venice! The city has 1,281 bridges connecting its 90 islands.'
-        },
-        {
-            'title': 'Anne Frank House',
-            'content': 'The Anne Frank House, where Anne Frank hid during World War II, is one of Amsterdam\'s most visited museums, preserving an important piece of history from the darkest period of the 20th century.'
-        }
-    ]
-    
-    return jsonify({'facts': facts}), 200
+    return current_app.extensions['static_content']['history'].respond()
 
-@app.route('/api/content/water')
+@routes.route('/api/content/water')
 def api_water_content():
     # Static content for Amsterdam water life
-    content = {
-        'intro': 'Amsterdam\'s canals are home to a diverse ecosystem of aquatic life, despite being in an urban environment.',
-        'fish_species': [
-            {
-                'name': 'Pike (Snoek)',
-                'description': 'Large predatory fish commonly found in Amsterdam\'s larger canals and the Amstel river.'
-            },
-            {
-                'name': 'Perch (Baars)',
-                'description': 'A popular fish among local anglers, easily recognizable by its distinctive stripes.'
-            },
-            {
-                'name': 'Roach (Voorn)',
-                'description': 'One of the most common fish in Amsterdam\'s waterways, well-adapted to urban environments.'
-            },
-            {
-                'name': 'Bream (Brasem)',
-                'description': 'Large, deep-bodied fish that can be found in the deeper parts of the canal system.'
-            }
-        ],
-        'ecosystem_facts': [
-            'The canals are cleaned regularly to maintain water quality for both fish and urban use.',
-            'Many canals connect to the North Sea, allowing for some saltwater fish to enter the system.',
-            'Water quality has improved significantly over the past decades due to environmental efforts.',
-            'The canal system supports not just fish, but also birds, plants, and other aquatic life.'
-        ]
-    }
-    
-    return jsonify(content), 200
+    return current_app.extensions['static_content']['water'].respond()
 
 # ===================== ERROR HANDLERS =====================
 
-@app.errorhandler(404)
+@routes.errorhandler(404)
 def api_not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
-@app.errorhandler(500)
+@routes.errorhandler(500)
 def api_internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
-# ===================== APPLICATION STARTUP =====================
-
 # ===================== SERVE REACT APP IN PRODUCTION =====================
 
-import os
+def serve_react(path):
+    """Serve React app for all non-API routes (from the in-memory asset index)"""
+    asset_index = current_app.extensions['asset_index']
 
-# Check if we have a React build directory
-react_build_path = os.path.join(os.path.dirname(__file__), 'frontend', 'out')
-react_build_exists = os.path.exists(react_build_path)
-
-if react_build_exists:
-    # Serve React static files - MUST be registered LAST to not interfere with API routes
-    @app.route('/', defaults={'path': ''})
-    @app.route('/<path:path>')
-    def serve_react(path):
-        """Serve React app for all non-API routes"""
-        # List of path prefixes that should NOT be handled by React
-        # These are handled by Flask directly
-        flask_route_prefixes = ['api/', 'auth/']
-        
-        # Check if this path should be handled by Flask
-        for prefix in flask_route_prefixes:
-            if path.startswith(prefix):
-                # Return 404 to let Flask's error handler or other routes take over
-                abort(404)
-        
-        # Try to serve static files (JS, CSS, images, etc.)
-        if path and '.' in path:
-            if os.path.exists(os.path.join(react_build_path, path)):
-                return send_from_directory(react_build_path, path)
-            else:
-                # File not found
-                abort(404)
-        
-        # For all other routes, serve index.html (React client-side routing)
-        return send_from_directory(react_build_path, 'index.html')
+    # List of path prefixes that should NOT be handled by React
+    # These are handled by Flask directly
+    flask_route_prefixes = ['api/', 'auth/']
+    
+    # Check if this path should be handled by Flask
+    for prefix in flask_route_prefixes:
+        if path.startswith(prefix):
+            # Return 404 to let Flask's error handler or other routes take over
+            abort(404)
+    
+    # Try to serve static files (JS, CSS, images, etc.)
+    if path and '.' in path:
+        asset = asset_index.lookup(path)
+        if asset is None:
+            # File not found
+            abort(404)
+        return asset_index.respond(asset)
+    
+    # For all other routes, serve index.html (React client-side routing)
+    index = asset_index.lookup('index.html')
+    if index is None:
+        # Export without an index page
+        abort(404)
+    return asset_index.respond(index)
+
+# ===================== APPLICATION STARTUP =====================
+
+# The app gunicorn serves (`gunicorn api:app`) and scripts import
+app = create_app()
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        apply_migrations()
     app.run(debug=True, port=5001)
@@ -1,58 +1,148 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort, session
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, abort, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from flask_dance.contrib.google import make_google_blueprint, google
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin, SQLAlchemyStorage
 from functools import wraps
-from models import db, User, Calculation, ChatMessage, OAuthToken
+from models import db, User, Calculation, CalculationStat, ChatMessage, OAuthToken
+from calculation_writer import calculation_writer
+from email_dispatcher import email_dispatcher
+from stats import get_site_statistics, get_recent_activity, get_user_statistics
+from auth_claims import role_versions
+from identity_cache import identity_cache
+from migrate import apply_migrations
+from db_config import engine_options, pool_stats
+from http_client import PooledOAuth2Session, scope_session_per_request
+from metrics import request_metrics
+from query_inspector import query_inspector, query_budget
+from exports import ExportError, export_format, users_query, calculations_query, stream_export
+from rollups import rollup_history_query
+from usage import UsageQueryError, usage_series_from_request
+from routing import RouteTable
 import os
 import random
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
+# (before anything reads os.environ - several modules do at import time)
 load_dotenv()
 
 # Allow OAuth over HTTP for local development (NEVER in production!)
 import os
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-app = Flask(__name__)
+# ===== Extensions and routes (bound to an app by create_app below) =====
 
-# Database configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///amsterdam.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Saves memory
+routes = RouteTable()
+mail = Mail()  # Messages are delivered by background workers (email_dispatcher)
 
-# Email configuration for MFA
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USE_SSL'] = False
-app.config['MAIL_USERNAME'] = os.environ.get('GMAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.environ.get('GMAIL_APP_PASSWORD')
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('GMAIL_USERNAME')
-
-# Google OAuth Configuration
-app.config['GOOGLE_OAUTH_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
-app.config['GOOGLE_OAUTH_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
-
-# Debug: Check if environment variables are loading
-print(f"🔍 DEBUG: GOOGLE_CLIENT_ID = {app.config['GOOGLE_OAUTH_CLIENT_ID']}")
-print(f"🔍 DEBUG: GOOGLE_CLIENT_SECRET = {app.config['GOOGLE_OAUTH_CLIENT_SECRET']}")
+# Flask-Login
+login_manager = LoginManager()
+login_manager.login_view = 'login'  # Where to redirect when login required
+login_manager.login_message = 'Please log in to access this page.'
 
 # Create Google OAuth blueprint
+# (client id/secret are read from GOOGLE_OAUTH_CLIENT_ID/SECRET in app.config)
 google_bp = make_google_blueprint(
-    client_id=app.config['GOOGLE_OAUTH_CLIENT_ID'],
-    client_secret=app.config['GOOGLE_OAUTH_CLIENT_SECRET'],
     scope=['https://www.googleapis.com/auth/userinfo.profile', 
            'https://www.googleapis.com/auth/userinfo.email', 
-           'openid']
+           'openid'],
+    session_class=PooledOAuth2Session  # Shared keep-alive pool with timeouts
 )
-app.register_blueprint(google_bp, url_prefix='/auth')
+scope_session_per_request(google_bp)  # One OAuth session per request, not per worker
 
 # Set up Flask-Dance storage
-google_bp.storage = SQLAlchemyStorage(OAuthToken, db.session, user=current_user)
+# (current_user is a cached snapshot, so hand Flask-Dance the real User row)
+google_bp.storage = SQLAlchemyStorage(
+    OAuthToken, db.session,
+    user=lambda: db.session.get(User, current_user.id) if current_user.is_authenticated else None
+)
+
+def create_app(config=None):
+    """
+    Build the Flask app - `gunicorn app:app` serves the instance created
+    at the bottom of this module
+
+    Why a factory?
+    - Importing this module only declares routes and extensions; the app,
+      its database engine and the startup output are created here
+    - gunicorn can build it once in the master (preload_app) and fork
+      workers that share its memory; post_fork in gunicorn.conf.py
+      disposes the engine each worker inherits
+    - Scripts can build an app with their own settings:
+      create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///other.db'})
+    """
+    app = Flask(__name__)
+
+    # Database configuration
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///amsterdam.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Saves memory
+
+    # Email configuration for MFA
+    app.config['MAIL_SERVER'] = 'smtp.gmail.com'
+    app.config['MAIL_PORT'] = 587
+    app.config['MAIL_USE_TLS'] = True
+    app.config['MAIL_USE_SSL'] = False
+    app.config['MAIL_USERNAME'] = os.environ.get('GMAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.environ.get('GMAIL_APP_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('GMAIL_USERNAME')
+
+    # Google OAuth Configuration
+    app.config['GOOGLE_OAUTH_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
+    app.config['GOOGLE_OAUTH_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
+
+    # Production security settings
+    if os.environ.get('FLASK_ENV') == 'production':
+        app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only cookies
+        app.config['SESSION_COOKIE_HTTPONLY'] = True  # No JS access to cookies
+        app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection
+
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    # Debug: Check if environment variables are loading
+    print(f"🔍 DEBUG: GOOGLE_CLIENT_ID = {app.config['GOOGLE_OAUTH_CLIENT_ID']}")
+    print(f"🔍 DEBUG: GOOGLE_CLIENT_SECRET = {app.config['GOOGLE_OAUTH_CLIENT_SECRET']}")
+
+    # Initialize database with app
+    db.init_app(app)
+
+    # Initialize Flask-Mail (messages are delivered by background workers)
+    mail.init_app(app)
+    email_dispatcher.init_app(app, mail)
+
+    # Calculation persistence (strict or write-behind, see CALCULATION_DURABILITY)
+    calculation_writer.init_app(app)
+
+    # N+1 / slow-query / query-budget checks (off unless QUERY_INSPECTOR=log|raise)
+    query_inspector.init_app(app)
+
+    # Request latency/DB histograms and component stats at /api/metrics
+    request_metrics.init_app(app)
+    request_metrics.add_stats_source('db_pool', lambda: pool_stats(db.engine),
+                                     counters={'checkouts', 'checkout_timeouts', 'checkout_wait_total_ms'})
+    request_metrics.add_stats_source('identity_cache', identity_cache.stats,
+                                     counters={'hits', 'misses', 'evictions', 'invalidations'})
+    request_metrics.add_stats_source('calculation_writer', calculation_writer.stats,
+                                     counters={'written', 'synchronous_writes', 'failed_flushes', 'dropped'})
+    request_metrics.add_stats_source('email', email_dispatcher.stats,
+                                     counters={'queued', 'sent', 'failed', 'retried', 'rejected', 'connections_opened'})
+
+    login_manager.init_app(app)
+    app.register_blueprint(google_bp, url_prefix='/auth')
+    routes.register(app)
+
+    # Create database tables and missing indexes (runs once when app starts).
+    # gunicorn.conf.py runs migrate.py once before forking workers instead,
+    # so workers don't all hit the database while the app is built.
+    if os.environ.get('MIGRATE_ON_STARTUP', '1') == '1':
+        with app.app_context():
+            apply_migrations()
+            print("📊 Database tables created!")
+
+    return app
 
 # Flask-Dance OAuth event handlers
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin, SQLAlchemyStorage
@@ -133,35 +223,17 @@ def google_error(blueprint, message, response):
     print(f"❌ Google OAuth error: {message}")
     flash('Google login failed. Please try again.', 'error')
 
-# Production security settings
-if os.environ.get('FLASK_ENV') == 'production':
-    app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only cookies
-    app.config['SESSION_COOKIE_HTTPONLY'] = True  # No JS access to cookies
-    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection
-
-# Initialize database with app
-db.init_app(app)
-
-# Initialize Flask-Mail
-mail = Mail(app)
-
-# Initialize Flask-Login
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'  # Where to redirect when login required
-login_manager.login_message = 'Please log in to access this page.'
-
 @login_manager.user_loader
 def load_user(user_id):
     """
     Required by Flask-Login
     
     What it does:
-    - Loads user from database by ID
+    - Loads user by ID from the identity cache (database on a miss)
     - Called on every request to check if user is logged in
-    - Returns User object or None
+    - Returns a read-only UserSnapshot or None
     """
-    return db.session.get(User, user_id)
+    return identity_cache.get(user_id)
 
 # Admin protection decorator
 def admin_required(f):
@@ -170,17 +242,23 @@ def admin_required(f):
     
     How it works:
     1. @login_required: Must be logged in
-    2. Check if user.is_administrator()
-    3. If not admin: return 403 Forbidden
+    2. Check the admin flag on the user's database row
+    3. If not admin (or deleted): return 403 Forbidden
     4. If admin: continue to route
     
+    Why not current_user.is_administrator()?
+    - current_user is a cached snapshot; another worker may have demoted
+      or deleted the user since it was loaded
+    - One primary-key lookup, and only on admin routes
+    
     Usage: @admin_required above route function
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
             return redirect(url_for('login'))
-        if not current_user.is_administrator():
+        is_admin = db.session.scalar(db.select(User.is_admin).where(User.id == current_user.id))
+        if not is_admin:
             abort(403)  # Forbidden
         return f(*args, **kwargs)
     return decorated_function
@@ -204,6 +282,7 @@ def send_mfa_email(user_email, code):
     
     Security considerations:
     - Uses secure Gmail SMTP with app password
+    - Queued for background delivery (login doesn't wait on SMTP)
     - Clear expiry time (5 minutes)
     - Professional appearance
     - No sensitive info in email logs
@@ -229,8 +308,9 @@ Amsterdam Discovery Team
 This is an automated message. Please do not reply to this email.
             '''
         )
-        mail.send(msg)
-        print(f"📧 MFA code sent to {user_email}")
+        if not email_dispatcher.send(msg):
+            return False
+        print(f"📧 MFA code queued for {user_email}")
         return True
     except Exception as e:
         print(f"❌ Email sending failed: {e}")
@@ -269,7 +349,7 @@ def send_verification_email(user_email, code):
     - Development mode (prints code instead of sending email)
     """
     # Development mode - no email server configured
-    if not app.config.get('MAIL_USERNAME'):
+    if not current_app.config.get('MAIL_USERNAME'):
         print(f"\n📧 DEVELOPMENT MODE - Email Verification Code:")
         print(f"ℹ️ Email: {user_email}")
         print(f"🔑 Code: {code}")
@@ -299,8 +379,9 @@ Amsterdam Discovery Team
 This is an automated message. Please do not reply to this email.
             '''
         )
-        mail.send(msg)
-        print(f"📧 Verification email sent to {user_email}")
+        if not email_dispatcher.send(msg):
+            return False
+        print(f"📧 Verification email queued for {user_email}")
         return True
     except Exception as e:
         print(f"❌ Verification email failed: {e}")
@@ -327,24 +408,19 @@ def verify_email_code(user, provided_code):
     # Check if code matches (string comparison for security)
     return user.verification_code == provided_code.strip()
 
-# Create database tables (runs once when app starts)
-with app.app_context():
-    db.create_all()
-    print("📊 Database tables created!")
-
-@app.route("/")
+@routes.route("/")
 def home():
     return render_template("index.html")
 
-@app.route("/history")
+@routes.route("/history")
 def history():
     return render_template("history.html")
 
-@app.route("/water")
+@routes.route("/water")
 def water():
     return render_template("water.html")
 
-@app.route("/calculator", methods=["GET", "POST"])
+@routes.route("/calculator", methods=["GET", "POST"])
 def calculator():
     result = None
     error = None
@@ -374,19 +450,12 @@ def calculator():
             # NEW: Save calculation to database
             if result is not None:
                 try:
-                    # Create a new calculation record
-                    calculation = Calculation(
-                        user_id=current_user.id if current_user.is_authenticated else 'anonymous',
-                        number1=num1,
-                        number2=num2,
-                        operation=operation,
-                        result=result
+                    # Save the calculation (counters are updated in the same transaction)
+                    calculation_writer.save(
+                        current_user.id if current_user.is_authenticated else 'anonymous',
+                        num1, num2, operation, result
                     )
                     
-                    # Save to database
-                    db.session.add(calculation)
-                    db.session.commit()
-                    
                     print(f"📊 Saved calculation: {num1} {operation} {num2} = {result}")
                     
                 except Exception as e:
@@ -402,7 +471,7 @@ def calculator():
     return render_template("calculator.html", result=result, error=error)
 
 # NEW: Calculation history route
-@app.route("/calculation-history")
+@routes.route("/calculation-history")
 @login_required  # Must be logged in to see history
 def calculation_history():
     """
@@ -413,15 +482,18 @@ def calculation_history():
     try:
         # Get current user's calculations only, newest first
         calculations = Calculation.query.filter_by(user_id=current_user.id).order_by(Calculation.calculated_at.desc()).all()
+        # Older calculations were compacted into daily totals (compact_calculations.py)
+        rollups = db.session.execute(rollup_history_query(current_user.id)).all()
         
-        return render_template("calculation_history.html", calculations=calculations)
+        return render_template("calculation_history.html", calculations=calculations, rollups=rollups,
+                               statistics=get_user_statistics(current_user.id))
         
     except Exception as e:
         print(f"❌ Error loading calculation history: {e}")
-        return render_template("calculation_history.html", calculations=[], error="Could not load calculation history")
+        return render_template("calculation_history.html", calculations=[], rollups=[], error="Could not load calculation history")
 
 # NEW: Authentication routes
-@app.route("/register", methods=["GET", "POST"])
+@routes.route("/register", methods=["GET", "POST"])
 def register():
     """
     Two-step registration with email verification:
@@ -550,7 +622,7 @@ def register():
     
     return render_template("register.html")
 
-@app.route("/login", methods=["GET", "POST"])
+@routes.route("/login", methods=["GET", "POST"])
 def login():
     """
     Two-step authentication login:
@@ -581,6 +653,15 @@ def login():
             flash("Invalid email or password!", "error")
             return render_template("login.html")
         
+        # Transparently upgrade hashes stored with outdated parameters
+        if user.password_needs_rehash():
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except Exception as e:
+                print(f"❌ Password rehash failed for {user.email}: {e}")
+                db.session.rollback()
+        
         # Check if email is verified
         if not user.email_verified:
             flash("📧 Please verify your email address before logging in. Check your inbox for the verification code.", "error")
@@ -647,7 +728,7 @@ def login():
     
     return render_template("login.html")
 
-@app.route("/logout")
+@routes.route("/logout")
 @login_required
 def logout():
     """
@@ -661,7 +742,7 @@ def logout():
     flash("You have been logged out.", "info")
     return redirect(url_for("home"))
 
-@app.route("/settings/mfa", methods=["GET", "POST"])
+@routes.route("/settings/mfa", methods=["GET", "POST"])
 @login_required
 def mfa_settings():
     """
@@ -676,32 +757,38 @@ def mfa_settings():
         action = request.form.get("action")
         
         try:
+            # current_user is a read-only snapshot - load the row to update it
+            user = db.session.get(User, current_user.id)
+            
             if action == "enable":
-                current_user.mfa_enabled = True
+                user.mfa_enabled = True
                 db.session.commit()
                 flash("✅ Email verification enabled! You'll receive codes on your next login.", "success")
-                print(f"🔐 MFA enabled for {current_user.email}")
+                print(f"🔐 MFA enabled for {user.email}")
                 
             elif action == "disable":
-                current_user.mfa_enabled = False
+                user.mfa_enabled = False
                 # Clear any existing codes for security
-                current_user.last_mfa_code = None
-                current_user.mfa_code_expires = None
+                user.last_mfa_code = None
+                user.mfa_code_expires = None
                 db.session.commit()
                 flash("❌ Email verification disabled. You can re-enable it anytime.", "info")
-                print(f"🔓 MFA disabled for {current_user.email}")
+                print(f"🔓 MFA disabled for {user.email}")
                 
         except Exception as e:
             print(f"❌ MFA settings error: {e}")
             db.session.rollback()
             flash("Error updating MFA settings. Please try again.", "error")
+        
+        # Redirect so the page renders with the freshly loaded user
+        return redirect(url_for("mfa_settings"))
     
     return render_template("mfa_settings.html")
 
 # Google OAuth is now handled automatically by Flask-Dance event handlers above
 
 # NEW: Admin Dashboard Routes
-@app.route("/admin")
+@routes.route("/admin")
 @admin_required
 def admin_dashboard():
     """
@@ -713,19 +800,11 @@ def admin_dashboard():
     - Links to management tools
     """
     try:
-        # Get statistics
-        total_users = User.query.count()
-        total_calculations = Calculation.query.count()
-        admin_users = User.query.filter_by(is_admin=True).count()
-        recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
-        recent_calculations = Calculation.query.order_by(Calculation.calculated_at.desc()).limit(10).all()
-        
-        stats = {
-            'total_users': total_users,
-            'total_calculations': total_calculations,
-            'admin_users': admin_users,
-            'regular_users': total_users - admin_users
-        }
+        # Cached counters (one aggregate query) and recent activity
+        stats = get_site_statistics()
+        recent = get_recent_activity()
+        recent_users = recent['recent_users']
+        recent_calculations = recent['recent_calculations']
         
         return render_template("admin/dashboard.html", 
                              stats=stats, 
@@ -737,8 +816,19 @@ def admin_dashboard():
         flash("Error loading admin dashboard.", "error")
         return redirect(url_for("home"))
 
-@app.route("/admin/users")
+@routes.route("/admin/analytics/usage")
 @admin_required
+@query_budget(3)  # usage query, admin check on the user row; +1 identity cache miss once per IDENTITY_CACHE_TTL
+def admin_usage_analytics():
+    """Usage time series as JSON for the dashboard chart (same as /api/admin/analytics/usage)"""
+    try:
+        return usage_series_from_request()
+    except UsageQueryError as e:
+        return {'error': str(e)}, 400
+
+@routes.route("/admin/users")
+@admin_required
+@query_budget(4)  # +1 admin check on the user row, +1 identity cache miss once per IDENTITY_CACHE_TTL
 def admin_users():
     """
     User management page
@@ -750,14 +840,37 @@ def admin_users():
     """
     try:
         users = User.query.order_by(User.created_at.desc()).all()
-        return render_template("admin/users.html", users=users)
+        # One grouped query instead of loading every user's calculations
+        calculation_counts = dict(db.session.execute(
+            db.select(CalculationStat.user_id, db.func.sum(CalculationStat.count))
+            .group_by(CalculationStat.user_id)
+        ).all())
+        return render_template("admin/users.html", users=users, calculation_counts=calculation_counts)
     
     except Exception as e:
         print(f"❌ Admin users error: {e}")
         flash("Error loading users.", "error")
         return redirect(url_for("admin_dashboard"))
 
-@app.route("/admin/users/<user_id>/delete", methods=["POST"])
+@routes.route("/admin/export/<kind>")
+@admin_required
+def admin_export(kind):
+    """
+    Download users or calculations as CSV / NDJSON
+    
+    Streamed straight from the database (see exports.py), so even the
+    full calculations table never sits in the worker's memory.
+    """
+    queries = {'users': users_query, 'calculations': calculations_query}
+    if kind not in queries:
+        abort(404)
+    try:
+        return stream_export(kind, queries[kind](), export_format())
+    except ExportError as e:
+        flash(str(e), "error")
+        return redirect(url_for("admin_users"))
+
+@routes.route("/admin/users/<user_id>/delete", methods=["POST"])
 @admin_required
 def admin_delete_user(user_id):
     """
@@ -778,6 +891,7 @@ def admin_delete_user(user_id):
             return redirect(url_for("admin_users"))
         
         user_email = user.email  # Store for flash message
+        role_versions.bump(user.id)  # Revokes the deleted user's API tokens
         db.session.delete(user)
         db.session.commit()
         
@@ -791,7 +905,7 @@ def admin_delete_user(user_id):
     
     return redirect(url_for("admin_users"))
 
-@app.route("/admin/users/<user_id>/toggle-admin", methods=["POST"])
+@routes.route("/admin/users/<user_id>/toggle-admin", methods=["POST"])
 @admin_required
 def admin_toggle_admin(user_id):
     """
@@ -810,6 +924,7 @@ def admin_toggle_admin(user_id):
             return redirect(url_for("admin_users"))
         
         user.is_admin = not user.is_admin
+        role_versions.bump(user.id)  # Invalidates API tokens issued with the old role
         db.session.commit()
         
         status = "promoted to admin" if user.is_admin else "removed from admin"
@@ -831,6 +946,9 @@ def admin_toggle_admin(user_id):
 # Database stats now available in admin dashboard
 # Debug functions removed for production security
 
+# The app gunicorn serves (`gunicorn app:app`) and scripts import
+app = create_app()
+
 if __name__ == "__main__":
     # Local development only - gunicorn handles production
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Claims-based authorization for JWT access tokens
+
+Tokens are issued with two extra claims:
+- is_admin: the user's admin flag when the token was created
+- role_version: the user's role version at that time
+
+Admin checks read these claims instead of loading the user. To make
+role changes take effect before tokens expire, role_versions keeps a
+version per user that is bumped on every admin toggle; tokens carrying
+an older version are rejected. The versions are held in memory and
+refreshed from the (small) role_versions table at most once every
+ROLE_VERSION_REFRESH seconds, so a request never needs its own query.
+
+A bump reaches the in-memory map only when its transaction commits: a
+rolled-back role change must not revoke tokens that are still valid.
+"""
+
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, RoleVersion
+
+ROLE_VERSION_REFRESH = float(os.environ.get('ROLE_VERSION_REFRESH', 30))
+
+# session.info key: role versions bumped in the current transaction
+BUMPED_ROLE_VERSIONS = 'auth_claims_bumped_role_versions'
+
+class RoleVersionRegistry:
+    """
+    In-memory map of user_id -> current role version
+
+    Changes made in this process are visible immediately; changes made
+    by other processes (other gunicorn workers, app.py vs api.py, the
+    create_admin.py script) within ROLE_VERSION_REFRESH seconds.
+    """
+
+    def __init__(self, refresh_interval=ROLE_VERSION_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._versions = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def current(self, user_id):
+        """Current role version for a user (0 if their role never changed)"""
+        if self._stale():
+            self.refresh(only_if_stale=True)
+        return self._versions.get(user_id, 0)
+
+    def _stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def refresh(self, only_if_stale=False):
+        """Reload every version with one query (needs an app context)"""
+        with self._lock:
+            if only_if_stale and not self._stale():
+                return  # Another thread reloaded while this one waited for the lock
+            # Periodic, not part of the request that triggers it (see query_inspector.py)
+            self._versions = dict(db.session.execute(
+                db.select(RoleVersion.user_id, RoleVersion.version)
+                .execution_options(query_budget_exempt=True)
+            ).all())
+            self._loaded_at = time.monotonic()
+
+    def bump(self, user_id):
+        """
+        Increment a user's role version (does NOT commit)
+
+        Call in the same transaction that changes the user's role; this
+        process applies the new version once that transaction commits.
+        Returns the new version.
+        """
+        role_version = db.session.get(RoleVersion, user_id)
+        if role_version is None:
+            role_version = RoleVersion(user_id=user_id, version=0)
+            db.session.add(role_version)
+        role_version.version += 1
+        db.session.info.setdefault(BUMPED_ROLE_VERSIONS, {})[user_id] = role_version.version
+        return role_version.version
+
+    def _apply(self, versions):
+        with self._lock:
+            for user_id, version in versions.items():
+                # A refresh may already have loaded this version (or a newer one)
+                self._versions[user_id] = max(version, self._versions.get(user_id, 0))
+
+role_versions = RoleVersionRegistry()
+
+@event.listens_for(Session, 'after_commit')
+def _apply_bumps_after_commit(session):
+    bumped = session.info.pop(BUMPED_ROLE_VERSIONS, None)
+    if bumped:
+        role_versions._apply(bumped)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_bumps_after_rollback(session):
+    session.info.pop(BUMPED_ROLE_VERSIONS, None)
+
+def user_claims(user):
+    """Extra JWT claims for a user's access token"""
+    return {
+        'is_admin': bool(user.is_admin),
+        'role_version': role_versions.current(user.id)
+    }
+
+def claims_are_current(user_id, claims):
+    """False if the token was issued before the user's last role change"""
+    return claims.get('role_version', 0) >= role_versions.current(user_id)
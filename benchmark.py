@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+In-process microbenchmarks for single components of the API
+
+loadtest.py measures the whole server end to end; these isolate one
+component (Flask test client, no sockets, no workers) so a change to it
+can be compared before/after with little noise.
+
+Usage:
+1. python benchmark.py assets                  # frontend export: 200 (gzip) and 304
+2. python benchmark.py assets --size 262144 --iterations 5000
+3. python benchmark.py json                    # JSON providers on 200-row pages
+
+Every scenario prints a JSON report (mean microseconds per call) and
+includes a baseline implementation where one exists, so a single run
+shows the difference.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# ===================== HELPERS =====================
+
+def timed(call, iterations, warmup=50):
+    """Mean microseconds per call"""
+    for _ in range(warmup):
+        call()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return round((time.perf_counter() - started) / iterations * 1e6, 1)
+
+def build_api_app(workdir, **config):
+    """api.create_app() on a throwaway SQLite database (startup output goes to stderr)"""
+    database_url = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['MIGRATE_ON_STARTUP'] = '0'
+    with contextlib.redirect_stdout(sys.stderr):  # Keep stdout for the JSON report
+        from api import create_app
+        from migrate import apply_migrations
+        app = create_app(dict(config, SQLALCHEMY_DATABASE_URI=database_url))
+        with app.app_context():
+            apply_migrations()
+    return app
+
+# ===================== SCENARIOS =====================
+
+def benchmark_assets(args, workdir):
+    """One hashed JS chunk of the Next.js export: gzip-accepting GET and conditional GET"""
+    from flask import abort, send_from_directory
+
+    export = os.path.join(workdir, 'out')
+    chunks = os.path.join(export, '_next', 'static', 'chunks')
+    os.makedirs(chunks)
+    rng = random.Random(args.seed)
+    with open(os.path.join(chunks, 'main-abc123.js'), 'w') as f:
+        written = 0
+        while written < args.size:  # Minified-looking code: compressible, but not trivially
+            line = f"function f{rng.randrange(10 ** 6)}(a,b){{return a*{rng.randrange(1000)}+b}}\n"
+            written += f.write(line)
+    url = '/_next/static/chunks/main-abc123.js'
+
+    app = build_api_app(workdir, FRONTEND_BUILD_PATH=export)
+
+    # What serve_react did before the asset index (a filesystem hit per request),
+    # on the same app so both pay for the same request hooks
+    def serve_from_disk(path):
+        if os.path.exists(os.path.join(export, path)):
+            return send_from_directory(export, path)
+        abort(404)
+
+    app.add_url_rule('/baseline/<path:path>', 'baseline', serve_from_disk)
+    client = app.test_client()
+    urls = {'send_from_directory': '/baseline' + url, 'asset_index': url}
+
+    report = {}
+    for name, url in urls.items():
+        first = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        etag = first.headers['ETag']
+        report[name] = {
+            'ok_us': timed(lambda: client.get(url, headers={'Accept-Encoding': 'gzip'}), args.iterations),
+            'ok_bytes': len(first.data),
+            'not_modified_us': timed(lambda: client.get(url, headers={'If-None-Match': etag}), args.iterations),
+        }
+    return report
+
+def benchmark_json(args, workdir):
+    """provider.response() for a history page and an admin users page of --rows rows"""
+    import uuid
+    from datetime import datetime, timedelta
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import OrjsonProvider, StdlibJSONProvider, orjson
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    pages = {
+        'history page': {'calculations': [
+            {'id': n, 'number1': rng.random() * 1000, 'number2': rng.random() * 1000, 'operation': rng.choice('+-*/'),
+             'result': rng.random() * 10 ** 6, 'calculated_at': now - timedelta(seconds=n)}
+            for n in range(args.rows)
+        ], 'next_cursor': 'MjAyNS0wMy0xNFQxNTowOToyNnwxMjA='},
+        'admin users page': {'users': [
+            {'id': str(uuid.UUID(int=rng.getrandbits(128))), 'email': f'user{n}@example.com',
+             'first_name': 'Anna', 'last_name': 'de Vries', 'user_age': rng.randint(16, 80), 'is_admin': False,
+             'created_at': now - timedelta(days=n), 'calculation_count': rng.randint(0, 500)}
+            for n in range(args.rows)
+        ], 'page': 1, 'pages': 10, 'total': args.rows * 10},
+    }
+
+    def isoformatted(value):
+        # What handlers did for Flask's default provider: .isoformat() per row
+        if isinstance(value, dict):
+            return {key: isoformatted(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [isoformatted(item) for item in value]
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    app = Flask('benchmark')
+    providers = {
+        'flask_default_isoformat': (DefaultJSONProvider(app), isoformatted),
+        'stdlib': (StdlibJSONProvider(app), None),
+    }
+    if orjson is not None:
+        providers['orjson'] = (OrjsonProvider(app), None)
+
+    report = {}
+    with app.app_context():
+        for page_name, page in pages.items():
+            report[page_name] = {
+                name: timed(lambda: provider.response(prepare(page) if prepare else page), args.iterations)
+                for name, (provider, prepare) in providers.items()
+            }
+    return report
+
+SCENARIOS = {
+    'assets': benchmark_assets,
+    'json': benchmark_json,
+}
+
+# ===================== MAIN =====================
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark API components and report as JSON')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=3000)
+    parser.add_argument('--size', type=int, default=66000, help='assets: bytes in the JS chunk')
+    parser.add_argument('--rows', type=int, default=200, help='json: rows per page')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        results = SCENARIOS[args.scenario](args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({'scenario': args.scenario, 'iterations': args.iterations, 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Calculation persistence with optional write-behind buffering
+
+Two durability modes, chosen with CALCULATION_DURABILITY:
+- strict (default): every calculation is committed before the response
+- buffered: calculations go into a bounded in-process queue and a
+  background thread inserts them in batches (by size or by time)
+
+Buffered mode trades a small window of possible loss (a hard crash
+before the next flush) for request latency that no longer waits on
+database fsync. The queue is flushed on shutdown.
+
+What if the database rejects a flush?
+- The batch is retried with backoff; if every attempt fails it stays
+  pending, ahead of anything buffered after it, and is retried until
+  it goes through
+- Meanwhile save() writes synchronously, like when the buffer is full,
+  so new calculations either commit or fail in front of the user
+- Rows are only lost if they are still pending when the process exits;
+  stats() counts them under 'dropped'
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from models import db, Calculation
+from stats import record_calculations
+
+logger = logging.getLogger(__name__)
+
+STRICT = 'strict'
+BUFFERED = 'buffered'
+
+class CalculationWriter:
+    """
+    Saves calculations in strict or buffered mode
+
+    Usage:
+        calculation_writer.init_app(app)
+        saved = calculation_writer.save(user_id, num1, num2, operation, result)
+    """
+
+    def __init__(self):
+        self.app = None
+        self.mode = STRICT
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.max_retries = 3
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._write_lock = threading.Lock()  # Held while writing a batch; guards _pending
+        self._pending = []  # Batch whose flush failed, written before anything newer
+        self._metrics = {'written': 0, 'synchronous_writes': 0, 'failed_flushes': 0, 'dropped': 0}
+
+    def init_app(self, app):
+        """Read durability settings from app.config and register the shutdown flush"""
+        app.config.setdefault('CALCULATION_DURABILITY', os.environ.get('CALCULATION_DURABILITY', STRICT))
+        app.config.setdefault('CALCULATION_BUFFER_SIZE', int(os.environ.get('CALCULATION_BUFFER_SIZE', 10000)))
+        app.config.setdefault('CALCULATION_FLUSH_BATCH_SIZE', int(os.environ.get('CALCULATION_FLUSH_BATCH_SIZE', 500)))
+        app.config.setdefault('CALCULATION_FLUSH_INTERVAL', float(os.environ.get('CALCULATION_FLUSH_INTERVAL', 1.0)))
+
+        mode = app.config['CALCULATION_DURABILITY']
+        if mode not in (STRICT, BUFFERED):
+            raise ValueError(f"CALCULATION_DURABILITY must be '{STRICT}' or '{BUFFERED}', got {mode!r}")
+
+        self.app = app
+        self.mode = mode
+        self.batch_size = app.config['CALCULATION_FLUSH_BATCH_SIZE']
+        self.flush_interval = app.config['CALCULATION_FLUSH_INTERVAL']
+        self._queue = queue.Queue(maxsize=app.config['CALCULATION_BUFFER_SIZE'])
+        atexit.register(self.shutdown)
+
+    @property
+    def buffered(self):
+        return self.mode == BUFFERED
+
+    def save(self, user_id, num1, num2, operation, result, need_id=False):
+        """
+        Persist one calculation
+
+        Returns {'id': int or None, 'calculated_at': datetime}.
+        The id is None only in buffered mode - pass need_id=True to
+        write this calculation synchronously and get a stable id back.
+        If the buffer is full, or a failed flush is waiting to be
+        retried, the calculation is also written synchronously, so
+        nothing is dropped under load or while the database is failing.
+        """
+        calculated_at = datetime.utcnow()
+        row = {
+            'user_id': user_id,
+            'number1': num1,
+            'number2': num2,
+            'operation': operation,
+            'result': result,
+            'calculated_at': calculated_at
+        }
+
+        if self.buffered and not need_id:
+            self._ensure_flusher()
+            if self._pending:
+                logger.warning("Calculation flush failing - writing synchronously")
+            else:
+                try:
+                    self._queue.put_nowait(row)
+                    return {'id': None, 'calculated_at': calculated_at}
+                except queue.Full:
+                    logger.warning("Calculation buffer full - writing synchronously")
+            with self._lock:
+                self._metrics['synchronous_writes'] += 1
+
+        calculation = Calculation(**row)
+        db.session.add(calculation)
+        record_calculations(user_id, [operation], calculated_at)
+        calculation_id = calculation.id  # Flushed above; reading it after commit would reload the row
+        db.session.commit()
+        return {'id': calculation_id, 'calculated_at': calculated_at}
+
+    def flush(self):
+        """
+        Write everything currently buffered (blocks until done)
+
+        Returns False if a batch could not be written; it stays pending.
+        """
+        if self._queue is None:
+            return True
+        while True:
+            with self._write_lock:
+                if not self._pending:
+                    self._pending = self._drain(self.batch_size)
+                if not self._pending:
+                    return True
+                if not self._write_pending():
+                    return False
+
+    def shutdown(self):
+        """Stop the flusher thread and write whatever is left in the buffer"""
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval * 2)
+        if not self.flush():
+            lost = len(self._pending) + self._queue.qsize()
+            with self._lock:
+                self._metrics['dropped'] += lost
+            logger.error(f"Lost {lost} buffered calculations: the database rejected the final flush")
+
+    def stats(self):
+        """Write counters plus the current buffer depth"""
+        with self._lock:
+            snapshot = dict(self._metrics)
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue else 0
+        snapshot['pending'] = len(self._pending)
+        return snapshot
+
+    # ----- internals -----
+
+    def _ensure_flusher(self):
+        """
+        Start the background flusher in this process if it isn't running
+
+        Threads do not survive fork(), so a gunicorn worker that inherited
+        a writer from the master starts its own flusher on first use.
+        """
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='calculation-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Flusher loop: write a batch when it is full or flush_interval has passed"""
+        while not self._stopping.is_set():
+            with self._write_lock:
+                if self._pending and not self._write_pending():
+                    self._stopping.wait(self.flush_interval)  # Still failing, try again later
+                    continue
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                with self._write_lock:
+                    self._pending = batch
+                    self._write_pending()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_pending(self):
+        """
+        Insert the pending batch and its counter updates in one transaction,
+        retrying with backoff (caller holds _write_lock)
+
+        Returns True once written; on failure the batch stays pending.
+        """
+        batch = self._pending
+        # One counter update per user and hour (usage buckets are hourly)
+        operations_by_user = {}
+        for row in batch:
+            hour = row['calculated_at'].replace(minute=0, second=0, microsecond=0)
+            operations_by_user.setdefault((row['user_id'], hour), []).append(row['operation'])
+
+        for attempt in range(1, self.max_retries + 1):
+            with self.app.app_context():
+                try:
+                    db.session.execute(db.insert(Calculation), batch)
+                    for (user_id, hour), operations in operations_by_user.items():
+                        record_calculations(user_id, operations, hour)
+                    db.session.commit()
+                    self._pending = []
+                    with self._lock:
+                        self._metrics['written'] += len(batch)
+                    return True
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"Calculation flush failed (attempt {attempt}/{self.max_retries}): {e}")
+            if attempt < self.max_retries:
+                time.sleep(0.1 * 2 ** attempt)
+
+        with self._lock:
+            self._metrics['failed_flushes'] += 1
+        logger.error(f"Kept {len(batch)} buffered calculations after {self.max_retries} failed attempts")
+        return False
+
+# Shared instance - call calculation_writer.init_app(app) once per app
+calculation_writer = CalculationWriter()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Roll old calculations up into daily totals and remove the raw rows
+
+Usage:
+1. python compact_calculations.py                  # older than CALCULATION_RETENTION_DAYS (90)
+2. python compact_calculations.py --days 30 --archive
+3. python compact_calculations.py --max-batches 10  # a bounded slice, e.g. from cron
+
+When to run:
+- Regularly (daily cron / scheduled job) to keep the calculations table small
+- Interrupting is safe: every batch commits on its own, just run it again
+
+See rollups.py for how batches stay idempotent.
+"""
+
+import argparse
+import os
+import sys
+
+def main():
+    from rollups import CALCULATION_RETENTION_DAYS, COMPACTION_BATCH_SIZE
+
+    parser = argparse.ArgumentParser(description='Compact old calculations into daily rollups')
+    parser.add_argument('--days', type=int, default=CALCULATION_RETENTION_DAYS,
+                        help='keep calculations from the last N days as individual rows')
+    parser.add_argument('--batch-size', type=int, default=COMPACTION_BATCH_SIZE, help='rows per transaction')
+    parser.add_argument('--max-batches', type=int, help='stop after N batches (resume on the next run)')
+    parser.add_argument('--archive', action='store_true', help='copy raw rows to calculations_archive first')
+    args = parser.parse_args()
+
+    os.environ['MIGRATE_ON_STARTUP'] = '0'  # Applied explicitly below
+    from app import app
+    from migrate import apply_migrations
+    from rollups import compact_calculations
+
+    with app.app_context():
+        try:
+            apply_migrations()
+            compacted = compact_calculations(args.days, args.batch_size, args.archive, args.max_batches)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            return False
+
+    print(f"✅ Compacted {compacted} calculations" + (" (archived)" if args.archive and compacted else ""))
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
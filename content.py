@@ -0,0 +1,60 @@
+"""
+Precomputed responses for the static content endpoints
+
+The history and water content never changes while the app is running,
+so it is loaded once from data/content.json at startup and encoded to
+bytes (plain and gzip) a single time. Each request then only compares
+ETags and returns ready-made bytes - no dict building, no JSON encoding.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from flask import Response, request
+
+CONTENT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'content.json')
+CONTENT_MAX_AGE = int(os.environ.get('CONTENT_MAX_AGE', 3600))
+
+class PrecomputedResponse:
+    """
+    A JSON payload encoded once, served many times
+
+    Why strong ETags per encoding?
+    - The gzip and plain bodies are different bytes, so each gets its own tag
+    - Browsers and CDNs send it back in If-None-Match and get a 304
+    """
+
+    def __init__(self, payload, max_age=CONTENT_MAX_AGE):
+        self.body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.cache_control = f'public, max-age={max_age}'
+
+    def respond(self):
+        """Build the response for the current request (200 or 304)"""
+        use_gzip = 'gzip' in request.accept_encodings
+        etag = self.gzip_etag if use_gzip else self.etag
+
+        headers = {
+            'ETag': etag,
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+
+        # Either representation's tag means the client already has this content
+        if request.if_none_match.contains_raw(self.etag) or request.if_none_match.contains_raw(self.gzip_etag):
+            return Response(status=304, headers=headers)
+
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            return Response(self.gzip_body, status=200, headers=headers, mimetype='application/json')
+        return Response(self.body, status=200, headers=headers, mimetype='application/json')
+
+def load_static_content(path=CONTENT_PATH):
+    """Load data/content.json and precompute a response per section ('history', 'water')"""
+    with open(path, encoding='utf-8') as f:
+        sections = json.load(f)
+    return {name: PrecomputedResponse(payload) for name, payload in sections.items()}
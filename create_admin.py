@@ -11,6 +11,7 @@ Usage:
 import os
 import sys
 from app import app, db, User
+from auth_claims import role_versions
 
 def create_first_admin(email):
     """
@@ -37,6 +38,7 @@ def create_first_admin(email):
             
             # Make them admin
             user.is_admin = True
+            role_versions.bump(user.id)  # Existing API tokens must pick up the new role
             db.session.commit()
             
             print(f"✅ {email} is now the first admin!")
@@ -0,0 +1,180 @@
+"""
+Database engine profiles and connection pool telemetry
+
+Both apps only set SQLALCHEMY_DATABASE_URI, which left PostgreSQL on the
+default pool (no pre-ping, no recycle) and SQLite in rollback-journal
+mode, where concurrent calculator writes fail with "database is locked".
+engine_options() returns SQLALCHEMY_ENGINE_OPTIONS for the database URL
+and the environment from get_environment():
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+PostgreSQL:
+- pool_size / max_overflow per environment (free Render databases allow
+  ~100 connections, shared by every gunicorn worker)
+- pool_pre_ping so connections dropped by the server are replaced
+- pool_recycle below the provider's idle timeout
+
+SQLite (file databases):
+- journal_mode=WAL so readers don't block the writer and vice versa
+- synchronous=NORMAL, which is durable in WAL mode and much faster
+- mmap_size to read the database through memory mapping
+- busy timeout so a writer waits for the lock instead of failing
+
+Every setting can be overridden with the DB_* environment variables below.
+Checkout wait times are recorded by InstrumentedQueuePool, and
+pool_stats(db.engine) reports them together with pool utilisation.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from environment import get_environment
+
+POSTGRES_PROFILES = {
+    'local':      {'pool_size': 5,  'max_overflow': 5,  'pool_recycle': 1800, 'pool_timeout': 10},
+    'staging':    {'pool_size': 5,  'max_overflow': 5,  'pool_recycle': 300,  'pool_timeout': 10},
+    'production': {'pool_size': 10, 'max_overflow': 10, 'pool_recycle': 300,  'pool_timeout': 10},
+}
+
+SQLITE_PROFILE = {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30}
+
+# Environment overrides (apply to every profile)
+ENV_OVERRIDES = {
+    'pool_size': ('DB_POOL_SIZE', int),
+    'max_overflow': ('DB_MAX_OVERFLOW', int),
+    'pool_recycle': ('DB_POOL_RECYCLE', int),
+    'pool_timeout': ('DB_POOL_TIMEOUT', float),
+}
+
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('DB_SQLITE_BUSY_TIMEOUT', 15))
+SQLITE_MMAP_SIZE = int(os.environ.get('DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+# ===================== POOL TELEMETRY =====================
+
+class PoolTelemetry:
+    """
+    Checkout wait-time counters shared by every InstrumentedQueuePool
+    in this process (engine.dispose() recreates the pool, so the
+    counters can't live on the pool itself)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.timeouts,
+                'checkout_wait_total_ms': round(self.wait_total * 1000, 3),
+                'checkout_wait_avg_ms': round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else None,
+                'checkout_wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+pool_telemetry = PoolTelemetry()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times every checkout (waiting for a free slot, connecting, pre-ping)"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_telemetry.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_telemetry.record(time.perf_counter() - started)
+        return connection
+
+def pool_stats(engine):
+    """Pool size, connections in use, utilisation and checkout wait times for this process"""
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update({
+            'pool_size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'utilisation': round(pool.checkedout() / capacity, 4) if capacity else None,
+        })
+
+    stats.update(pool_telemetry.snapshot())
+    return stats
+
+# ===================== ENGINE PROFILES =====================
+
+def engine_options(database_url, env=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for this database URL and environment"""
+    env = env or get_environment()
+    url = make_url(database_url)
+
+    if url.get_backend_name() == 'postgresql':
+        options = dict(POSTGRES_PROFILES[env], pool_pre_ping=True)
+    elif url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}  # In-memory databases use SQLAlchemy's single-connection pools
+        options = dict(SQLITE_PROFILE, connect_args={'timeout': SQLITE_BUSY_TIMEOUT})
+    else:
+        return {}
+
+    for key, (variable, cast) in ENV_OVERRIDES.items():
+        if key in options and os.environ.get(variable):
+            options[key] = cast(os.environ[variable])
+
+    options['poolclass'] = InstrumentedQueuePool
+    return options
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Runs once per new SQLite connection (PostgreSQL connections are left alone)"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.close()
+
+# ===================== FORKING =====================
+
+def dispose_engines(app):
+    """
+    Forget the database connections inherited from a parent process
+
+    Call in a forked child (gunicorn post_fork with preload_app) before
+    it runs any query. close=False drops the pooled connections without
+    closing them, so the sockets/file handles the parent still uses are
+    left alone and the child opens its own on first use.
+    """
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    pool_telemetry.reset()  # Counters are per process, don't inherit the parent's
@@ -0,0 +1,239 @@
+"""
+Background email dispatch with pooled SMTP connections
+
+Request handlers call email_dispatcher.send(msg), which only puts the
+message on a bounded queue and returns. Worker threads deliver queued
+messages, each keeping one SMTP connection open and reusing it across
+messages instead of opening a fresh TLS session per email.
+
+Settings (app.config or environment):
+- EMAIL_DISPATCH_WORKERS: worker threads per process (default 2)
+- EMAIL_QUEUE_SIZE: max queued messages before send() refuses (default 1000)
+- EMAIL_MAX_RETRIES: delivery attempts per message (default 3)
+- EMAIL_RETRY_BACKOFF: seconds before the first retry, doubled each time (default 1.0)
+- EMAIL_IDLE_TIMEOUT: close a worker's connection after this many idle seconds (default 60)
+- EMAIL_SMTP_TIMEOUT: socket timeout for connecting to and talking to the SMTP server (default 30)
+"""
+
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+from flask_mail import Connection
+
+class TimeoutConnection(Connection):
+    """
+    Flask-Mail connection with a socket timeout
+
+    Flask-Mail opens smtplib connections without one, so an SMTP server
+    that stops answering would block a worker thread forever.
+    """
+
+    def __init__(self, mail, timeout):
+        super().__init__(mail)
+        self.timeout = timeout
+
+    def configure_host(self):
+        smtp_class = smtplib.SMTP_SSL if self.mail.use_ssl else smtplib.SMTP
+        host = smtp_class(self.mail.server, self.mail.port, timeout=self.timeout)
+        host.set_debuglevel(int(self.mail.debug))
+        if self.mail.use_tls:
+            host.starttls()
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+        return host
+
+class EmailDispatcher:
+    """
+    Queue-backed sender for Flask-Mail messages
+
+    Usage:
+        email_dispatcher.init_app(app, mail)
+        email_dispatcher.send(Message(...))   # returns immediately
+        email_dispatcher.stats()              # counters for monitoring
+    """
+
+    def __init__(self):
+        self.app = None
+        self.mail = None
+        self.workers = 2
+        self.max_retries = 3
+        self.retry_backoff = 1.0
+        self.idle_timeout = 60.0
+        self.smtp_timeout = 30.0
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._pending_retries = 0
+        self._metrics = {
+            'queued': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+            'rejected': 0,
+            'connections_opened': 0
+        }
+
+    def init_app(self, app, mail):
+        """Read dispatch settings from app.config and register the shutdown drain"""
+        app.config.setdefault('EMAIL_DISPATCH_WORKERS', int(os.environ.get('EMAIL_DISPATCH_WORKERS', 2)))
+        app.config.setdefault('EMAIL_QUEUE_SIZE', int(os.environ.get('EMAIL_QUEUE_SIZE', 1000)))
+        app.config.setdefault('EMAIL_MAX_RETRIES', int(os.environ.get('EMAIL_MAX_RETRIES', 3)))
+        app.config.setdefault('EMAIL_RETRY_BACKOFF', float(os.environ.get('EMAIL_RETRY_BACKOFF', 1.0)))
+        app.config.setdefault('EMAIL_IDLE_TIMEOUT', float(os.environ.get('EMAIL_IDLE_TIMEOUT', 60)))
+        app.config.setdefault('EMAIL_SMTP_TIMEOUT', float(os.environ.get('EMAIL_SMTP_TIMEOUT', 30)))
+
+        self.app = app
+        self.mail = mail
+        self.workers = app.config['EMAIL_DISPATCH_WORKERS']
+        self.max_retries = app.config['EMAIL_MAX_RETRIES']
+        self.retry_backoff = app.config['EMAIL_RETRY_BACKOFF']
+        self.idle_timeout = app.config['EMAIL_IDLE_TIMEOUT']
+        self.smtp_timeout = app.config['EMAIL_SMTP_TIMEOUT']
+        self._queue = queue.Queue(maxsize=app.config['EMAIL_QUEUE_SIZE'])
+        atexit.register(self.shutdown)
+
+    def send(self, message):
+        """
+        Queue a message for delivery
+
+        Returns True once queued, False if the queue is full.
+        Delivery failures are retried in the background and counted
+        in stats(), they are not reported back to the caller.
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((message, 1))
+        except queue.Full:
+            self._count('rejected')
+            print("⚠️ Email queue full - message rejected")
+            return False
+        self._count('queued')
+        return True
+
+    def stats(self):
+        """Snapshot of dispatch counters plus the current queue depth"""
+        with self._lock:
+            snapshot = dict(self._metrics)
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue else 0
+        return snapshot
+
+    def join(self, timeout=None):
+        """
+        Block until every queued message (including pending retries) has been
+        delivered or given up on. Returns False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue is not None and (self._queue.unfinished_tasks or self._pending_retries):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def shutdown(self, timeout=10.0):
+        """Give queued messages a chance to go out, then stop the workers"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        self.join(timeout)
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+    # ----- internals -----
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def _count_pending(self, amount):
+        with self._lock:
+            self._pending_retries += amount
+
+    def _ensure_workers(self):
+        """
+        Start worker threads in this process if they aren't running
+
+        Threads do not survive fork(), so each gunicorn worker starts its
+        own dispatch threads on first use.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'email-dispatcher-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self):
+        """Worker loop: one reusable SMTP connection per thread"""
+        with self.app.app_context():
+            connection = None
+            while not self._stopping.is_set():
+                try:
+                    message, attempt = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    # Idle too long - servers drop idle sessions anyway
+                    connection = self._close(connection)
+                    continue
+
+                try:
+                    if connection is None:
+                        connection = TimeoutConnection(self.app.extensions['mail'], self.smtp_timeout).__enter__()
+                        self._count('connections_opened')
+                    connection.send(message)
+                    self._count('sent')
+                except Exception as e:
+                    # Drop the (possibly broken) connection and retry with backoff
+                    connection = self._close(connection)
+                    self._retry(message, attempt, e)
+                finally:
+                    self._queue.task_done()
+
+            self._close(connection)
+
+    def _retry(self, message, attempt, error):
+        if attempt >= self.max_retries:
+            self._count('failed')
+            print(f"❌ Email to {message.recipients} failed after {attempt} attempts: {error}")
+            return
+
+        self._count('retried')
+        self._count_pending(1)
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        print(f"⚠️ Email to {message.recipients} failed (attempt {attempt}), retrying in {delay:.1f}s: {error}")
+
+        # Requeue from a timer so this worker keeps delivering other mail meanwhile
+        def requeue():
+            try:
+                self._queue.put_nowait((message, attempt + 1))
+            except queue.Full:
+                self._count('failed')
+                print(f"❌ Email to {message.recipients} dropped - queue full on retry")
+            finally:
+                self._count_pending(-1)
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+# Shared instance - call email_dispatcher.init_app(app, mail) once per app
+email_dispatcher = EmailDispatcher()
@@ -0,0 +1,20 @@
+"""
+Deployment environment detection shared by app.py, api.py and db_config.py
+
+ENVIRONMENT is one of:
+- local / development -> 'local'
+- staging / test      -> 'staging'
+- anything else       -> 'production'
+"""
+
+import os
+
+def get_environment():
+    """Detect current environment"""
+    env = os.environ.get('ENVIRONMENT', 'local')
+    if env in ['local', 'development']:
+        return 'local'
+    elif env in ['staging', 'test']:
+        return 'staging'
+    else:
+        return 'production'
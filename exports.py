@@ -0,0 +1,129 @@
+"""
+Streaming CSV / NDJSON exports of users and calculations for admins
+
+Exports can cover the whole calculations table, so nothing is ever
+materialised:
+- Rows come from a server-side cursor (stream_results + yield_per):
+  psycopg2 fetches them from PostgreSQL in chunks, SQLite steps through
+  the result as it goes
+- Rows are encoded and sent in ~64 KB chunks as a chunked HTTP response,
+  so the first bytes leave the worker right away and memory stays flat
+
+Filters (query parameters, all optional):
+- users:        created_from, created_to
+- calculations: from, to, user_id, email, operation
+
+Dates are ISO 8601 (2025-01-31 or 2025-01-31T12:00:00); `*_to` / `to`
+are exclusive. Used by api.py (/api/admin/export/...) and app.py
+(/admin/export/...).
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from flask import Response, request, stream_with_context
+from models import db, User, Calculation
+
+EXPORT_YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', 2000))
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+USER_COLUMNS = (
+    User.id, User.email, User.first_name, User.last_name, User.user_age, User.is_admin,
+    User.email_verified, User.mfa_enabled, User.google_id.isnot(None).label('google_user'), User.created_at
+)
+CALCULATION_COLUMNS = (
+    Calculation.id, Calculation.user_id, User.email, Calculation.number1, Calculation.operation,
+    Calculation.number2, Calculation.result, Calculation.calculated_at
+)
+
+class ExportError(ValueError):
+    """Invalid export parameters (reported to the client as 400)"""
+
+def _parse_date(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"{name} must be an ISO 8601 date, e.g. 2025-01-31")
+
+def export_format():
+    export = request.args.get('format', 'csv')
+    if export not in EXPORT_FORMATS:
+        raise ExportError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    return export
+
+def users_query():
+    """Users matching the request's filters, oldest first"""
+    query = db.select(*USER_COLUMNS)
+    created_from, created_to = _parse_date('created_from'), _parse_date('created_to')
+    if created_from:
+        query = query.where(User.created_at >= created_from)
+    if created_to:
+        query = query.where(User.created_at < created_to)
+    return query.order_by(User.created_at, User.id)
+
+def calculations_query():
+    """Calculations matching the request's filters, in id order"""
+    query = db.select(*CALCULATION_COLUMNS).join(User, User.id == Calculation.user_id)
+    date_from, date_to = _parse_date('from'), _parse_date('to')
+    if date_from:
+        query = query.where(Calculation.calculated_at >= date_from)
+    if date_to:
+        query = query.where(Calculation.calculated_at < date_to)
+    if request.args.get('user_id'):
+        query = query.where(Calculation.user_id == request.args['user_id'])
+    if request.args.get('email'):
+        query = query.where(User.email == request.args['email'].lower())
+    if request.args.get('operation'):
+        query = query.where(Calculation.operation == request.args['operation'])
+    return query.order_by(Calculation.id)
+
+def _encode_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _generate(query, export):
+    rows = db.session.execute(query.execution_options(stream_results=True, yield_per=EXPORT_YIELD_PER))
+    columns = list(rows.keys())
+    buffer = io.StringIO()
+
+    try:
+        if export == 'csv':
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([_encode_value(value) for value in row])
+                if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(columns, map(_encode_value, row)))))
+                buffer.write('\n')
+                if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        # Also runs when the client disconnects mid-download
+        rows.close()
+
+def stream_export(name, query, export):
+    """Chunked download response for a query (call inside a request)"""
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{export}"
+    return Response(
+        stream_with_context(_generate(query, export)),
+        mimetype=EXPORT_FORMATS[export],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no',  # Don't let a proxy buffer the whole export
+        }
+    )
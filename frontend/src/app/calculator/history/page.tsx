@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef, useCallback } from 'react';
 import Navigation from '@/components/Navigation';
 import { calculatorAPI } from '@/lib/api';
 import { useAuth } from '@/contexts/AuthContext';
@@ -15,10 +15,16 @@ interface ApiError {
 }
 
 interface Calculation {
-  id: number;
+  id: number | null;  // null for daily totals of compacted calculations
   expression: string;
-  result: number;
+  result: number | null;
   timestamp: string;
+  rollup?: {
+    day: string;
+    operation: string;
+    count: number;
+    result_sum: number;
+  };
 }
 
 interface HistoryData {
@@ -27,13 +33,19 @@ interface HistoryData {
     total: number;
     operations: { [key: string]: number };
   };
+  next_cursor: string | null;
+  has_more: boolean;
 }
 
+const PAGE_SIZE = 50;
+
 export default function CalculationHistoryPage() {
   const { user } = useAuth();
   const [historyData, setHistoryData] = useState<HistoryData | null>(null);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string>('');
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const sentinelRef = useRef<HTMLDivElement | null>(null);
 
   useEffect(() => {
     const fetchHistory = async () => {
@@ -43,7 +55,7 @@ export default function CalculationHistoryPage() {
       }
 
       try {
-        const response = await calculatorAPI.getHistory();
+        const response = await calculatorAPI.getHistory({ limit: PAGE_SIZE });
         setHistoryData(response.data);
       } catch (error: unknown) {
         setError((error as ApiError)?.response?.data?.error || 'Failed to load calculation history');
@@ -55,6 +67,46 @@ export default function CalculationHistoryPage() {
     fetchHistory();
   }, [user]);
 
+  // Fetch the next page using the cursor returned by the previous one
+  const loadMore = useCallback(async () => {
+    if (!historyData?.next_cursor || isLoadingMore) {
+      return;
+    }
+
+    setIsLoadingMore(true);
+    try {
+      const response = await calculatorAPI.getHistory({
+        limit: PAGE_SIZE,
+        after: historyData.next_cursor,
+      });
+      setHistoryData({
+        ...response.data,
+        calculations: [...historyData.calculations, ...response.data.calculations],
+      });
+    } catch (error: unknown) {
+      setError((error as ApiError)?.response?.data?.error || 'Failed to load more calculations');
+    } finally {
+      setIsLoadingMore(false);
+    }
+  }, [historyData, isLoadingMore]);
+
+  // Load the next page when the sentinel below the table scrolls into view
+  useEffect(() => {
+    const sentinel = sentinelRef.current;
+    if (!sentinel || !historyData?.has_more) {
+      return;
+    }
+
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) {
+        loadMore();
+      }
+    }, { rootMargin: '200px' });
+
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [historyData, loadMore]);
+
   const formatDate = (timestamp: string) => {
     return new Date(timestamp).toLocaleString();
   };
@@ -214,7 +266,7 @@ export default function CalculationHistoryPage() {
                       <tbody>
                         {historyData.calculations.map((calc, index) => (
                           <tr 
-                            key={calc.id}
+                            key={calc.id ?? `${calc.rollup?.day}-${calc.rollup?.operation}`}
                             style={{ 
                               borderBottom: index < historyData.calculations.length - 1 ? '1px solid rgba(255, 255, 255, 0.05)' : 'none'
                             }}
@@ -239,6 +291,14 @@ export default function CalculationHistoryPage() {
                       </tbody>
                     </table>
                   </div>
+
+                  {historyData.has_more && (
+                    <div ref={sentinelRef} className="text-center py-6">
+                      <p className="text-sm" style={{ color: 'var(--text-light-gray)' }}>
+                        {isLoadingMore ? 'Loading more calculations...' : ''}
+                      </p>
+                    </div>
+                  )}
                 </div>
               </>
             ) : null}
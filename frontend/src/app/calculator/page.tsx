@@ -17,7 +17,7 @@ interface ApiError {
 interface CalculationResult {
   result: number;
   expression: string;
-  calculation_id: number;
+  calculation_id: number | null;
   timestamp: string;
 }
 
@@ -84,9 +84,17 @@ export const calculatorAPI = {
     num1: number;
     num2: number;
     operation: string;
+    return_id?: boolean;
   }) => api.post('/calculator', data),
   
-  getHistory: () => api.get('/calculator/history'),
+  calculateBatch: (data: {
+    num1: number[];
+    num2: number[];
+    operation: string | string[];
+  }) => api.post('/calculator/batch', data),
+  
+  getHistory: (params?: { limit?: number; after?: string }) =>
+    api.get('/calculator/history', { params }),
 };
 
 export const contentAPI = {
@@ -95,7 +103,12 @@ export const contentAPI = {
 };
 
 export const adminAPI = {
-  getUsers: () => api.get('/admin/users'),
+  getUsers: (params?: {
+    page?: number;
+    per_page?: number;
+    sort?: 'created_at' | 'email' | 'calculations_count';
+    order?: 'asc' | 'desc';
+  }) => api.get('/admin/users', { params }),
   getStats: () => api.get('/admin/stats'),
 };
 
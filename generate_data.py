@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic users, calculations and chat messages for benchmarks
+
+Usage:
+1. python generate_data.py --users 200000 --calculations 5000000
+2. python generate_data.py --users 1000 --calculations 50000 --chat-messages 5000 --seed 7
+3. python generate_data.py --users 50000 --calculations 1000000 --distribution uniform
+
+Every generated user with a password can log in with --password
+(default: synthetic-password). Emails are <prefix><n>@example.com.
+
+Why not the ORM?
+- Creating millions of objects one at a time takes hours
+- Rows are inserted in batches: executemany, or COPY on PostgreSQL
+- The password is hashed once and shared by every user (scrypt takes
+  ~50ms per hash, i.e. hours for hundreds of thousands of users)
+
+Realistic shape:
+- --distribution zipf (default): a few power users own most calculations,
+  most users have a handful - like production, and the worst case for
+  the history and admin queries
+- Signups skew recent, calculations happen after the user signed up,
+  '+' is more popular than '/'
+- The same --seed always produces the same data
+
+Counters in calculation_stats and usage_buckets are rebuilt at the end.
+Don't run this against production!
+"""
+
+import argparse
+import csv
+import io
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+BATCH_SIZE = 10000
+OPERATION_WEIGHTS = {'+': 40, '-': 25, '*': 20, '/': 15}
+FIRST_NAMES = ['Anna', 'Bram', 'Daan', 'Emma', 'Fenna', 'Julia', 'Lars', 'Lotte', 'Milan', 'Noah', 'Sanne', 'Sem', 'Tess', 'Thijs']
+LAST_NAMES = ['de Jong', 'Jansen', 'de Vries', 'van den Berg', 'van Dijk', 'Bakker', 'Visser', 'Smit', 'Meijer', 'Mulder']
+CHAT_QUESTIONS = [
+    'What is the best time to visit the Rijksmuseum?',
+    'How old are the canals of Amsterdam?',
+    'Where can I rent a bike near Centraal?',
+    'Is the tap water in Amsterdam safe to drink?',
+    'What happened during the Golden Age?',
+]
+CHAT_ANSWERS = [
+    'Early on a weekday morning is usually the quietest.',
+    'The canal ring was dug in the 17th century.',
+    'There are several rental shops right next to the station.',
+    'Yes, Amsterdam tap water is among the cleanest in Europe.',
+    'Amsterdam became one of the richest trading cities in the world.',
+]
+
+# ===================== DISTRIBUTIONS =====================
+
+def per_user_counts(total, users, distribution, rng, alpha=1.1):
+    """Split `total` rows over `users` users (list of counts, sums to total)"""
+    if users == 0:
+        return []
+    if distribution == 'uniform':
+        weights = [1.0] * users
+    else:
+        # Zipf: the k-th most active user has weight 1/k^alpha
+        weights = [1.0 / (rank ** alpha) for rank in range(1, users + 1)]
+        rng.shuffle(weights)  # Power users aren't always the oldest accounts
+
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for index in rng.choices(range(users), weights=weights, k=total - sum(counts)):
+        counts[index] += 1
+    return counts
+
+def signup_time(rng, now, days):
+    # Squaring skews signups towards recent days (growing user base)
+    return now - timedelta(seconds=days * 86400 * rng.random() ** 2)
+
+def activity_time(rng, now, created_at):
+    return created_at + (now - created_at) * rng.random()
+
+# ===================== ROW GENERATORS =====================
+
+def generate_users(count, start, prefix, password_hash, rng, now, days, admins, google_fraction):
+    """User rows to insert, plus (id, created_at) of every user for the activity generators"""
+    users = []
+    rows = []
+    for n in range(start, start + count):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        created_at = signup_time(rng, now, days)
+        is_google = rng.random() < google_fraction
+        users.append((user_id, created_at))
+        rows.append({
+            'id': user_id,
+            'email': f'{prefix}{n}@example.com',
+            'password_hash': None if is_google else password_hash,
+            'is_admin': n - start < admins,
+            'user_age': rng.randint(16, 80) if rng.random() < 0.7 else None,
+            'google_id': str(rng.getrandbits(64)) if is_google else None,
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'email_verified': is_google or rng.random() < 0.95,
+            'mfa_enabled': False,
+            'created_at': created_at,
+        })
+    return users, rows
+
+def generate_calculations(users, counts, rng, now):
+    operations = list(OPERATION_WEIGHTS)
+    weights = list(OPERATION_WEIGHTS.values())
+    for (user_id, created_at), count in zip(users, counts):
+        for operation in rng.choices(operations, weights=weights, k=count):
+            num1 = rng.randint(1, 1000)
+            num2 = rng.randint(1, 1000)
+            result = {'+': num1 + num2, '-': num1 - num2, '*': num1 * num2, '/': num1 / num2}[operation]
+            yield {
+                'user_id': user_id, 'number1': num1, 'number2': num2, 'operation': operation,
+                'result': result, 'calculated_at': activity_time(rng, now, created_at),
+            }
+
+def generate_chat_messages(users, counts, rng, now):
+    for (user_id, created_at), count in zip(users, counts):
+        for _ in range(count):
+            topic = rng.randrange(len(CHAT_QUESTIONS))
+            yield {
+                'user_id': user_id, 'user_message': CHAT_QUESTIONS[topic], 'ai_response': CHAT_ANSWERS[topic],
+                'created_at': activity_time(rng, now, created_at),
+            }
+
+# ===================== BULK INSERT =====================
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bulk_insert(connection, table, rows, batch_size=BATCH_SIZE):
+    """
+    Insert an iterable of row dicts, committing every batch
+
+    PostgreSQL: COPY ... FROM STDIN (CSV), the fastest way in.
+    Others: DBAPI executemany with the driver's placeholders.
+    """
+    dialect = connection.dialect
+    inserted = 0
+
+    for batch in _batches(rows, batch_size):
+        columns = list(batch[0])
+        cursor = connection.connection.cursor()  # Raw DBAPI cursor, no ORM/Core overhead
+
+        if dialect.name == 'postgresql':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in batch:
+                # Unquoted empty field = NULL in COPY's CSV format
+                writer.writerow(['' if value is None else value for value in (row[c] for c in columns)])
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            placeholder = '?' if dialect.paramstyle == 'qmark' else '%s'
+            sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})"
+            if dialect.name == 'sqlite':
+                # Same text format SQLAlchemy uses for DateTime columns on SQLite
+                batch = [{c: v.strftime('%Y-%m-%d %H:%M:%S.%f') if isinstance(v, datetime) else v
+                          for c, v in row.items()} for row in batch]
+            cursor.executemany(sql, [tuple(row[c] for c in columns) for row in batch])
+
+        cursor.close()
+        connection.connection.commit()
+        inserted += len(batch)
+    return inserted
+
+# ===================== MAIN =====================
+
+def generate(users, calculations, chat_messages=0, distribution='zipf', alpha=1.1, seed=42,
+             password='synthetic-password', prefix='user', admins=1, google_fraction=0.1, days=365,
+             batch_size=BATCH_SIZE, verbose=True):
+    """
+    Generate data into the app's database (needs an app context)
+
+    Returns the number of rows inserted per table. Emails are
+    <prefix><n>@example.com, numbered after existing users with the prefix.
+    """
+    from models import db, User, Calculation, ChatMessage
+    from password_hashing import password_hasher
+    from stats import rebuild_calculation_stats
+    from usage import rebuild_usage_buckets
+
+    def log(message):
+        if verbose:
+            print(message)
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    password_hash = password_hasher.hash(password)  # Once, shared by every user
+    start = db.session.scalar(db.select(db.func.count(User.id)).where(User.email.like(f'{prefix}%@example.com')))
+    db.session.commit()  # Don't hold a transaction open while bulk inserting
+
+    inserted = {}
+    started = time.perf_counter()
+    with db.engine.connect() as connection:
+        user_list, user_rows = generate_users(users, start, prefix, password_hash, rng, now, days, admins, google_fraction)
+        inserted['users'] = bulk_insert(connection, User.__table__, user_rows, batch_size)
+        log(f"👥 {inserted['users']} users ({time.perf_counter() - started:.1f}s)")
+
+        counts = per_user_counts(calculations, len(user_list), distribution, rng, alpha)
+        inserted['calculations'] = bulk_insert(
+            connection, Calculation.__table__, generate_calculations(user_list, counts, rng, now), batch_size)
+        log(f"🧮 {inserted['calculations']} calculations ({time.perf_counter() - started:.1f}s)"
+            + (f", busiest user has {max(counts)}" if counts else ""))
+
+        counts = per_user_counts(chat_messages, len(user_list), distribution, rng, alpha)
+        inserted['chat_messages'] = bulk_insert(
+            connection, ChatMessage.__table__, generate_chat_messages(user_list, counts, rng, now), batch_size)
+        log(f"💬 {inserted['chat_messages']} chat messages ({time.perf_counter() - started:.1f}s)")
+
+    inserted['calculation_stats'] = rebuild_calculation_stats()
+    inserted['usage_buckets'] = rebuild_usage_buckets()
+    db.session.commit()
+    log(f"📊 Rebuilt {inserted['calculation_stats']} calculation counters and {inserted['usage_buckets']} "
+        f"usage buckets ({time.perf_counter() - started:.1f}s)")
+    return inserted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bulk-generate synthetic benchmark data')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--calculations', type=int, default=100000, help='total, spread over the new users')
+    parser.add_argument('--chat-messages', type=int, default=0, help='total, spread over the new users')
+    parser.add_argument('--distribution', choices=['zipf', 'uniform'], default='zipf')
+    parser.add_argument('--alpha', type=float, default=1.1, help='zipf skew (higher = more concentrated)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default='synthetic-password')
+    parser.add_argument('--email-prefix', default='user')
+    parser.add_argument('--admins', type=int, default=1, help='the first N new users are admins')
+    parser.add_argument('--google-fraction', type=float, default=0.1, help='share of Google (passwordless) users')
+    parser.add_argument('--days', type=int, default=365, help='signups spread over this many days')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    import os
+    os.environ['MIGRATE_ON_STARTUP'] = '0'  # Applied explicitly below
+    from app import app
+    from migrate import apply_migrations
+
+    with app.app_context():
+        apply_migrations()
+        try:
+            generate(args.users, args.calculations, args.chat_messages, args.distribution, args.alpha,
+                     args.seed, args.password, args.email_prefix, args.admins, args.google_fraction,
+                     args.days, args.batch_size)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+    print("✅ Done!")
@@ -0,0 +1,114 @@
+"""
+Gunicorn settings per environment (picked up automatically from the
+working directory, or explicitly with `gunicorn -c gunicorn.conf.py api:app`)
+
+Why gthread workers?
+- The default sync worker serves one request at a time, so a few slow
+  outbound calls (Google userinfo, SMTP) could tie up every worker
+- Threads let a worker keep serving while one request waits on I/O
+- Everything shared between threads is thread-safe: Flask-SQLAlchemy
+  scopes sessions per app context, the OAuth session is per request
+  (http_client.py) and the caches/queues use locks
+
+gevent also works (GUNICORN_WORKER_CLASS=gevent, after `pip install
+gevent`), but psycopg2 doesn't yield to other greenlets while it waits on
+PostgreSQL, so gthread is the default.
+
+Why preload_app?
+- The master builds the app once (create_app() in app.py / api.py) and
+  forks the workers from it, so a worker starts without importing
+  anything and the imported code and static indexes are shared
+  copy-on-write instead of being loaded once per worker
+- post_fork disposes the database engine each worker inherits, so no
+  two processes ever use the same connection
+- gc.freeze() keeps the garbage collector from touching (and so copying)
+  the shared objects
+- Off with auto-reload (local), where workers must re-import changed code
+
+Starting from another directory works too (`gunicorn -c
+/srv/app/gunicorn.conf.py api:app`): the config finds the app modules
+next to itself and chdirs there before loading the app.
+
+Settings (environment, override the profile):
+- GUNICORN_WORKER_CLASS, GUNICORN_WORKERS, GUNICORN_THREADS, GUNICORN_TIMEOUT
+- GUNICORN_PRELOAD: 1/0 to force preload_app on or off
+- PORT: set by Render
+- METRICS_DIR: where workers share their request metrics (see metrics.py)
+"""
+
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+
+# gunicorn only puts the working directory on sys.path, not this file's
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+from environment import get_environment
+
+PROFILES = {
+    # One worker with auto-reload, like `python app.py`
+    'local':      {'workers': 1, 'threads': 4, 'timeout': 120, 'reload': True},
+    # Render free instances have 512 MB - two workers fit comfortably
+    'staging':    {'workers': 2, 'threads': 4, 'timeout': 30, 'reload': False},
+    'production': {'workers': 2, 'threads': 8, 'timeout': 30, 'reload': False},
+}
+
+environment = get_environment()
+profile = PROFILES[environment]
+
+chdir = HERE  # Where `api:app` / `app:app` and .env are found
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', profile['workers']))
+threads = int(os.environ.get('GUNICORN_THREADS', profile['threads']))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', profile['timeout']))
+graceful_timeout = 30  # Time for atexit drains (calculation writer, email queue)
+keepalive = 5          # Render's proxy reuses connections to the app
+reload = profile['reload']
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0' if reload else '1') == '1'
+
+accesslog = '-'
+errorlog = '-'
+
+# Migrations run once in the master instead of in every worker's import
+os.environ['MIGRATE_ON_STARTUP'] = '0'
+
+# Workers write their metrics here so /api/metrics can merge them
+metrics_dir = os.environ.setdefault(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), f"gunicorn-metrics-{os.environ.get('PORT', '8000')}")
+)
+
+def post_fork(server, worker):
+    """Give the worker its own database connections and metrics flush thread"""
+    if preload_app:
+        from db_config import dispose_engines
+        dispose_engines(worker.app.wsgi())
+
+    from metrics import request_metrics
+    request_metrics.start_flusher()
+
+def on_starting(server):
+    """Create missing tables/indexes before any worker starts"""
+    # A separate process, so the master never opens database connections
+    # that the forked workers would inherit (building the app doesn't
+    # connect: MIGRATE_ON_STARTUP is 0 below gunicorn)
+    subprocess.run([sys.executable, os.path.join(HERE, 'migrate.py')], cwd=HERE, check=True)
+
+    from metrics import clear_metrics_dir
+    clear_metrics_dir(metrics_dir)
+
+def child_exit(server, worker):
+    """Keep an exited worker's request counts in the totals"""
+    from metrics import archive_worker
+    archive_worker(metrics_dir, worker.pid)
+
+def when_ready(server):
+    if preload_app:
+        gc.freeze()  # Move the preloaded app out of the collector's sight before forking
+    server.log.info(
+        f"🚀 {environment}: {workers} {worker_class} workers x {threads} threads on {bind}"
+    )
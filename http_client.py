@@ -0,0 +1,105 @@
+"""
+Outbound HTTP for threaded (gthread) and cooperative (gevent) workers
+
+Two problems with the Flask-Dance defaults once a worker serves several
+requests at the same time:
+- Every request built a fresh requests session for the Google userinfo
+  call: a new TLS handshake each time and no timeout, so a slow Google
+  response held the worker thread indefinitely.
+- The blueprint caches its OAuth session on the blueprint object itself,
+  which is shared by every thread of the worker - one user's token could
+  be used for another user's concurrent request.
+
+This module fixes both:
+- shared_adapter: one keep-alive connection pool per process, with default
+  connect/read timeouts, mounted on every outbound session
+- PooledOAuth2Session: Flask-Dance OAuth2Session using the shared adapter
+- scope_session_per_request(blueprint): keeps the OAuth session in flask.g
+  (per request) instead of on the blueprint
+- http_session: a plain requests.Session for any other outbound calls
+
+Usage:
+    google_bp = make_google_blueprint(..., session_class=PooledOAuth2Session)
+    scope_session_per_request(google_bp)
+
+Settings (environment):
+- HTTP_CONNECT_TIMEOUT: seconds to establish a connection (default 3.05)
+- HTTP_READ_TIMEOUT: seconds to wait for response data (default 10)
+- HTTP_POOL_SIZE: keep-alive connections per host (default 10)
+- HTTP_MAX_RETRIES: retries on connection errors only (default 2)
+"""
+
+import os
+import requests
+from flask import g
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.requests import OAuth2Session
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests made without one"""
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+def _make_adapter():
+    # Only connection failures are retried - a request that reached Google
+    # may have had side effects (e.g. the OAuth token exchange)
+    retries = Retry(total=HTTP_MAX_RETRIES, connect=HTTP_MAX_RETRIES, read=False, status=0,
+                    backoff_factor=0.2, raise_on_status=False)
+    return TimeoutHTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE,
+                              max_retries=retries)
+
+# urllib3 pools are thread-safe, so one adapter serves every session in
+# this process. Connections are opened lazily, after gunicorn forks.
+shared_adapter = _make_adapter()
+
+def mount_shared_adapter(session):
+    session.mount('https://', shared_adapter)
+    session.mount('http://', shared_adapter)
+    return session
+
+http_session = mount_shared_adapter(requests.Session())
+
+class PooledOAuth2Session(OAuth2Session):
+    """Flask-Dance OAuth2Session that reuses the process-wide keep-alive pool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        mount_shared_adapter(self)
+
+class RequestScopedOAuth2Blueprint(OAuth2ConsumerBlueprint):
+    """OAuth2ConsumerBlueprint whose session lives in flask.g for one request"""
+
+    @property
+    def session(self):
+        sessions = g.setdefault('oauth_sessions', {})
+        if self.name not in sessions:
+            sessions[self.name] = OAuth2ConsumerBlueprint.session.fget(self)
+        return sessions[self.name]
+
+    @session.deleter
+    def session(self):
+        # Called by Flask-Dance's teardown_session after every request
+        g.get('oauth_sessions', {}).pop(self.name, None)
+
+def scope_session_per_request(blueprint):
+    """Make an existing Flask-Dance OAuth2 blueprint keep its session per request"""
+    if not isinstance(blueprint, RequestScopedOAuth2Blueprint):
+        blueprint.__dict__.pop('session', None)  # Cached by __init__ (client_id setter)
+        blueprint.__class__ = type(
+            f'RequestScoped{type(blueprint).__name__}',
+            (RequestScopedOAuth2Blueprint, type(blueprint)),
+            {}
+        )
+    return blueprint
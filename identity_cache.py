@@ -0,0 +1,167 @@
+"""
+Identity cache for authenticated requests
+
+Every authenticated request needs the current user: api.py resolves the
+JWT identity, app.py's Flask-Login user_loader resolves the session.
+Instead of a SELECT per request, both read a UserSnapshot from a bounded
+LRU cache whose entries expire after a TTL.
+
+Snapshots are read-only copies. Code that changes a user must load the
+real User with db.session.get(User, user_id). Committed changes to a
+User (admin toggle, delete, MFA settings, OAuth linking, ...)
+invalidate that user's entry automatically through the ORM events at
+the bottom of this module - in this process only.
+
+Why check role versions too?
+- Other gunicorn workers (and app.py vs api.py) never see those events,
+  so they would keep a demoted or deleted user's snapshot for a whole TTL
+- Role changes and deletions bump the user's role version
+  (auth_claims.role_versions, shared through the database); every hit
+  compares the version the snapshot was loaded at with the current one
+  and reloads on a mismatch
+- Admin rights are still checked against the database before admin
+  routes run (app.py admin_required / api.py JWT claims)
+
+Settings (environment):
+- IDENTITY_CACHE_SIZE: max cached users per process (default 10000)
+- IDENTITY_CACHE_TTL: seconds before an entry is reloaded (default 60)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, User
+from auth_claims import role_versions
+
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+CHANGED_USER_IDS = 'identity_cache_changed_user_ids'
+
+class UserSnapshot(UserMixin):
+    """
+    Lightweight, read-only copy of a User row
+
+    Has the same attributes and helper methods that routes and
+    templates read from a User, so it works as Flask-Login's current_user.
+    """
+
+    FIELDS = (
+        'id', 'email', 'first_name', 'last_name', 'user_age', 'is_admin',
+        'profile_picture', 'google_id', 'email_verified', 'mfa_enabled', 'created_at'
+    )
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{field: getattr(user, field) for field in cls.FIELDS})
+
+    def is_google_user(self):
+        return self.google_id is not None
+
+    def get_display_name(self):
+        if self.first_name and self.last_name:
+            return f"{self.first_name} {self.last_name}"
+        elif self.first_name:
+            return self.first_name
+        else:
+            return self.email.split('@')[0]
+
+    def is_administrator(self):
+        return self.is_admin
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.email}>'
+
+class IdentityCache:
+    """
+    Bounded LRU + TTL cache of UserSnapshots keyed by user id
+
+    Usage:
+        identity_cache.get(user_id)         -> UserSnapshot or None
+        identity_cache.invalidate(user_id)
+        identity_cache.stats()              -> hit/miss counters for sizing
+    """
+
+    def __init__(self, maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, user_id):
+        """Snapshot for user_id, loading it from the database on a miss"""
+        if user_id is None:
+            return None
+        user_id = str(user_id)
+        now = time.monotonic()
+        role_version = role_versions.current(user_id)  # In memory, refreshed every ROLE_VERSION_REFRESH
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now and entry[2] == role_version:
+                self._entries.move_to_end(user_id)
+                self._metrics['hits'] += 1
+                return entry[0]
+            self._metrics['misses'] += 1
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None  # Missing users are not cached
+        snapshot = UserSnapshot.from_user(user)
+
+        with self._lock:
+            self._entries[user_id] = (snapshot, now + self.ttl, role_version)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._metrics['evictions'] += 1
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self._metrics['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss/eviction counters, current size and hit ratio"""
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot['size'] = len(self._entries)
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['maxsize'] = self.maxsize
+        snapshot['hit_ratio'] = round(snapshot['hits'] / lookups, 4) if lookups else None
+        return snapshot
+
+identity_cache = IdentityCache()
+
+# Invalidate users changed by a flush - once right away, and again after
+# commit in case another request re-cached the old row in between.
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    changed = session.info.setdefault(CHANGED_USER_IDS, set())
+    for obj in chain(session.dirty, session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+            identity_cache.invalidate(obj.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop(CHANGED_USER_IDS, ()):
+        identity_cache.invalidate(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop(CHANGED_USER_IDS, None)
@@ -0,0 +1,65 @@
+"""
+Fast JSON provider for the API app
+
+Uses orjson when it is installed and falls back to the stdlib json
+module otherwise. Both providers serialize the same types the same way,
+so handlers can put datetime, date and UUID values straight into
+responses:
+- datetime / date -> ISO 8601 string (same as .isoformat())
+- UUID -> string
+- Decimal -> float
+
+Usage:
+    app.json = make_json_provider(app)
+"""
+
+import decimal
+import uuid
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional - stdlib json is used without it
+    orjson = None
+
+def _default(obj):
+    """Types neither encoder handles natively"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    return DefaultJSONProvider.default(obj)
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's default provider, but with ISO 8601 datetimes instead of HTTP dates"""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+class OrjsonProvider(JSONProvider):
+    """orjson-backed provider - encodes straight to bytes for responses"""
+
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option | (orjson.OPT_INDENT_2 if self._app.debug else 0)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=option),
+            mimetype='application/json'
+        )
+
+def make_json_provider(app):
+    """The fastest available provider for this app"""
+    if orjson is not None:
+        return OrjsonProvider(app)
+    return StdlibJSONProvider(app)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the API (gunicorn api:app)
+
+Seeds a database, boots gunicorn with gunicorn.conf.py against it, drives
+a mix of login -> calculator -> history (+ admin) traffic from concurrent
+virtual users and prints latency percentiles and throughput as JSON.
+
+Usage:
+1. python loadtest.py                                  # temporary SQLite database
+2. python loadtest.py --duration 60 --users 20 --output before.json
+3. python loadtest.py --database-url postgresql://.../loadtest   # disposable DB only!
+4. python loadtest.py --mix read-heavy
+5. python loadtest.py --mix profile --seed-users 2 --seed-calculations 1000000
+   (profile latency against a large history: rerun with 0, 10000, 100000...)
+6. python loadtest.py --mix login --password-hash-workers 0   # then 1, 2, 4
+   (login throughput with inline hashing vs. the password hashing pool)
+7. python loadtest.py --workers 4 --preload 0   # vs. --preload 1: boot time and memory
+8. python loadtest.py --workers 1 --respawns 5  # time to replace a killed worker
+
+Compare two runs (e.g. before/after a commit) by diffing their JSON:
+every endpoint reports count, errors, rps, mean, p50, p95, p99 and max
+latency in milliseconds. 'server' reports the time until gunicorn first
+answered and, on Linux, the memory of the master and its workers after
+the run (RSS, PSS and USS from /proc/<pid>/smaps_rollup - PSS/USS show
+what preload_app shares copy-on-write, RSS doesn't).
+
+Why gunicorn instead of the Flask test client?
+- Measures what production runs: real workers, threads, sockets
+- Includes JSON encoding, connection pooling and lock contention
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEED_PASSWORD = 'loadtest-password'
+OPERATIONS = ['+', '-', '*', '/']
+
+# Weighted actions per virtual user request
+MIXES = {
+    'default':     {'calculator': 60, 'history': 25, 'history_next': 5, 'login': 5, 'admin_users': 3, 'admin_stats': 2},
+    'read-heavy':  {'calculator': 20, 'history': 50, 'history_next': 15, 'login': 5, 'admin_users': 5, 'admin_stats': 5},
+    'write-heavy': {'calculator': 85, 'history': 10, 'login': 5},
+    'login':       {'login': 100},
+    'profile':     {'profile': 95, 'login': 5},
+}
+
+# ===================== SEEDING =====================
+
+def seed_database(database_url, users, calculations_per_user, seed):
+    """Create the schema and generate users (user 0 is admin) with calculation history"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['MIGRATE_ON_STARTUP'] = '0'
+    from app import app
+    from migrate import apply_migrations
+    from generate_data import generate
+
+    with app.app_context():
+        apply_migrations()
+        generate(users, users * calculations_per_user, distribution='uniform', seed=seed,
+                 password=SEED_PASSWORD, prefix='loadtest', admins=1, google_fraction=0)
+
+    return [f'loadtest{i}@example.com' for i in range(users)]
+
+# ===================== SERVER =====================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(database_url, port, workers, threads, log_path, password_hash_workers=None, preload=None):
+    """Boot gunicorn api:app and wait until it answers"""
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        PORT=str(port),
+        ENVIRONMENT='staging',          # No auto-reload, OAuth over HTTPS
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        METRICS_DIR=os.path.join(os.path.dirname(log_path), 'metrics'),
+    )
+    env.pop('MIGRATE_ON_STARTUP', None)
+    if password_hash_workers is not None:
+        env['PASSWORD_HASH_WORKERS'] = str(password_hash_workers)
+    if preload is not None:
+        env['GUNICORN_PRELOAD'] = str(preload)
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(HERE, 'gunicorn.conf.py'), 'api:app'],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    log.close()  # The child keeps its own handle
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}, see {log_path}")
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/api/content/history', timeout=1).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not start within 60s, see {log_path}")
+
+def wait_until_serving(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/content/history', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{base_url} did not answer within {timeout}s")
+
+def worker_pids(process):
+    with open(f'/proc/{process.pid}/task/{process.pid}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+def process_memory(pid):
+    """RSS, PSS and USS of a process in MB (Linux only)"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, *rest = line.split()
+            values[key.rstrip(':')] = int(rest[0]) if rest and rest[0].isdigit() else 0
+    return {
+        'rss_mb': round(values['Rss'] / 1024, 1),
+        'pss_mb': round(values['Pss'] / 1024, 1),
+        'uss_mb': round((values['Private_Clean'] + values['Private_Dirty']) / 1024, 1),
+    }
+
+def server_memory(process):
+    """Master and mean worker memory, or None where /proc isn't available"""
+    try:
+        master = process_memory(process.pid)
+        workers = [process_memory(pid) for pid in worker_pids(process)]
+    except (OSError, KeyError):
+        return None
+    return {
+        'master': master,
+        'worker_mean': {key: round(statistics.mean(w[key] for w in workers), 1) for key in master} if workers else None,
+        'total_pss_mb': round(master['pss_mb'] + sum(w['pss_mb'] for w in workers), 1),
+    }
+
+def measure_respawns(process, base_url, count):
+    """
+    Median seconds from SIGKILLing a worker until the server answers again
+
+    Only meaningful with --workers 1: otherwise the other workers answer
+    while the killed one is being replaced.
+    """
+    times = []
+    for _ in range(count):
+        started = time.perf_counter()
+        os.kill(worker_pids(process)[0], signal.SIGKILL)
+        time.sleep(0.01)  # Let the socket close before polling
+        wait_until_serving(base_url)
+        times.append(time.perf_counter() - started)
+    return round(statistics.median(times), 3)
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+# ===================== VIRTUAL USERS =====================
+
+class VirtualUser(threading.Thread):
+    """Logs in, then picks weighted actions until the test ends"""
+
+    def __init__(self, base_url, email, admin_token, mix, seed, results, started_at, warmup, stop_at):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.email = email
+        self.admin_token = admin_token
+        self.actions = list(mix)
+        self.weights = list(mix.values())
+        self.rng = random.Random(seed)
+        self.results = results
+        self.record_from = started_at + warmup
+        self.stop_at = stop_at
+        self.http = requests.Session()
+        self.token = None
+        self.next_cursor = None
+
+    def request(self, name, method, path, token=None, **kwargs):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, headers=headers, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        finished = time.perf_counter()
+        if finished >= self.record_from:
+            self.results.append((name, finished - started, status))
+        return response
+
+    def login(self):
+        response = self.request('login', 'POST', '/api/auth/login',
+                                json={'email': self.email, 'password': SEED_PASSWORD})
+        if response is not None and response.ok:
+            self.token = response.json()['access_token']
+
+    def run(self):
+        self.login()
+        while time.perf_counter() < self.stop_at:
+            action = self.rng.choices(self.actions, self.weights)[0]
+            if action == 'login' or self.token is None:
+                self.login()
+            elif action == 'calculator':
+                self.request('calculator', 'POST', '/api/calculator', self.token, json={
+                    'num1': self.rng.randint(1, 1000),
+                    'num2': self.rng.randint(1, 1000),
+                    'operation': self.rng.choice(OPERATIONS),
+                })
+            elif action == 'history' or (action == 'history_next' and not self.next_cursor):
+                response = self.request('history', 'GET', '/api/calculator/history', self.token)
+                self.next_cursor = response.json().get('next_cursor') if response is not None and response.ok else None
+            elif action == 'history_next':
+                response = self.request('history_next', 'GET', '/api/calculator/history', self.token,
+                                        params={'after': self.next_cursor})
+                self.next_cursor = response.json().get('next_cursor') if response is not None and response.ok else None
+            elif action == 'profile':
+                self.request('profile', 'GET', '/api/auth/profile', self.token)
+            elif action == 'admin_users':
+                self.request('admin_users', 'GET', '/api/admin/users', self.admin_token,
+                             params={'page': self.rng.randint(1, 3)})
+            elif action == 'admin_stats':
+                self.request('admin_stats', 'GET', '/api/admin/stats', self.admin_token)
+
+# ===================== REPORT =====================
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(samples, duration):
+    latencies = sorted(latency * 1000 for _, latency, _ in samples)
+    errors = sum(1 for _, _, status in samples if status == 0 or status >= 400)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / duration, 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'max_ms': round(latencies[-1], 2) if latencies else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ===================== MAIN =====================
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    process = None
+    server = {}
+
+    try:
+        print(f"🌱 Seeding {args.seed_users} users x {args.seed_calculations} calculations", file=sys.stderr)
+        with contextlib.redirect_stdout(sys.stderr):  # Keep stdout for the JSON report
+            emails = seed_database(database_url, args.seed_users, args.seed_calculations, args.seed)
+
+        port = args.port or free_port()
+        booting = time.perf_counter()
+        process = start_server(database_url, port, args.workers, args.threads, os.path.join(workdir, 'gunicorn.log'),
+                               args.password_hash_workers, args.preload)
+        server['first_response_s'] = round(time.perf_counter() - booting, 2)
+        base_url = f'http://127.0.0.1:{port}'
+        print(f"🚀 gunicorn up on {base_url}, running {args.duration}s (+{args.warmup}s warmup)", file=sys.stderr)
+
+        admin_token = requests.post(f'{base_url}/api/auth/login', timeout=30,
+                                    json={'email': emails[0], 'password': SEED_PASSWORD}).json()['access_token']
+
+        results = []  # list.append is atomic, shared by every virtual user
+        started_at = time.perf_counter()
+        stop_at = started_at + args.warmup + args.duration
+        users = [
+            VirtualUser(base_url, emails[1 + i % (len(emails) - 1)] if len(emails) > 1 else emails[0],
+                        admin_token, MIXES[args.mix], args.seed + i, results, started_at, args.warmup, stop_at)
+            for i in range(args.users)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+
+        server['memory'] = server_memory(process)
+        if args.respawns:
+            server['respawn_s'] = measure_respawns(process, base_url, args.respawns)
+    finally:
+        if process is not None:
+            stop_server(process)
+        if args.keep:
+            print(f"📁 Kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    endpoints = {}
+    for sample in results:
+        endpoints.setdefault(sample[0], []).append(sample)
+
+    return {
+        'commit': git_commit(),
+        'started': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'config': {
+            'database': 'postgresql' if database_url.startswith('postgres') else 'sqlite',
+            'mix': args.mix, 'users': args.users, 'duration_s': args.duration, 'warmup_s': args.warmup,
+            'workers': args.workers, 'threads': args.threads, 'preload': args.preload,
+            'password_hash_workers': args.password_hash_workers,
+            'seed': args.seed, 'seed_users': args.seed_users, 'seed_calculations': args.seed_calculations,
+        },
+        'server': server,
+        'total': summarize(results, args.duration),
+        'endpoints': {name: summarize(samples, args.duration) for name, samples in sorted(endpoints.items())},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test gunicorn api:app and report latency as JSON')
+    parser.add_argument('--database-url', help='disposable database (default: temporary SQLite file)')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='default')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds before measuring')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--preload', type=int, choices=[0, 1], help='GUNICORN_PRELOAD (default: per environment)')
+    parser.add_argument('--respawns', type=int, default=0, help='after the run, kill a worker N times and time its replacement')
+    parser.add_argument('--password-hash-workers', type=int,
+                        help='PASSWORD_HASH_WORKERS for the server (0 = hash inline; default: environment)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--seed-users', type=int, default=50)
+    parser.add_argument('--seed-calculations', type=int, default=200, help='per user')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the database and gunicorn log')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"✅ Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Request metrics in Prometheus text format
+
+For every request, per endpoint:
+- http_requests_total: requests by method and status
+- http_request_duration_seconds: latency histogram
+- http_request_db_queries: SQL statements per request (histogram)
+- http_request_db_duration_seconds: time spent in SQL per request (histogram)
+
+Each response also gets a Server-Timing header (`db;dur=..;desc="N queries",
+app;dur=..`) that shows up in the browser's network panel.
+
+Why a metrics directory?
+- gunicorn runs several worker processes, each with its own counters
+- Every worker writes its counters to METRICS_DIR/<pid>.json from a
+  background thread every METRICS_FLUSH_INTERVAL, busy or idle, so the
+  last requests before a worker goes quiet still reach the totals
+- /api/metrics merges the files of all workers, so a scrape sees the
+  whole server no matter which worker answers it
+- Without METRICS_DIR (e.g. `python app.py`) only this process is reported
+
+Other components (connection pool, identity cache, email queue) plug in
+with add_stats_source(): their counters are summed across workers, their
+gauges are reported for the worker answering the scrape.
+
+Usage:
+    request_metrics.init_app(app)
+    request_metrics.add_stats_source('identity_cache', identity_cache.stats,
+                                     counters={'hits', 'misses'})
+
+Settings (environment):
+- METRICS_DIR: directory shared by the workers (gunicorn.conf.py sets one)
+- METRICS_FLUSH_INTERVAL: seconds between writes to METRICS_DIR (default 5)
+- METRICS_TOKEN: if set, /api/metrics requires `Authorization: Bearer <token>`
+"""
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+ARCHIVE_FILE = 'archive.json'  # Counters of workers that have exited
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'Requests by endpoint, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time to build the response'),
+    'http_request_db_queries': ('histogram', 'SQL statements executed per request'),
+    'http_request_db_duration_seconds': ('histogram', 'Time spent executing SQL per request'),
+}
+
+# ===================== DATABASE TIMING =====================
+
+# Counts every statement run inside a request, whichever engine runs it
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_start'].pop()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + (time.perf_counter() - started)
+
+# ===================== METRICS REGISTRY =====================
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class RequestMetrics:
+    """
+    Per-process counters and histograms, merged across workers on scrape
+
+    Thread-safe: gthread workers record from several threads at once.
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {}      # name -> bucket upper bounds
+        self._sources = []      # (prefix, stats function, counter keys)
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None  # Process the flush thread runs in
+        self._flusher_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Instrument every request of this app and serve /api/metrics"""
+        app_name = app.import_name
+
+        @app.before_request
+        def _start_request_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def _record_request(response):
+            started = g.pop('request_started', None)
+            if started is None:
+                return response
+            duration = time.perf_counter() - started
+            queries = g.get('db_queries', 0)
+            db_time = g.get('db_time', 0.0)
+
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={db_time * 1000:.1f};desc="{queries} queries", app;dur={duration * 1000:.1f}'
+            )
+
+            # Unmatched URLs share one label so 404 scans can't explode the series count
+            endpoint = request.endpoint or 'unmatched'
+            if endpoint == 'metrics':
+                return response
+            self.observe(app_name, endpoint, request.method, response.status_code, duration, queries, db_time)
+            return response
+
+        app.add_url_rule('/api/metrics', 'metrics', self.metrics_view)
+        atexit.register(self.flush)
+
+    def add_stats_source(self, prefix, stats, counters=()):
+        """
+        Export a component's stats() dict
+
+        Keys in `counters` are cumulative and summed across workers
+        (exported as <prefix>_<key>_total); other numeric keys are gauges
+        of the worker answering the scrape (labelled with its pid).
+        Adding a prefix again replaces it (every create_app() adds its own).
+        """
+        self._sources = [source for source in self._sources if source[0] != prefix]
+        self._sources.append((prefix, stats, set(counters)))
+
+    # ----- recording -----
+
+    def observe(self, app_name, endpoint, method, status, duration, queries, db_time):
+        labels = {'app': app_name, 'endpoint': endpoint}
+        with self._lock:
+            key = _key('http_requests_total', dict(labels, method=method, status=str(status)))
+            self._counters[key] = self._counters.get(key, 0) + 1
+            self._observe('http_request_duration_seconds', dict(labels, method=method), duration, LATENCY_BUCKETS)
+            self._observe('http_request_db_queries', labels, queries, QUERY_COUNT_BUCKETS)
+            self._observe('http_request_db_duration_seconds', labels, db_time, LATENCY_BUCKETS)
+
+        # Servers without a post_fork hook start the flush thread on their first request
+        if self.metrics_dir and self._flusher_pid != os.getpid():
+            self.start_flusher()
+
+    def _observe(self, name, labels, value, buckets):
+        # Caller holds the lock
+        self._buckets[name] = buckets
+        key = _key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(buckets) + 3)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(buckets)] += 1  # +Inf
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    # ----- multiprocess aggregation -----
+
+    def _snapshot(self):
+        """This process's counters (including stats sources) and histograms"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+            buckets = dict(self._buckets)
+
+        for prefix, stats, counter_keys in self._sources:
+            try:
+                values = stats()
+            except Exception:
+                continue  # A broken source must not break the scrape
+            for name in counter_keys:
+                if isinstance(values.get(name), (int, float)):
+                    counters[_key(f'{prefix}_{name}_total', {})] = values[name]
+
+        return {
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+            'buckets': buckets,
+        }
+
+    def start_flusher(self):
+        """
+        Write this process's snapshot every flush_interval from a daemon thread
+
+        Called in each worker (gunicorn post_fork). Threads don't survive a
+        fork, so the thread belongs to the process that started it: the
+        preloading master never runs one, every worker starts its own.
+        """
+        if not self.metrics_dir:
+            return
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ Could not write metrics to {self.metrics_dir}: {e}")
+
+    def flush(self):
+        """Write this process's snapshot to METRICS_DIR (atomically)"""
+        if not self.metrics_dir:
+            return
+        with self._flush_lock:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            path = os.path.join(self.metrics_dir, f'{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(path + '.tmp', path)
+
+    def _merged(self):
+        """Counters and histograms of every worker (or just this process)"""
+        if not self.metrics_dir:
+            snapshots = [self._snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.metrics_dir, '*.json')):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # Worker exiting or archive being rewritten
+
+        return merge_snapshots(snapshots)
+
+    # ----- exposition -----
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        merged = self._merged()
+        lines = []
+
+        by_name = {}
+        for (name, labels), value in merged['counters'].items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            kind, help_text = METRIC_HELP.get(name, ('counter', name.replace('_', ' ')))
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value in sorted(by_name[name]):
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        by_name = {}
+        for (name, labels), values in merged['histograms'].items():
+            by_name.setdefault(name, []).append((labels, values))
+        for name in sorted(by_name):
+            kind, help_text = METRIC_HELP[name]
+            buckets = merged['buckets'][name]
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, values in sorted(by_name[name]):
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], values[:-2]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(values[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+
+        # Gauges: live values of the worker answering this scrape
+        pid_label = (('pid', str(os.getpid())),)
+        for prefix, stats, counter_keys in self._sources:
+            try:
+                values = stats()
+            except Exception:
+                continue
+            for key in sorted(values):
+                value = values[key]
+                if key in counter_keys or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                lines += [f'# TYPE {name} gauge', f'{name}{_format_labels(pid_label)} {_format_value(value)}']
+
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+def merge_snapshots(snapshots):
+    """Sum counters and histograms of several snapshots"""
+    counters, histograms, buckets = {}, {}, {}
+    for snapshot in snapshots:
+        buckets.update(snapshot.get('buckets', {}))
+        for name, labels, value in snapshot.get('counters', []):
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot.get('histograms', []):
+            key = _key(name, labels)
+            if key in histograms and len(histograms[key]) == len(values):
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+    return {'counters': counters, 'histograms': histograms, 'buckets': buckets}
+
+def archive_worker(metrics_dir, pid):
+    """
+    Fold an exited worker's file into the archive (gunicorn child_exit hook)
+
+    Keeps totals monotonic without leaving one file per dead worker behind.
+    """
+    path = os.path.join(metrics_dir, f'{pid}.json')
+    archive_path = os.path.join(metrics_dir, ARCHIVE_FILE)
+    try:
+        with open(path) as f:
+            snapshots = [json.load(f)]
+    except (OSError, ValueError):
+        return
+    try:
+        with open(archive_path) as f:
+            snapshots.append(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    merged = merge_snapshots(snapshots)
+    archive = {
+        'counters': [[name, dict(labels), value] for (name, labels), value in merged['counters'].items()],
+        'histograms': [[name, dict(labels), values] for (name, labels), values in merged['histograms'].items()],
+        'buckets': merged['buckets'],
+    }
+    with open(archive_path + '.tmp', 'w') as f:
+        json.dump(archive, f)
+    os.replace(archive_path + '.tmp', archive_path)
+    os.remove(path)
+
+def clear_metrics_dir(metrics_dir):
+    """Start a server with empty counters (gunicorn on_starting hook)"""
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, '*.json*')):
+        os.remove(path)
+
+# Shared instance - call request_metrics.init_app(app) once per app
+request_metrics = RequestMetrics()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Apply schema additions to existing databases
+
+db.create_all() creates missing tables but never changes existing ones,
+so indexes added to models.py later would never reach a database that
+already has the table. apply_migrations() compares every index declared
+in models.py with what the database has and creates the missing ones.
+
+Tables derived from existing data (calculation_stats and usage_buckets,
+counted from calculations and rollups) are filled in the same step that creates them, so the
+counters are right from the first request after a deploy.
+
+Usage:
+1. python migrate.py             # create missing tables and indexes
+2. python migrate.py --explain   # also check the hot queries use indexes
+   (tests/test_hot_queries.py checks the same on SQLite)
+
+gunicorn.conf.py runs this script once before starting the workers.
+
+Safe to run repeatedly - it only creates what is missing. On PostgreSQL
+indexes are built CONCURRENTLY so writes are not blocked meanwhile.
+"""
+
+import sys
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from models import db, User, Calculation
+from stats import rebuild_calculation_stats, users_with_calculation_counts
+from usage import rebuild_usage_buckets
+
+# Derived tables: filled from existing rows when apply_migrations() creates them
+BACKFILLS = {
+    'calculation_stats': rebuild_calculation_stats,
+    'usage_buckets': rebuild_usage_buckets,
+}
+
+def apply_migrations():
+    """
+    Create tables and indexes missing from the database (needs an app context)
+
+    Returns the names of the indexes that were created.
+    """
+    engine = db.engine
+    existing_tables = set(inspect(engine).get_table_names())
+    db.create_all()
+
+    for table, backfill in BACKFILLS.items():
+        if table in existing_tables:
+            continue
+        try:
+            rows = backfill()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            db.metadata.tables[table].drop(engine)  # So the next run creates and fills it again
+            raise
+        if rows:
+            print(f"📊 Backfilled {table} ({rows} rows)")
+
+    inspector = inspect(engine)
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing:
+                continue
+
+            if engine.dialect.name == 'postgresql':
+                # CONCURRENTLY can't run inside a transaction block
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                ddl = ddl.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+                with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    conn.execute(text(ddl))
+            else:
+                with engine.begin() as conn:
+                    index.create(conn, checkfirst=True)
+
+            print(f"🗂️ Created index {index.name} on {table.name}")
+            created.append(index.name)
+
+    return created
+
+def hot_queries():
+    """The queries that must be served by an index, as (name, statement)"""
+    users, _ = users_with_calculation_counts()
+    return [
+        ('calculation history page', db.select(Calculation.id)
+            .where(Calculation.user_id == 'example-user-id')
+            .order_by(Calculation.calculated_at.desc(), Calculation.id.desc())
+            .limit(51)),
+        ('admin recent users', db.select(User.email)
+            .order_by(User.created_at.desc())
+            .limit(5)),
+        ('admin recent calculations', db.select(Calculation.id)
+            .order_by(Calculation.calculated_at.desc())
+            .limit(10)),
+        ('admin users page', users
+            .order_by(User.created_at.desc(), User.id)
+            .offset(50)
+            .limit(50)),
+    ]
+
+def query_plan(conn, statement):
+    """
+    The database's plan for a statement, one step per item
+
+    Returns (steps, uses_index): uses_index is False if any step is a
+    full table scan (or, on SQLite, a sort of the whole result).
+    """
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'sqlite':
+        plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+        uses_index = all('USING' in step or not step.startswith('SCAN') for step in plan) \
+            and not any('USE TEMP B-TREE FOR ORDER BY' in step for step in plan)
+    else:
+        plan = [row[0] for row in conn.execute(text(f'EXPLAIN {sql}'))]
+        uses_index = not any('Seq Scan' in step for step in plan)
+    return plan, uses_index
+
+def explain_hot_queries():
+    """
+    Print the query plan of every hot query (needs an app context)
+
+    Returns the names of queries whose plan is a full table scan.
+    """
+    engine = db.engine
+    full_scans = []
+
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            # Small tables make the planner prefer seq scans - we want to
+            # know whether an index *can* serve the query
+            conn.execute(text('SET enable_seqscan = off'))
+
+        for name, statement in hot_queries():
+            plan, uses_index = query_plan(conn, statement)
+            print(f"{'✅' if uses_index else '❌'} {name}")
+            for step in plan:
+                print(f"     {step}")
+            if not uses_index:
+                full_scans.append(name)
+
+    return full_scans
+
+if __name__ == "__main__":
+    import os
+    os.environ['MIGRATE_ON_STARTUP'] = '0'  # Applied explicitly below
+    from app import app
+
+    with app.app_context():
+        created = apply_migrations()
+        print(f"✅ Migrations applied ({len(created)} new indexes)")
+
+        if '--explain' in sys.argv[1:]:
+            if explain_hot_queries():
+                sys.exit(1)
@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hashing import password_hasher
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from datetime import datetime
 import uuid
@@ -42,11 +42,14 @@ class User(UserMixin, db.Model):
     last_mfa_code = db.Column(db.String(10), nullable=True)  # Current verification code
     mfa_code_expires = db.Column(db.DateTime, nullable=True)  # When code expires
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Admin "newest users" lists
     
     # Relationships - "this user has many calculations and chat messages"
     calculations = db.relationship('Calculation', backref='user', lazy=True, cascade='all, delete-orphan')
     chat_messages = db.relationship('ChatMessage', backref='user', lazy=True, cascade='all, delete-orphan')
+    calculation_stats = db.relationship('CalculationStat', backref='user', lazy=True, cascade='all, delete-orphan')
+    calculation_rollups = db.relationship('CalculationRollup', backref='user', lazy=True, cascade='all, delete-orphan')
+    archived_calculations = db.relationship('ArchivedCalculation', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
         """
@@ -56,9 +59,11 @@ class User(UserMixin, db.Model):
         - NEVER store plain text passwords
         - Even if database is compromised, passwords are safe
         - Werkzeug uses bcrypt - industry standard
+        - Hashing runs in a process pool (password_hashing.py) so it
+          doesn't block the request worker
         """
         if password:  # Only set password if provided (Google users have no password)
-            self.password_hash = generate_password_hash(password)
+            self.password_hash = password_hasher.hash(password)
         else:
             self.password_hash = None  # No password for Google users
     
@@ -74,7 +79,16 @@ class User(UserMixin, db.Model):
         """
         if not self.password_hash:  # Google OAuth user
             return False
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """
+        Check if the stored hash uses outdated hash parameters
+        
+        Call after a successful check_password() and, if True, call
+        set_password() with the same password to upgrade the hash.
+        """
+        return bool(self.password_hash) and password_hasher.needs_rehash(self.password_hash)
     
     def is_google_user(self):
         """
@@ -124,11 +138,121 @@ class Calculation(db.Model):
     number2 = db.Column(db.Float, nullable=False)
     operation = db.Column(db.String(20), nullable=False)  # 'add', 'subtract', etc.
     result = db.Column(db.Float, nullable=False)
-    calculated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    calculated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Dashboard "recent calculations"
     
     def __repr__(self):
         return f'<Calculation {self.number1} {self.operation} {self.number2} = {self.result}>'
 
+# History is always "one user's calculations, newest first" (keyset on calculated_at, id)
+db.Index(
+    'ix_calculations_user_id_calculated_at',
+    Calculation.user_id, Calculation.calculated_at.desc(), Calculation.id.desc()
+)
+
+class CalculationStat(db.Model):
+    """
+    Per-user calculation counters - one row per user and operation
+    
+    Why keep counters?
+    - History statistics come back without scanning every calculation
+    - Updated in the same transaction as the calculation itself
+    - Can always be rebuilt from calculations + rollups (rebuild_stats.py)
+    """
+    __tablename__ = 'calculation_stats'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    operation = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CalculationStat {self.user_id} {self.operation}={self.count}>'
+
+class UsageBucket(db.Model):
+    """
+    Hourly calculation counts per operation and user cohort
+    
+    Why pre-aggregate?
+    - Usage charts read at most hours x operations x cohorts x shards
+      rows, however big the calculations table gets
+    - Updated in the same transaction as the calculations (usage.py)
+    - Several shards per bucket so concurrent writers don't all wait on
+      the same row lock; readers sum them
+    """
+    __tablename__ = 'usage_buckets'
+    
+    bucket = db.Column(db.DateTime, primary_key=True)  # Start of the hour (UTC)
+    operation = db.Column(db.String(20), primary_key=True)
+    cohort = db.Column(db.String(10), primary_key=True)  # 'new' or 'returning' user
+    shard = db.Column(db.Integer, primary_key=True, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<UsageBucket {self.bucket} {self.operation} {self.cohort}={self.count}>'
+
+class CalculationRollup(db.Model):
+    """
+    Daily per-user, per-operation totals of compacted calculations
+    
+    Why roll up?
+    - The calculations table only grows; old rows are rarely read one by one
+    - compact_calculations.py folds rows older than the retention period
+      into one row per (user, day, operation) and removes the raw rows
+    - History and counters keep including them (see rollups.py)
+    """
+    __tablename__ = 'calculation_rollups'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    operation = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    result_sum = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f'<CalculationRollup {self.user_id} {self.day} {self.operation}={self.count}>'
+
+class ArchivedCalculation(db.Model):
+    """
+    Raw calculations moved out of the live table by compaction (--archive)
+    
+    Same columns as Calculation, never read by the app - kept for audits
+    or to re-import rows later. Deleted together with the user.
+    """
+    __tablename__ = 'calculations_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
+    number1 = db.Column(db.Float, nullable=False)
+    number2 = db.Column(db.Float, nullable=False)
+    operation = db.Column(db.String(20), nullable=False)
+    result = db.Column(db.Float, nullable=False)
+    calculated_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<ArchivedCalculation {self.id}>'
+
+class RoleVersion(db.Model):
+    """
+    Role version per user - bumped whenever a user's admin status changes
+    
+    Why a version?
+    - Access tokens carry is_admin and the role version as JWT claims
+    - Admin checks trust the claims instead of loading the user
+    - A token whose version is older than this row is rejected,
+      so demoted admins can't keep using old tokens
+    
+    Only users whose role ever changed have a row (missing = version 0).
+    No foreign key on purpose: the row outlives a deleted user so their
+    tokens stay rejected.
+    """
+    __tablename__ = 'role_versions'
+    
+    user_id = db.Column(db.String(36), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<RoleVersion {self.user_id} v{self.version}>'
+
 class ChatMessage(db.Model):
     """
     Chat message model - stores AI conversations about Amsterdam
@@ -146,6 +270,10 @@ class ChatMessage(db.Model):
     ai_response = db.Column(db.Text, nullable=False)   # What AI responded
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_chat_messages_user_id_created_at', 'user_id', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<ChatMessage from {self.user_id} at {self.created_at}>'
 
@@ -158,5 +286,5 @@ class OAuthToken(OAuthConsumerMixin, db.Model):
     __tablename__ = 'oauth_tokens'
     
     provider_user_id = db.Column(db.String(256), unique=True, nullable=False)
-    user_id = db.Column(db.String(36), db.ForeignKey(User.id), nullable=False)
+    user_id = db.Column(db.String(36), db.ForeignKey(User.id), nullable=False, index=True)
     user = db.relationship(User)
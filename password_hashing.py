@@ -0,0 +1,130 @@
+"""
+Password hashing service backed by a process pool
+
+Werkzeug's scrypt/pbkdf2 hashing is deliberately CPU-heavy. Running it
+in the request thread lets a burst of logins starve every other request
+in the worker (and, with the GIL, every other thread too). Here hash and
+verify run in a small ProcessPoolExecutor instead.
+
+Settings (environment):
+- PASSWORD_HASH_METHOD: Werkzeug method string, e.g. 'scrypt:32768:8:1'
+  or 'pbkdf2:sha256:600000' (default: Werkzeug's default scrypt)
+- PASSWORD_HASH_SALT_LENGTH: salt length in characters (default 16)
+- PASSWORD_HASH_WORKERS: pool size per process (default: CPU count, max 4);
+  0 disables the pool and hashes inline
+- PASSWORD_HASH_TIMEOUT: seconds to wait for the pool before hashing
+  inline instead (default 10)
+
+Why forkserver?
+- The pool is created from a gthread worker that already runs several
+  threads; fork() copies locks another thread may be holding, and the
+  child can deadlock on them
+- forkserver starts a clean single-threaded server process once and
+  forks the pool processes from it
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+class PasswordHasher:
+    """
+    Hash and verify passwords off the request thread
+
+    Usage:
+        password_hasher.hash(password)          -> hash string
+        password_hasher.verify(hash, password)  -> True/False
+        password_hasher.needs_rehash(hash)      -> True if stored with old parameters
+    """
+
+    def __init__(self):
+        self.method = os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+        self.salt_length = int(os.environ.get('PASSWORD_HASH_SALT_LENGTH', 16))
+        self.workers = int(os.environ.get('PASSWORD_HASH_WORKERS', min(os.cpu_count() or 1, 4)))
+        self.timeout = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+        self._method_prefix = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        return self._call(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._call(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        True if the hash was made with a different method or parameters
+
+        Werkzeug hashes look like 'method$salt$hash', so comparing the
+        method prefix tells us whether the stored parameters are current.
+        """
+        if self._method_prefix is None:
+            # 'scrypt' expands to 'scrypt:32768:8:1' etc. - learn the full
+            # prefix once from a throwaway hash
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    # ----- internals -----
+
+    def _call(self, fn, *args):
+        """
+        Run fn in the pool, or inline if there is no pool
+
+        A pool that is too busy to answer within `timeout`, or whose
+        processes died, must not turn a login into a 500: the caller
+        hashes inline instead (slower, but the request succeeds).
+        """
+        executor = self._get_executor()
+        if executor is None:
+            return fn(*args)
+        try:
+            future = executor.submit(fn, *args)
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()  # Skip it if it hasn't started yet
+            print(f"⚠️ Password hashing pool busy for {self.timeout:.0f}s - hashing inline")
+        except BrokenProcessPool:
+            print("⚠️ Password hashing pool broken - recreating it, hashing inline")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+        return fn(*args)
+
+    def _get_executor(self):
+        """
+        Create the pool lazily, once per process
+
+        A pool inherited through fork() belongs to the parent, so a
+        gunicorn worker builds its own the first time it hashes.
+        """
+        if self.workers <= 0:
+            return None
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Not fork: this process may already run other threads (see above)
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(start_method)
+                )
+                self._pid = os.getpid()
+        return self._executor
+
+# Shared instance used by User.set_password / User.check_password
+password_hasher = PasswordHasher()
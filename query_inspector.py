@@ -0,0 +1,178 @@
+"""
+N+1 and slow-query detector (opt-in, for development and staging)
+
+Counts the SQL statements each request runs and reports, with the route
+that ran them:
+- statements repeated more than QUERY_REPEAT_THRESHOLD times - the
+  signature of an N+1 (e.g. `user.calculations|length` inside a loop)
+- statements slower than SLOW_QUERY_MS
+- routes that run more statements than their budget
+
+Budgets are declared on the view with @query_budget(n), or per endpoint
+in app.config['QUERY_BUDGETS'] = {'api_calculation_history': 3}.
+Periodic refreshes that happen to run inside some request (e.g.
+auth_claims.role_versions every ROLE_VERSION_REFRESH seconds) aren't
+part of any route's queries: they run with
+execution_options(query_budget_exempt=True) and are not counted.
+
+Modes (QUERY_INSPECTOR environment variable or app.config):
+- off:   nothing is installed, zero overhead (default)
+- log:   problems are printed
+- raise: a budget overrun raises QueryBudgetExceeded, so the request
+         fails - use this when running tests or load checks
+
+In raise mode the budget is also checked right before every commit, so
+an overrun fails the request while its writes can still be rolled back.
+Statements run after a commit are only logged: raising then would
+report a failure for a write that was saved, and a retry would
+duplicate it.
+
+Usage:
+    query_inspector.init_app(app)
+
+    @app.route('/api/calculator/history')
+    @query_budget(3)
+    def api_calculation_history(): ...
+"""
+
+import os
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+QUERY_INSPECTOR = os.environ.get('QUERY_INSPECTOR', 'off')
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+QUERY_INSPECTOR_MODES = ('off', 'log', 'raise')
+
+class QueryBudgetExceeded(Exception):
+    """A route ran more SQL statements than its query budget allows"""
+
+def query_budget(max_queries):
+    """Declare the most SQL statements this view may run per request"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+def _shorten(statement, length=300):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + '...'
+
+class QueryInspector:
+    """Per-request statement log checked after every request"""
+
+    def __init__(self):
+        self.mode = 'off'
+        self.repeat_threshold = QUERY_REPEAT_THRESHOLD
+        self.slow_query_ms = SLOW_QUERY_MS
+        self._listening = False
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_INSPECTOR', QUERY_INSPECTOR)
+        app.config.setdefault('QUERY_REPEAT_THRESHOLD', QUERY_REPEAT_THRESHOLD)
+        app.config.setdefault('SLOW_QUERY_MS', SLOW_QUERY_MS)
+        app.config.setdefault('QUERY_BUDGETS', {})
+
+        mode = app.config['QUERY_INSPECTOR']
+        if mode not in QUERY_INSPECTOR_MODES:
+            raise ValueError(f"QUERY_INSPECTOR must be one of {QUERY_INSPECTOR_MODES}, not {mode!r}")
+        if mode == 'off':
+            return
+
+        self.mode = mode
+        self.repeat_threshold = app.config['QUERY_REPEAT_THRESHOLD']
+        self.slow_query_ms = app.config['SLOW_QUERY_MS']
+        self._listen()
+
+        app.before_request(self._start_request)
+        app.after_request(self._check_request)
+        print(f"🔎 Query inspector on ({mode}): repeats > {self.repeat_threshold}, slow > {self.slow_query_ms}ms")
+
+    def _listen(self):
+        if self._listening:
+            return
+        event.listen(Engine, 'before_cursor_execute', self._before_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_execute)
+        event.listen(Session, 'before_commit', self._before_commit)
+        event.listen(Session, 'after_commit', self._after_commit)
+        self._listening = True
+
+    # ----- statement tracking -----
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('inspector_query_start', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['inspector_query_start'].pop()) * 1000
+        if not has_request_context() or 'query_log' not in g:
+            return  # Background threads and code outside requests aren't inspected
+        if context is not None and context.execution_options.get('query_budget_exempt'):
+            return
+
+        # Parameters are bound separately, so the text is the same for
+        # every row of an N+1 loop
+        g.query_log[statement] += 1
+        if elapsed_ms > self.slow_query_ms:
+            print(f"🐢 Slow query ({elapsed_ms:.1f}ms) in {request.method} {request.endpoint}: {_shorten(statement)}")
+
+    # ----- commits -----
+
+    def _before_commit(self, session):
+        if self.mode != 'raise' or not has_request_context() or 'query_log' not in g:
+            return
+        message = self._budget_overrun(g.query_log)
+        if message:
+            # Raised before anything is saved - the caller rolls back
+            raise QueryBudgetExceeded(message)
+
+    def _after_commit(self, session):
+        if has_request_context() and 'query_log' in g:
+            g.query_committed = True
+
+    # ----- per-request checks -----
+
+    def _start_request(self):
+        g.query_log = Counter()
+
+    def _check_request(self, response):
+        query_log = g.pop('query_log', None)
+        if query_log is None:
+            return response
+        route = f"{request.method} {request.endpoint}"
+
+        for statement, count in query_log.items():
+            if count > self.repeat_threshold:
+                print(f"🔁 Possible N+1 in {route}: same statement ran {count} times: {_shorten(statement)}")
+
+        committed = g.pop('query_committed', False)
+        message = self._budget_overrun(query_log)
+        if message:
+            if self.mode == 'raise' and not committed:
+                raise QueryBudgetExceeded(message)
+            # After a commit the writes are saved - failing the response
+            # now would make the client retry (and duplicate) them
+            print(f"💸 Query budget exceeded: {message}" + (" (after commit)" if committed else ""))
+        return response
+
+    def _budget_overrun(self, query_log):
+        """Error message if this request ran more statements than its budget, else None"""
+        budget = self.budget_for(request.endpoint)
+        total = sum(query_log.values())
+        if budget is not None and total > budget:
+            return f"{request.method} {request.endpoint} ran {total} SQL statements, budget is {budget}"
+        return None
+
+    def budget_for(self, endpoint):
+        """Budget from app.config['QUERY_BUDGETS'], else from @query_budget"""
+        budgets = current_app.config['QUERY_BUDGETS']
+        if endpoint in budgets:
+            return budgets[endpoint]
+        view = current_app.view_functions.get(endpoint)
+        return getattr(view, 'query_budget', None)
+
+# Shared instance - call query_inspector.init_app(app) once per app
+query_inspector = QueryInspector()
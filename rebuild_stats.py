@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Rebuild per-user calculation statistics from the calculations table
+
+Usage:
+1. python rebuild_stats.py                     # rebuild every user + usage buckets
+2. python rebuild_stats.py your.email@example.com   # rebuild one user
+
+When to run:
+- After a crash or restore left counters out of sync
+- After manually editing or deleting calculation rows
+"""
+
+import sys
+from app import app, db, User
+from stats import rebuild_calculation_stats
+from usage import rebuild_usage_buckets
+
+def rebuild_stats(email=None):
+    """
+    Recompute counters in a single transaction
+    
+    Safety:
+    - Either every counter is rebuilt or nothing changes
+    - Safe to run repeatedly (result only depends on calculations)
+    """
+    with app.app_context():
+        try:
+            user_id = None
+            if email:
+                user = User.query.filter_by(email=email.lower()).first()
+                if not user:
+                    print(f"❌ User {email} not found.")
+                    return False
+                user_id = user.id
+            
+            written = rebuild_calculation_stats(user_id)
+            # Usage buckets are site-wide, so only a full rebuild touches them
+            buckets = rebuild_usage_buckets() if user_id is None else None
+            db.session.commit()
+            
+            print(f"✅ Rebuilt {written} calculation counters" + (f" for {email}" if email else f" and {buckets} usage buckets"))
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            db.session.rollback()
+            return False
+
+if __name__ == "__main__":
+    email = sys.argv[1] if len(sys.argv) > 1 else None
+    
+    if not rebuild_stats(email):
+        sys.exit(1)
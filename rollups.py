@@ -0,0 +1,165 @@
+"""
+Compaction of old calculations into daily rollups
+
+Calculations older than the retention period are folded into
+calculation_rollups (one row per user, day and operation) and removed
+from the live table, optionally copied to calculations_archive first.
+
+Why is this safe to interrupt and re-run?
+- Each batch is one transaction: DELETE ... RETURNING removes the raw
+  rows and the same transaction adds exactly those rows to the rollups
+- A crash rolls the whole batch back, so nothing is counted twice or lost
+- Two jobs running at once can't double count either: a row can only be
+  deleted (and therefore returned) by one of them
+
+The per-user counters in calculation_stats already include every
+calculation, so compaction leaves them untouched. History reads the live
+rows first and then continues with the rollups (see api.py).
+"""
+
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Calculation, CalculationRollup, ArchivedCalculation
+
+CALCULATION_RETENTION_DAYS = int(os.environ.get('CALCULATION_RETENTION_DAYS', 90))
+COMPACTION_BATCH_SIZE = int(os.environ.get('COMPACTION_BATCH_SIZE', 5000))
+
+CALCULATION_FIELDS = (
+    Calculation.id, Calculation.user_id, Calculation.number1, Calculation.number2,
+    Calculation.operation, Calculation.result, Calculation.calculated_at
+)
+
+def compaction_cutoff(retention_days=CALCULATION_RETENTION_DAYS, now=None):
+    """
+    Rows calculated before this moment get compacted
+
+    Always midnight (UTC), so a day is either fully rolled up or fully
+    live and history never shows the same day twice.
+    """
+    now = now or datetime.utcnow()
+    return datetime.combine((now - timedelta(days=retention_days)).date(), datetime.min.time())
+
+def _add_to_rollups(totals):
+    """Add {(user_id, day, operation): [count, result_sum]} to the rollups (does NOT commit)"""
+    if not totals:
+        return
+    dialect = db.session.get_bind().dialect.name
+    values = [
+        {'user_id': user_id, 'day': day, 'operation': operation, 'count': count, 'result_sum': result_sum}
+        for (user_id, day, operation), (count, result_sum) in totals.items()
+    ]
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(CalculationRollup).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'day', 'operation'],
+            set_={
+                'count': CalculationRollup.count + stmt.excluded.count,
+                'result_sum': CalculationRollup.result_sum + stmt.excluded.result_sum,
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    for row in values:
+        updated = db.session.execute(
+            db.update(CalculationRollup)
+            .where(CalculationRollup.user_id == row['user_id'],
+                   CalculationRollup.day == row['day'],
+                   CalculationRollup.operation == row['operation'])
+            .values(count=CalculationRollup.count + row['count'],
+                    result_sum=CalculationRollup.result_sum + row['result_sum'])
+        )
+        if updated.rowcount == 0:
+            db.session.add(CalculationRollup(**row))
+
+def _take_batch(cutoff, batch_size):
+    """Delete up to batch_size rows older than cutoff and return them"""
+    batch = db.select(Calculation.id) \
+        .where(Calculation.calculated_at < cutoff) \
+        .order_by(Calculation.calculated_at) \
+        .limit(batch_size)
+
+    if db.session.get_bind().dialect.delete_returning:
+        return db.session.execute(
+            db.delete(Calculation)
+            .where(Calculation.id.in_(batch.scalar_subquery()))
+            .returning(*CALCULATION_FIELDS)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+    # No RETURNING (e.g. MySQL): lock the rows, then delete them by id
+    rows = db.session.execute(
+        db.select(*CALCULATION_FIELDS).where(Calculation.id.in_(batch.scalar_subquery())).with_for_update()
+    ).all()
+    if rows:
+        db.session.execute(
+            db.delete(Calculation).where(Calculation.id.in_([row.id for row in rows]))
+            .execution_options(synchronize_session=False)
+        )
+    return rows
+
+def compact_batch(cutoff, batch_size=COMPACTION_BATCH_SIZE, archive=False):
+    """
+    Roll up one batch of old calculations in its own transaction
+
+    Returns the number of calculations compacted (0 when done).
+    """
+    try:
+        rows = _take_batch(cutoff, batch_size)
+        totals = defaultdict(lambda: [0, 0.0])
+        for row in rows:
+            total = totals[(row.user_id, row.calculated_at.date(), row.operation)]
+            total[0] += 1
+            total[1] += row.result
+        _add_to_rollups(totals)
+
+        if archive and rows:
+            db.session.execute(db.insert(ArchivedCalculation), [row._asdict() for row in rows])
+
+        db.session.commit()
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
+
+def compact_calculations(retention_days=CALCULATION_RETENTION_DAYS, batch_size=COMPACTION_BATCH_SIZE,
+                         archive=False, max_batches=None, verbose=True):
+    """
+    Compact every calculation older than retention_days (needs an app context)
+
+    Commits after each batch - stop it any time and run it again to
+    resume. Returns the number of calculations compacted.
+    """
+    cutoff = compaction_cutoff(retention_days)
+    compacted = 0
+    batches = 0
+    started = time.perf_counter()
+
+    while max_batches is None or batches < max_batches:
+        count = compact_batch(cutoff, batch_size, archive)
+        if count == 0:
+            break
+        compacted += count
+        batches += 1
+        if verbose:
+            print(f"🗜️ Compacted {compacted} calculations older than {cutoff:%Y-%m-%d} "
+                  f"({time.perf_counter() - started:.1f}s)")
+
+    return compacted
+
+# ===================== READING ROLLUPS =====================
+
+def rollup_history_query(user_id):
+    """A user's rollups, newest day first (keyset on day, operation)"""
+    return db.select(
+        CalculationRollup.day,
+        CalculationRollup.operation,
+        CalculationRollup.count,
+        CalculationRollup.result_sum
+    ).where(CalculationRollup.user_id == user_id) \
+        .order_by(CalculationRollup.day.desc(), CalculationRollup.operation.desc())
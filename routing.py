@@ -0,0 +1,50 @@
+"""
+Route declarations for the application factories in app.py and api.py
+
+Views are declared at import time with @routes.route(...), exactly like
+@app.route(...), and create_app() adds them to each new app.
+
+Why not a Blueprint?
+- Blueprint endpoints get a prefix ('web.admin_users'), which would
+  break every url_for('admin_users') in templates and redirects
+- RouteTable registers with app.add_url_rule, so endpoint names stay
+  the same as before the factory existed
+"""
+
+class RouteTable:
+    """
+    Routes and error handlers to register on every app built by a factory
+
+    Usage:
+        routes = RouteTable()
+
+        @routes.route('/api/calculator', methods=['POST'])
+        def api_calculator(): ...
+
+        def create_app(config=None):
+            app = Flask(__name__)
+            routes.register(app)
+    """
+
+    def __init__(self):
+        self._rules = []
+        self._error_handlers = []
+
+    def route(self, rule, **options):
+        def decorator(view):
+            endpoint = options.pop('endpoint', view.__name__)
+            self._rules.append((rule, endpoint, view, options))
+            return view
+        return decorator
+
+    def errorhandler(self, code):
+        def decorator(handler):
+            self._error_handlers.append((code, handler))
+            return handler
+        return decorator
+
+    def register(self, app):
+        for rule, endpoint, view, options in self._rules:
+            app.add_url_rule(rule, endpoint, view, **options)
+        for code, handler in self._error_handlers:
+            app.register_error_handler(code, handler)
@@ -0,0 +1,121 @@
+"""
+In-memory index of the Next.js static export (frontend/out)
+
+Built once at startup: every file is read, hashed for its ETag and,
+when it's a compressible type, precompressed with gzip (and brotli if
+the optional `brotli` package is installed). Requests are then answered
+from memory - including 304s for conditional requests - without any
+os.path.exists / open / stat calls.
+
+Hashed chunks under _next/static/ never change for a given URL, so they
+are served as `immutable` with a one-year max-age; everything else
+(HTML pages, favicon, ...) must be revalidated.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:  # Optional - gzip only without it
+    brotli = None
+
+# Files bigger than this are indexed but streamed from disk
+MAX_INLINE_SIZE = int(os.environ.get('STATIC_MAX_INLINE_SIZE', 4 * 1024 * 1024))
+MIN_COMPRESS_SIZE = 256
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/javascript', 'application/json', 'application/xml',
+    'image/svg+xml', 'application/manifest+json', 'application/wasm'
+)
+
+IMMUTABLE_PREFIX = '_next/static/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+class Asset:
+    """One file of the export with its precomputed variants"""
+
+    __slots__ = ('path', 'full_path', 'size', 'mimetype', 'etag', 'cache_control', 'body', 'variants')
+
+    def __init__(self, path, full_path):
+        self.path = path
+        self.full_path = full_path
+        self.size = os.path.getsize(full_path)
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if path.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE_CONTROL
+        self.body = None
+        self.variants = {}  # encoding -> (body, etag)
+
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        self.etag = f'"{hashlib.sha1(data).hexdigest()}"'
+
+        if self.size > MAX_INLINE_SIZE:
+            return
+        self.body = data
+
+        if self.size >= MIN_COMPRESS_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < self.size:
+                self.variants['gzip'] = (compressed, self.etag[:-1] + '-gzip"')
+            if brotli is not None:
+                compressed = brotli.compress(data)
+                if len(compressed) < self.size:
+                    self.variants['br'] = (compressed, self.etag[:-1] + '-br"')
+
+class AssetIndex:
+    """
+    Maps request paths to Assets for one export directory
+
+    Usage:
+        index = AssetIndex('frontend/out')
+        asset = index.lookup('_next/static/chunks/main.js')
+        return index.respond(asset)
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        for directory, _, files in os.walk(root):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                path = os.path.relpath(full_path, root).replace(os.sep, '/')
+                self.assets[path] = Asset(path, full_path)
+
+        self.total_bytes = sum(len(a.body or b'') + sum(len(v[0]) for v in a.variants.values())
+                               for a in self.assets.values())
+
+    def lookup(self, path):
+        return self.assets.get(path)
+
+    def respond(self, asset):
+        """200 from memory (best encoding the client accepts) or 304 if its ETag matches"""
+        body, etag, encoding = asset.body, asset.etag, None
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and candidate in request.accept_encodings:
+                body, etag = asset.variants[candidate]
+                encoding = candidate
+                break
+
+        headers = {'ETag': etag, 'Cache-Control': asset.cache_control}
+        if asset.variants:
+            headers['Vary'] = 'Accept-Encoding'
+
+        # Any representation's tag means the client already has this file
+        tags = [asset.etag] + [variant_etag for _, variant_etag in asset.variants.values()]
+        if any(request.if_none_match.contains_raw(tag) for tag in tags):
+            return Response(status=304, headers=headers)
+
+        if body is None:
+            # Too large to keep in memory - stream it from disk
+            response = send_file(asset.full_path, mimetype=asset.mimetype, conditional=False, etag=False)
+            response.headers.update(headers)
+            return response
+
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(body, status=200, headers=headers, mimetype=asset.mimetype)
@@ -0,0 +1,255 @@
+"""
+Incrementally maintained calculation statistics
+
+Every write path that saves a Calculation also calls record_calculations()
+before committing, so the per-user counters in calculation_stats (and
+the hourly usage buckets) always move together with the calculations table.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from itertools import chain
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import db, User, Calculation, CalculationStat, CalculationRollup
+from usage import record_usage
+
+def _add_to_counters(user_id, amounts):
+    """
+    Add {operation: amount} to a user's counters in a single statement
+    
+    Uses one multi-row INSERT ... ON CONFLICT on SQLite and PostgreSQL,
+    so concurrent writers never lose an increment and a batch costs one
+    statement however many operations it mixes. Other databases fall
+    back to UPDATE-then-INSERT per operation.
+    """
+    dialect = db.session.get_bind().dialect.name
+    values = [
+        {'user_id': user_id, 'operation': operation, 'count': amount}
+        for operation, amount in amounts.items()
+    ]
+    
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(CalculationStat).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'operation'],
+            set_={'count': CalculationStat.count + stmt.excluded.count}
+        )
+        db.session.execute(stmt)
+        return
+    
+    for row in values:
+        updated = db.session.execute(
+            db.update(CalculationStat)
+            .where(CalculationStat.user_id == user_id, CalculationStat.operation == row['operation'])
+            .values(count=CalculationStat.count + row['count'])
+        )
+        if updated.rowcount == 0:
+            db.session.add(CalculationStat(**row))
+
+def record_calculations(user_id, operations, calculated_at=None):
+    """
+    Count new calculations for a user (does NOT commit)
+    
+    Call this right before db.session.commit() in any write path that
+    adds Calculation rows, so counters and rows commit together.
+    Also adds them to the hourly usage buckets (usage.py) for the hour
+    of calculated_at (default: now).
+    """
+    amounts = Counter(operations)
+    if amounts:
+        _add_to_counters(user_id, amounts)
+    record_usage(user_id, operations, calculated_at)
+    db.session.info[SITE_STATS_STALE] = True
+
+def get_user_statistics(user_id):
+    """
+    Return {'total': int, 'operations': {operation: count}} for a user
+    
+    Reads at most one row per operation - O(1) in history size.
+    """
+    operations = dict(
+        db.session.query(CalculationStat.operation, CalculationStat.count)
+        .filter_by(user_id=user_id)
+        .all()
+    )
+    return {
+        'total': sum(operations.values()),
+        'operations': operations
+    }
+
+def get_user_calculation_count(user_id):
+    """Total calculations for a user, summed from their per-operation counters"""
+    return db.session.query(
+        db.func.coalesce(db.func.sum(CalculationStat.count), 0)
+    ).filter_by(user_id=user_id).scalar()
+
+def users_with_calculation_counts():
+    """
+    Select of (User, total calculations) for the admin user listing
+    
+    Returns (statement, calculations_count column) so the caller can sort
+    and page it. The counts come from one grouped subquery over the
+    counters joined onto the users, so a page costs one query however
+    many users it shows. Also checked by migrate.py's hot_queries().
+    """
+    counts = db.select(
+        CalculationStat.user_id.label('user_id'),
+        db.func.sum(CalculationStat.count).label('calculations_count')
+    ).group_by(CalculationStat.user_id).subquery()
+    calculations_count = db.func.coalesce(counts.c.calculations_count, 0)
+    statement = db.select(User, calculations_count).outerjoin(counts, counts.c.user_id == User.id)
+    return statement, calculations_count
+
+def rebuild_calculation_stats(user_id=None):
+    """
+    Rebuild counters from calculations + rollups (does NOT commit)
+    
+    Use after a crash or a manual data fix. Pass user_id to repair a
+    single user, or None to rebuild every counter. Compacted
+    calculations (see rollups.py) are counted through their rollups.
+    
+    Returns the number of counter rows written.
+    """
+    delete = db.delete(CalculationStat)
+    live = db.select(
+        Calculation.user_id.label('user_id'),
+        Calculation.operation.label('operation'),
+        db.func.count(Calculation.id).label('count')
+    ).group_by(Calculation.user_id, Calculation.operation)
+    compacted = db.select(
+        CalculationRollup.user_id,
+        CalculationRollup.operation,
+        db.func.sum(CalculationRollup.count)
+    ).group_by(CalculationRollup.user_id, CalculationRollup.operation)
+    
+    if user_id is not None:
+        delete = delete.where(CalculationStat.user_id == user_id)
+        live = live.where(Calculation.user_id == user_id)
+        compacted = compacted.where(CalculationRollup.user_id == user_id)
+    
+    both = db.union_all(live, compacted).subquery()
+    counts = db.select(both.c.user_id, both.c.operation, db.func.sum(both.c.count)) \
+        .group_by(both.c.user_id, both.c.operation)
+    
+    db.session.execute(delete)
+    # INSERT ... SELECT keeps the counts in the database, even for
+    # millions of calculations (see generate_data.py)
+    result = db.session.execute(
+        db.insert(CalculationStat).from_select(['user_id', 'operation', 'count'], counts)
+    )
+    return result.rowcount
+
+# ===================== SITE-WIDE ADMIN STATISTICS =====================
+
+SITE_STATS_TTL = float(os.environ.get('SITE_STATS_TTL', 30))
+SITE_STATS_STALE = 'site_stats_stale'
+
+class CachedValue:
+    """
+    A value recomputed at most once per TTL, shared by all threads
+    
+    Why single-flight?
+    - When the cache expires under load, many requests miss at once
+    - Only the first one runs compute(); the rest wait for its result
+      instead of all hitting the database together
+    """
+    
+    def __init__(self, compute, ttl):
+        self.compute = compute
+        self.ttl = ttl
+        self._value = None
+        self._expires = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+    
+    def get(self):
+        if time.monotonic() < self._expires:
+            return self._value
+        with self._compute_lock:
+            # Another thread may have refreshed it while we waited
+            if time.monotonic() < self._expires:
+                return self._value
+            with self._lock:
+                generation = self._generation
+            value = self.compute()
+            with self._lock:
+                # Don't cache a result that an invalidate() made stale mid-compute
+                if generation == self._generation:
+                    self._value = value
+                    self._expires = time.monotonic() + self.ttl
+            return value
+    
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._expires = 0.0
+
+def _compute_site_statistics():
+    """All site counters in one aggregate query"""
+    row = db.session.query(
+        db.func.count(User.id),
+        db.func.coalesce(db.func.sum(db.case((User.is_admin, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((User.email_verified, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((User.google_id.isnot(None), 1), else_=0)), 0),
+        db.select(db.func.coalesce(db.func.sum(CalculationStat.count), 0)).scalar_subquery()
+    ).one()
+    total_users, admin_users, verified_users, google_users, total_calculations = row
+    return {
+        'total_users': total_users,
+        'total_calculations': int(total_calculations),
+        'admin_users': int(admin_users),
+        'regular_users': total_users - int(admin_users),
+        'verified_users': int(verified_users),
+        'google_users': int(google_users)
+    }
+
+def _compute_recent_activity():
+    """Newest users and calculations as plain dicts (safe to share between requests)"""
+    recent_users = db.session.query(User.email, User.is_admin, User.created_at) \
+        .order_by(User.created_at.desc()).limit(5).all()
+    recent_calculations = db.session.query(
+        Calculation.number1, Calculation.operation, Calculation.number2,
+        Calculation.result, Calculation.calculated_at
+    ).order_by(Calculation.calculated_at.desc()).limit(10).all()
+    return {
+        'recent_users': [row._asdict() for row in recent_users],
+        'recent_calculations': [row._asdict() for row in recent_calculations]
+    }
+
+_site_statistics = CachedValue(_compute_site_statistics, SITE_STATS_TTL)
+_recent_activity = CachedValue(_compute_recent_activity, SITE_STATS_TTL)
+
+def get_site_statistics():
+    """Cached site counters (users, admins, verified, Google, calculations)"""
+    return _site_statistics.get()
+
+def get_recent_activity():
+    """Cached newest users and calculations for the admin dashboard"""
+    return _recent_activity.get()
+
+def invalidate_site_statistics():
+    _site_statistics.invalidate()
+    _recent_activity.invalidate()
+
+# Invalidate after any commit that changed users or calculations.
+# Calculation writes flag the session in record_calculations(); user
+# writes are picked up from the ORM flush.
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    if any(isinstance(obj, User) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info[SITE_STATS_STALE] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop(SITE_STATS_STALE, False):
+        invalidate_site_statistics()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop(SITE_STATS_STALE, None)
@@ -0,0 +1,23 @@
+"""
+Shared fixtures: the API app on a temporary SQLite database
+
+Run with: python -m pytest -q tests   (from the repository root)
+"""
+
+import os
+import tempfile
+import pytest
+
+@pytest.fixture(scope='session')
+def api_app():
+    database = os.path.join(tempfile.mkdtemp(), 'api.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'  # The default dialect
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+    from api import create_app
+    from migrate import apply_migrations
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}', 'TESTING': True,
+                      'QUERY_INSPECTOR': 'raise'})
+    with app.app_context():
+        apply_migrations()
+    return app
@@ -0,0 +1,82 @@
+"""
+Role changes revoke API tokens issued before them - but only once the
+change commits - and the role version map is reloaded once per expiry
+
+Run with: python -m pytest -q tests
+"""
+
+import threading
+import time
+import pytest
+from sqlalchemy import event
+
+def make_admin(api_app, email):
+    """A new admin and an access token issued to them"""
+    from api import create_user_token
+    from models import db, User
+
+    with api_app.app_context():
+        user = User(email=email, first_name='Role', last_name='Test', user_age=30, is_admin=True)
+        db.session.add(user)
+        db.session.commit()
+        return user.id, {'Authorization': f'Bearer {create_user_token(user)}'}
+
+def demote(api_app, user_id, commit):
+    from auth_claims import role_versions
+    from models import db, User
+
+    with api_app.app_context():
+        user = db.session.get(User, user_id)
+        user.is_admin = False
+        role_versions.bump(user_id)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.rollback()
+
+def test_role_change_revokes_earlier_tokens(api_app):
+    user_id, headers = make_admin(api_app, 'demoted@example.com')
+    client = api_app.test_client()
+    assert client.get('/api/admin/stats', headers=headers).status_code == 200
+
+    demote(api_app, user_id, commit=True)
+
+    assert client.get('/api/admin/stats', headers=headers).status_code == 401
+
+def test_rolled_back_role_change_keeps_tokens_valid(api_app):
+    user_id, headers = make_admin(api_app, 'kept@example.com')
+
+    demote(api_app, user_id, commit=False)
+
+    assert api_app.test_client().get('/api/admin/stats', headers=headers).status_code == 200
+
+def test_threads_waiting_on_an_expired_map_reload_it_once(api_app):
+    from auth_claims import RoleVersionRegistry
+    from models import db
+
+    registry = RoleVersionRegistry(refresh_interval=60)
+    reloads = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM role_versions' in statement:
+            reloads.append(statement)
+
+    def lookup():
+        with api_app.app_context():
+            registry.current('someone')
+
+    with api_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        with registry._lock:  # Every thread finds the map expired and queues on the lock...
+            threads = [threading.Thread(target=lookup) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            registry._loaded_at = time.monotonic()  # ...while the first one reloads it
+        for thread in threads:
+            thread.join()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert reloads == []
@@ -0,0 +1,90 @@
+"""
+Buffered calculations must survive failing flushes: the batch is kept
+and retried while new calculations are written synchronously
+
+Run with: python -m pytest -q tests
+"""
+
+import threading
+import time
+import pytest
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+@pytest.fixture(scope='module')
+def user_id(api_app):
+    from models import db, User
+
+    with api_app.app_context():
+        user = User(email='writer@example.com', first_name='Write', last_name='Behind', user_age=30)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def test_failed_flushes_keep_the_batch_and_write_synchronously(api_app, user_id, monkeypatch):
+    import calculation_writer as module
+    from models import db, Calculation
+
+    failing = threading.Event()
+    failing.set()
+    record_calculations = module.record_calculations
+
+    def flaky_record_calculations(*args, **kwargs):
+        # The database rejects the flusher's transactions, not the request's
+        if failing.is_set() and threading.current_thread().name == 'calculation-writer':
+            raise RuntimeError('database unavailable')
+        return record_calculations(*args, **kwargs)
+
+    monkeypatch.setattr(module, 'record_calculations', flaky_record_calculations)
+
+    writer = module.CalculationWriter()
+    writer.init_app(api_app)
+    writer.mode = module.BUFFERED
+    writer.flush_interval = 0.05
+    writer.max_retries = 2
+
+    with api_app.app_context():
+        buffered = [writer.save(user_id, n, 1, '+', n + 1) for n in range(3)]
+        wait_for(lambda: writer.stats()['failed_flushes'] >= 1)
+        synchronous = writer.save(user_id, 10, 1, '+', 11)
+
+    assert all(saved['id'] is None for saved in buffered)
+    assert synchronous['id'] is not None  # Not queued behind the failing batch
+    assert writer.stats()['pending'] == 3
+    assert writer.stats()['synchronous_writes'] == 1
+
+    failing.clear()
+    wait_for(lambda: writer.stats()['pending'] == 0)
+    writer.shutdown()
+
+    with api_app.app_context():
+        saved = db.session.scalars(
+            db.select(Calculation.number1).where(Calculation.user_id == user_id).order_by(Calculation.id)
+        ).all()
+    assert sorted(saved) == [0, 1, 2, 10]
+    assert writer.stats()['written'] == 3
+    assert writer.stats()['dropped'] == 0
+
+def test_shutdown_counts_rows_it_could_not_write(api_app, user_id, monkeypatch):
+    import calculation_writer as module
+
+    def broken_record_calculations(*args, **kwargs):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(module, 'record_calculations', broken_record_calculations)
+
+    writer = module.CalculationWriter()
+    writer.init_app(api_app)
+    writer.mode = module.BUFFERED
+    writer.flush_interval = 60  # The flusher holds nothing back until shutdown
+    writer.max_retries = 1
+
+    writer._queue.put_nowait({'user_id': user_id, 'number1': 1, 'number2': 1, 'operation': '+',
+                              'result': 2, 'calculated_at': module.datetime.utcnow()})
+    writer.shutdown()
+
+    assert writer.stats()['dropped'] == 1
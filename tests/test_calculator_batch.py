@@ -0,0 +1,131 @@
+"""
+POST /api/calculator/batch must run the same number of SQL statements
+whatever the batch size (one bulk INSERT, not one INSERT per row), and
+stay within its query budget (the app runs with QUERY_INSPECTOR=raise)
+
+Run with: python -m pytest -q tests
+"""
+
+import pytest
+from sqlalchemy import event
+
+@pytest.fixture(scope='module')
+def auth_headers(api_app):
+    from flask_jwt_extended import create_access_token
+    from models import db, User
+
+    with api_app.app_context():
+        user = User(email='batch@example.com', first_name='Batch', last_name='Test', user_age=30)
+        db.session.add(user)
+        db.session.commit()
+        return {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+
+def post_batch(api_app, headers, size, operations):
+    """Response JSON and the SQL statements the request ran"""
+    from models import db
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with api_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = api_app.test_client().post('/api/calculator/batch', headers=headers, json={
+            'num1': [index + 1 for index in range(size)],
+            'num2': [2] * size,
+            'operation': [operations[index % len(operations)] for index in range(size)],
+        })
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json(), statements
+
+def test_batch_statement_count_does_not_grow_with_size(api_app, auth_headers):
+    post_batch(api_app, auth_headers, 1, ['+'])  # Warm the identity cache
+
+    _, one_row = post_batch(api_app, auth_headers, 1, ['+'])
+    body, fifty_rows = post_batch(api_app, auth_headers, 50, ['+'])
+
+    assert body['saved'] == 50
+    assert len(fifty_rows) == len(one_row)
+    assert sum(statement.startswith('INSERT INTO calculations') for statement in fifty_rows) == 1
+
+def test_batch_statement_count_does_not_grow_with_operations(api_app, auth_headers):
+    post_batch(api_app, auth_headers, 1, ['+'])
+
+    _, one_operation = post_batch(api_app, auth_headers, 1, ['+'])
+    body, four_operations = post_batch(api_app, auth_headers, 50, ['+', '-', '*', '/'])
+
+    assert body['saved'] == 50
+    assert len(four_operations) == len(one_operation)
+
+def test_batch_updates_the_counters(api_app, auth_headers):
+    from flask_jwt_extended import decode_token
+    from models import db, Calculation
+    from stats import get_user_statistics
+
+    with api_app.app_context():
+        user_id = decode_token(auth_headers['Authorization'].split()[1])['sub']
+        before = get_user_statistics(user_id)['operations']
+    post_batch(api_app, auth_headers, 8, ['+', '-', '*', '/'])
+    with api_app.app_context():
+        after = get_user_statistics(user_id)['operations']
+        live = dict(db.session.execute(
+            db.select(Calculation.operation, db.func.count())
+            .where(Calculation.user_id == user_id).group_by(Calculation.operation)
+        ).all())
+    assert {operation: after[operation] - before.get(operation, 0) for operation in after} == \
+        {'+': 2, '-': 2, '*': 2, '/': 2}
+    assert after == live
+
+def test_batch_returns_the_ids_of_its_rows(api_app, auth_headers):
+    from models import db, Calculation
+
+    body, _ = post_batch(api_app, auth_headers, 20, ['+', '*'])
+    with api_app.app_context():
+        for item in body['results']:
+            calculation = db.session.get(Calculation, item['calculation_id'])
+            assert f"{calculation.number1} {calculation.operation} {calculation.number2}" in item['expression']
+
+def test_budget_overrun_fails_before_commit(api_app, auth_headers):
+    from models import db, Calculation
+
+    with api_app.app_context():
+        before = db.session.scalar(db.select(db.func.count(Calculation.id)))
+    api_app.config['QUERY_BUDGETS']['api_calculator_batch'] = 2
+    api_app.config['PROPAGATE_EXCEPTIONS'] = False  # Answer with a 500, like production
+    try:
+        response = api_app.test_client().post('/api/calculator/batch', headers=auth_headers, json={
+            'num1': [1, 2], 'num2': [3, 4], 'operation': '+'
+        })
+    finally:
+        del api_app.config['QUERY_BUDGETS']['api_calculator_batch']
+        api_app.config['PROPAGATE_EXCEPTIONS'] = None
+    with api_app.app_context():
+        after = db.session.scalar(db.select(db.func.count(Calculation.id)))
+
+    assert response.status_code == 500
+    assert after == before  # Nothing was saved, so a retry can't duplicate rows
+
+def test_batch_ids_ignore_other_rows_saved_at_the_same_time(api_app, auth_headers):
+    from datetime import datetime
+    from flask_jwt_extended import decode_token
+    from api import insert_calculations
+    from models import db, Calculation
+
+    with api_app.app_context():
+        user_id = decode_token(auth_headers['Authorization'].split()[1])['sub']
+        calculated_at = datetime.utcnow()
+        row = {'user_id': user_id, 'number1': 1.0, 'number2': 2.0, 'operation': '+', 'result': 3.0,
+               'calculated_at': calculated_at}
+        other = Calculation(**row)  # E.g. the write-behind buffer flushing in the same tick
+        db.session.add(other)
+        db.session.flush()
+
+        ids = insert_calculations([row, dict(row, number2=3.0, result=4.0)])
+        db.session.rollback()
+
+    assert other.id not in ids
+    assert len(set(ids)) == 2
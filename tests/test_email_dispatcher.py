@@ -0,0 +1,93 @@
+"""
+Email dispatch against a local SMTP sink (aiosmtpd): messages share one
+connection per worker and transient failures are retried
+
+Needs aiosmtpd (pip install aiosmtpd). Run with: python -m pytest -q tests
+"""
+
+import socket
+import pytest
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+class SmtpSink:
+    """aiosmtpd handler counting sessions and delivered messages"""
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+        self.failures_left = 0  # Answer DATA with a transient error this many times
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1  # smtplib greets once per connection
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.failures_left:
+            self.failures_left -= 1
+            return '451 Try again later'
+        self.messages.append(envelope)
+        return '250 OK'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def smtp_sink():
+    sink = SmtpSink()
+    controller = aiosmtpd_controller.Controller(sink, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield sink, controller.port
+    controller.stop()
+
+@pytest.fixture
+def dispatcher(smtp_sink):
+    from flask import Flask
+    from flask_mail import Mail
+    from email_dispatcher import EmailDispatcher
+
+    _, port = smtp_sink
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                      MAIL_DEFAULT_SENDER='noreply@example.com', EMAIL_DISPATCH_WORKERS=1,
+                      EMAIL_RETRY_BACKOFF=0.05, EMAIL_SMTP_TIMEOUT=5, EMAIL_IDLE_TIMEOUT=0.5)
+    mail = Mail(app)
+    dispatcher = EmailDispatcher()
+    dispatcher.init_app(app, mail)
+    yield dispatcher
+    dispatcher.shutdown(timeout=5)
+
+def message(n):
+    from flask_mail import Message
+    return Message(f'Test {n}', recipients=[f'user{n}@example.com'], body='Hello')
+
+def test_messages_reuse_one_connection(smtp_sink, dispatcher):
+    sink, _ = smtp_sink
+
+    with dispatcher.app.app_context():
+        for n in range(10):
+            assert dispatcher.send(message(n))
+    assert dispatcher.join(timeout=10)
+
+    assert len(sink.messages) == 10
+    assert sink.connections == 1
+    stats = dispatcher.stats()
+    assert (stats['queued'], stats['sent'], stats['failed'], stats['connections_opened']) == (10, 10, 0, 1)
+
+def test_transient_failure_is_retried(smtp_sink, dispatcher):
+    sink, _ = smtp_sink
+    sink.failures_left = 1
+
+    with dispatcher.app.app_context():
+        for n in range(3):
+            dispatcher.send(message(n))
+    assert dispatcher.join(timeout=10)
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in sink.messages) == \
+        ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    stats = dispatcher.stats()
+    assert (stats['sent'], stats['retried'], stats['failed']) == (3, 1, 0)
+    assert stats['connections_opened'] == 2  # The failed connection is dropped, not reused
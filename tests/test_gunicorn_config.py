@@ -0,0 +1,90 @@
+"""
+gunicorn.conf.py loads from any working directory and sets up workers
+per environment; post_fork gives every worker its own connections and
+metrics flush thread
+
+Run with: python -m pytest -q tests
+"""
+
+import json
+import os
+import subprocess
+import sys
+import types
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = os.path.join(REPO, 'gunicorn.conf.py')
+
+# Loads the config the way `gunicorn -c ... api:app` does and reports the settings
+LOAD_CONFIG = """
+import json, sys
+sys.argv = ['gunicorn', '-c', sys.argv[1], 'api:app']
+from gunicorn.app.wsgiapp import WSGIApplication
+cfg = WSGIApplication().cfg
+print(json.dumps({
+    'workers': cfg.workers, 'threads': cfg.threads, 'worker_class': cfg.worker_class_str,
+    'preload_app': cfg.preload_app, 'reload': cfg.reload, 'chdir': cfg.chdir,
+    'hooks': {name: getattr(cfg, name).__code__.co_filename
+              for name in ('post_fork', 'on_starting', 'child_exit', 'when_ready')},
+}))
+"""
+
+def load_config(tmp_path, **env):
+    """Settings from a fresh interpreter started outside the repository"""
+    environ = {key: value for key, value in os.environ.items()
+               if not key.startswith('GUNICORN_') and key not in ('ENVIRONMENT', 'PYTHONPATH')}
+    result = subprocess.run([sys.executable, '-c', LOAD_CONFIG, CONFIG], cwd=tmp_path, env=dict(environ, **env),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+def test_production_profile(tmp_path):
+    cfg = load_config(tmp_path, ENVIRONMENT='production')
+
+    assert (cfg['workers'], cfg['threads'], cfg['worker_class']) == (2, 8, 'gthread')
+    assert cfg['preload_app'] is True
+    assert cfg['reload'] is False
+    assert cfg['chdir'] == REPO
+    assert cfg['hooks'] == dict.fromkeys(cfg['hooks'], CONFIG)  # Ours, not gunicorn's defaults
+
+def test_local_profile_reloads_without_preloading(tmp_path):
+    cfg = load_config(tmp_path, ENVIRONMENT='local')
+
+    assert (cfg['workers'], cfg['worker_class']) == (1, 'gthread')
+    assert cfg['reload'] is True
+    assert cfg['preload_app'] is False
+
+def test_environment_overrides_the_profile(tmp_path):
+    cfg = load_config(tmp_path, ENVIRONMENT='staging', GUNICORN_WORKERS='5', GUNICORN_THREADS='1',
+                      GUNICORN_WORKER_CLASS='sync', GUNICORN_PRELOAD='0')
+
+    assert (cfg['workers'], cfg['threads'], cfg['worker_class'], cfg['preload_app']) == (5, 1, 'sync', False)
+
+@pytest.fixture
+def config_module(monkeypatch, tmp_path):
+    """gunicorn.conf.py executed in this process (its environment changes are undone)"""
+    monkeypatch.setenv('ENVIRONMENT', 'production')
+    monkeypatch.setenv('MIGRATE_ON_STARTUP', '1')
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    namespace = {'__file__': CONFIG, '__name__': 'gunicorn_conf'}
+    with open(CONFIG) as f:
+        exec(compile(f.read(), CONFIG, 'exec'), namespace)
+    return types.SimpleNamespace(**namespace)
+
+@pytest.mark.parametrize('preload', [True, False])
+def test_post_fork_disposes_engines_and_starts_metrics(config_module, monkeypatch, preload):
+    import db_config
+    from metrics import request_metrics
+
+    disposed, flushers = [], []
+    monkeypatch.setattr(db_config, 'dispose_engines', disposed.append)
+    monkeypatch.setattr(request_metrics, 'start_flusher', lambda: flushers.append(os.getpid()))
+    config_module.post_fork.__globals__['preload_app'] = preload  # The config's own namespace
+
+    app = object()
+    worker = types.SimpleNamespace(app=types.SimpleNamespace(wsgi=lambda: app))
+    config_module.post_fork(server=None, worker=worker)
+
+    assert disposed == ([app] if preload else [])  # A non-preloaded worker builds its own engine
+    assert flushers == [os.getpid()]
@@ -0,0 +1,33 @@
+"""
+The hot queries (migrate.hot_queries) must be served by the indexes
+declared in models.py, checked with EXPLAIN QUERY PLAN on SQLite
+
+Run with: python -m pytest -q tests
+"""
+
+import pytest
+
+EXPECTED_INDEXES = {
+    'calculation history page': 'ix_calculations_user_id_calculated_at',
+    'admin recent users': 'ix_users_created_at',
+    'admin recent calculations': 'ix_calculations_calculated_at',
+    'admin users page': 'ix_users_created_at',
+}
+
+@pytest.fixture(scope='module')
+def plans(api_app):
+    from migrate import hot_queries, query_plan
+    from models import db
+
+    with api_app.app_context(), db.engine.connect() as conn:
+        return {name: query_plan(conn, statement) for name, statement in hot_queries()}
+
+def test_every_hot_query_is_checked(plans):
+    assert set(plans) == set(EXPECTED_INDEXES)
+
+@pytest.mark.parametrize('name', sorted(EXPECTED_INDEXES))
+def test_hot_query_uses_its_index(plans, name):
+    plan, uses_index = plans[name]
+
+    assert any(EXPECTED_INDEXES[name] in step for step in plan), plan
+    assert uses_index, plan
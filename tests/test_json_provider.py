@@ -0,0 +1,79 @@
+"""
+The orjson provider must produce the same JSON as the stdlib fallback
+for the app's own payloads (datetimes, Decimals, UUIDs, non-str keys)
+
+Run with: python -m pytest -q tests
+"""
+
+import json
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import pytest
+from flask import Flask
+
+pytest.importorskip('orjson')
+
+CALCULATED_AT = datetime(2025, 3, 14, 15, 9, 26, 535897)
+
+PAYLOADS = {
+    'history page': {
+        'calculations': [
+            {'id': 120 - n, 'number1': n * 1.5, 'number2': 3, 'operation': '*', 'result': n * 4.5,
+             'calculated_at': CALCULATED_AT.replace(second=n)}
+            for n in range(50)
+        ],
+        'next_cursor': 'MjAyNS0wMy0xNFQxNTowOToyNnwxMjA=',
+        'source': 'live',
+    },
+    'admin users page': {
+        'users': [
+            {'id': str(uuid.UUID(int=n)), 'email': f'user{n}@example.com', 'user_age': None if n % 3 else 30,
+             'is_admin': n == 0, 'created_at': datetime(2024, 1, 1, 8, 0, n), 'calculation_count': n * 7}
+            for n in range(20)
+        ],
+        'page': 1, 'pages': 4, 'total': 70,
+    },
+    'site statistics (PostgreSQL sums are Decimals)': {
+        'total_calculations': Decimal('5002'),
+        'average_age': Decimal('31.25'),
+        'operations': {'+': 2001, '-': 1250, '*': 1000, '/': 751},
+    },
+    'usage series': {
+        'granularity': 'day', 'from': date(2025, 3, 1), 'to': datetime(2025, 3, 2, tzinfo=timezone.utc),
+        'totals': {'total': 3, 'new': 1, 'returning': 2, 'operations': {'+': 3}},
+    },
+    'non-str keys': {'by_hour': {0: 5, 13: 2}, 'ratios': {0.5: 'half'}, 'flags': {True: 1, None: 0}},
+    'uuid': {'request_id': uuid.UUID('12345678-1234-5678-1234-567812345678')},
+}
+
+@pytest.fixture(scope='module')
+def providers():
+    from json_provider import OrjsonProvider, StdlibJSONProvider
+
+    app = Flask(__name__)
+    return app, OrjsonProvider(app), StdlibJSONProvider(app)
+
+@pytest.mark.parametrize('name', sorted(PAYLOADS))
+def test_dumps_matches_stdlib(providers, name):
+    _, fast, stdlib = providers
+
+    assert json.loads(fast.dumps(PAYLOADS[name])) == json.loads(stdlib.dumps(PAYLOADS[name]))
+
+@pytest.mark.parametrize('name', sorted(PAYLOADS))
+def test_response_matches_stdlib(providers, name):
+    app, fast, stdlib = providers
+
+    with app.app_context():
+        fast_response = fast.response(PAYLOADS[name])
+        stdlib_response = stdlib.response(PAYLOADS[name])
+
+    assert fast_response.mimetype == stdlib_response.mimetype == 'application/json'
+    assert json.loads(fast_response.get_data()) == json.loads(stdlib_response.get_data())
+
+def test_datetimes_are_iso_8601(providers):
+    _, fast, stdlib = providers
+    payload = {'at': CALCULATED_AT, 'day': date(2025, 3, 14), 'utc': datetime(2025, 3, 14, tzinfo=timezone.utc)}
+
+    expected = {'at': '2025-03-14T15:09:26.535897', 'day': '2025-03-14', 'utc': '2025-03-14T00:00:00+00:00'}
+    assert json.loads(fast.dumps(payload)) == json.loads(stdlib.dumps(payload)) == expected
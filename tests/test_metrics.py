@@ -0,0 +1,61 @@
+"""
+Workers share their request counts through METRICS_DIR: a scrape must
+report every request served, including the last ones a worker answered
+before going idle
+
+Run with: python -m pytest -q tests
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+# A second "worker": records three requests, then sits idle until stdin closes
+WORKER = """
+import sys
+from metrics import RequestMetrics
+
+registry = RequestMetrics(metrics_dir=sys.argv[1], flush_interval=0.2)
+for _ in range(3):
+    registry.observe('api', 'health_check', 'GET', 200, 0.001, 0, 0.0)
+print('ready', flush=True)
+sys.stdin.read()
+"""
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def requests_total(registry):
+    lines = [line for line in registry.render().splitlines()
+             if line.startswith('http_requests_total{') and 'health_check' in line]
+    return sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+
+def test_scrape_sums_requests_of_idle_workers(tmp_path):
+    from metrics import RequestMetrics
+
+    worker = subprocess.Popen([sys.executable, '-c', WORKER, str(tmp_path)], cwd=REPO,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                              env=dict(os.environ, PYTHONPATH=REPO))
+    try:
+        assert worker.stdout.readline().strip() == 'ready'
+        registry = RequestMetrics(metrics_dir=str(tmp_path), flush_interval=0.2)
+        registry.observe('api', 'health_check', 'GET', 200, 0.001, 0, 0.0)
+        registry.observe('api', 'health_check', 'GET', 200, 0.001, 0, 0.0)
+
+        time.sleep(1)  # The worker serves nothing more, its flush thread still writes
+        assert worker.poll() is None
+        assert requests_total(registry) == 5
+        assert requests_total(registry) == 5  # Scrapes agree with each other
+    finally:
+        worker.stdin.close()
+        worker.wait(timeout=10)
+
+def test_flush_thread_writes_without_requests(tmp_path):
+    from metrics import RequestMetrics
+
+    registry = RequestMetrics(metrics_dir=str(tmp_path), flush_interval=0.1)
+    registry.start_flusher()
+    registry.start_flusher()  # Once per process
+
+    time.sleep(0.5)
+    assert os.listdir(tmp_path) == [f'{os.getpid()}.json']
@@ -0,0 +1,32 @@
+"""
+The password hashing pool must be safe to create from a threaded worker
+and must not fail a login when it is too busy to answer
+
+Run with: python -m pytest -q tests
+"""
+
+import multiprocessing
+import pytest
+from password_hashing import PasswordHasher
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher()
+    hasher.method = 'pbkdf2:sha256:1000'  # Fast enough for tests
+    hasher.workers = 1
+    yield hasher
+    hasher.shutdown()
+
+@pytest.mark.skipif('forkserver' not in multiprocessing.get_all_start_methods(), reason='no forkserver here')
+def test_pool_does_not_fork_the_threaded_worker(hasher):
+    assert hasher._get_executor()._mp_context.get_start_method() == 'forkserver'
+    assert hasher.verify(hasher.hash('secret'), 'secret')
+
+def test_busy_pool_falls_back_to_hashing_inline(hasher):
+    hasher.timeout = 0.0001  # The pool can't even start its processes this fast
+
+    password_hash = hasher.hash('secret')
+
+    assert password_hash.startswith('pbkdf2:sha256:1000$')
+    assert hasher.verify(password_hash, 'secret')
+    assert not hasher.verify(password_hash, 'wrong')
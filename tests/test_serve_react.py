@@ -0,0 +1,66 @@
+"""
+serve_react answers from the in-memory asset index: gzip when accepted,
+304 for a matching If-None-Match, 404 when the export has no index.html
+
+Run with: python -m pytest -q tests
+"""
+
+import pytest
+
+CHUNK = 'export function add(a, b) { return a + b }\n' * 200
+
+def build_export(root, with_index=True):
+    chunks = root / '_next' / 'static' / 'chunks'
+    chunks.mkdir(parents=True)
+    (chunks / 'main-abc123.js').write_text(CHUNK)
+    if with_index:
+        (root / 'index.html').write_text('<html><body>' + 'Amsterdam ' * 100 + '</body></html>')
+    return root
+
+def react_app(api_app, export):
+    from api import create_app
+    return create_app({'SQLALCHEMY_DATABASE_URI': api_app.config['SQLALCHEMY_DATABASE_URI'], 'TESTING': True,
+                       'FRONTEND_BUILD_PATH': str(export)})
+
+@pytest.fixture(scope='module')
+def client(api_app, tmp_path_factory):
+    return react_app(api_app, build_export(tmp_path_factory.mktemp('out'))).test_client()
+
+def test_gzip_served_when_accepted(client):
+    response = client.get('/_next/static/chunks/main-abc123.js', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert len(response.data) < len(CHUNK)
+
+def test_identity_served_otherwise(client):
+    response = client.get('/_next/static/chunks/main-abc123.js')
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == CHUNK
+
+def test_matching_etag_gets_304(client):
+    etag = client.get('/_next/static/chunks/main-abc123.js', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+
+    response = client.get('/_next/static/chunks/main-abc123.js', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_client_routes_get_index_html(client):
+    response = client.get('/dashboard/history')
+
+    assert response.status_code == 200
+    assert b'Amsterdam' in response.data
+    assert response.headers['Cache-Control'] == 'public, max-age=0, must-revalidate'
+
+def test_missing_files_and_api_paths_are_404(client):
+    assert client.get('/_next/static/chunks/missing.js').status_code == 404
+    assert client.get('/api/nothing-here').get_json() == {'error': 'Endpoint not found'}
+
+def test_export_without_index_html_is_404(api_app, tmp_path):
+    client = react_app(api_app, build_export(tmp_path, with_index=False)).test_client()
+
+    assert client.get('/dashboard').status_code == 404
+    assert client.get('/_next/static/chunks/main-abc123.js').status_code == 200
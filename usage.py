@@ -0,0 +1,296 @@
+"""
+Time-series usage analytics backed by hourly pre-aggregates
+
+record_calculations() (stats.py) calls record_usage() in the same
+transaction as every calculation write, adding to usage_buckets: one
+counter per hour, operation and cohort. Charts then read those counters
+instead of scanning calculations - a 90-day range is at most
+90 x 24 x operations x cohorts x shards rows.
+
+Cohorts:
+- new: the user signed up less than USAGE_NEW_USER_HOURS (24) before
+  the calculation
+- returning: everyone else
+
+Settings (environment):
+- USAGE_NEW_USER_HOURS: age below which a user counts as new (default 24)
+- USAGE_BUCKET_SHARDS: counter rows per bucket, spreads row-lock
+  contention between concurrent writers (default 8 on PostgreSQL, 1 on
+  SQLite where the whole database has a single writer anyway)
+
+rebuild_usage_buckets() recomputes everything from calculations and
+rollups, e.g. after bulk imports (generate_data.py does this). It also
+merges the shards back into one row per bucket (rebuild_stats.py), and
+migrate.py runs it when it creates the table on an existing database.
+"""
+
+import os
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from flask import request
+from sqlalchemy.dialects import postgresql, sqlite
+from identity_cache import identity_cache
+from models import db, User, Calculation, CalculationRollup, UsageBucket
+
+USAGE_NEW_USER_HOURS = float(os.environ.get('USAGE_NEW_USER_HOURS', 24))
+USAGE_BUCKET_SHARDS = int(os.environ.get('USAGE_BUCKET_SHARDS', 0))  # 0 = per dialect, see above
+USAGE_DEFAULT_DAYS = 30
+USAGE_MAX_DAYS = 366
+USAGE_MAX_HOURLY_DAYS = 31  # 744 points is plenty for a chart
+GRANULARITIES = ('hour', 'day')
+
+class UsageQueryError(ValueError):
+    """Invalid analytics parameters (reported to the client as 400)"""
+
+def bucket_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def _cohort_at(created_at, moment):
+    if created_at and moment - created_at < timedelta(hours=USAGE_NEW_USER_HOURS):
+        return 'new'
+    return 'returning'
+
+def user_cohort(user_id, calculated_at):
+    """'new' or 'returning' - reads the identity cache, so usually no query"""
+    user = identity_cache.get(user_id)
+    return _cohort_at(user.created_at if user else None, calculated_at)
+
+# ===================== WRITE PATH =====================
+
+def _add_to_buckets(bucket, cohort, shard, amounts):
+    """
+    Add {operation: amount} to one bucket's counters in a single statement
+
+    INSERT ... ON CONFLICT on SQLite and PostgreSQL (same strategy as
+    stats._add_to_counters), UPDATE-then-INSERT elsewhere.
+    """
+    dialect = db.session.get_bind().dialect.name
+    values = [
+        {'bucket': bucket, 'operation': operation, 'cohort': cohort, 'shard': shard, 'count': amount}
+        for operation, amount in amounts.items()
+    ]
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(UsageBucket).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['bucket', 'operation', 'cohort', 'shard'],
+            set_={'count': UsageBucket.count + stmt.excluded.count}
+        )
+        db.session.execute(stmt)
+        return
+
+    for row in values:
+        updated = db.session.execute(
+            db.update(UsageBucket)
+            .where(UsageBucket.bucket == bucket, UsageBucket.operation == row['operation'],
+                   UsageBucket.cohort == cohort, UsageBucket.shard == shard)
+            .values(count=UsageBucket.count + row['count'])
+        )
+        if updated.rowcount == 0:
+            db.session.add(UsageBucket(**row))
+
+def record_usage(user_id, operations, calculated_at=None):
+    """Count calculations made by one user at one moment (does NOT commit)"""
+    amounts = Counter(operations)
+    if not amounts:
+        return
+    calculated_at = calculated_at or datetime.utcnow()
+    cohort = user_cohort(user_id, calculated_at)
+    shards = USAGE_BUCKET_SHARDS or (1 if db.session.get_bind().dialect.name == 'sqlite' else 8)
+    _add_to_buckets(bucket_start(calculated_at), cohort, random.randrange(shards), amounts)
+
+# ===================== REBUILD =====================
+
+def _sql_helpers(dialect):
+    """
+    Dialect-specific SQL: (hour of a timestamp, midnight of a timestamp or
+    date, hours between two timestamps), or None if unsupported
+    """
+    if dialect == 'postgresql':
+        return (
+            lambda moment: db.func.date_trunc('hour', moment),
+            lambda moment: db.func.date_trunc('day', db.cast(moment, db.DateTime)),
+            lambda later, earlier: db.extract('epoch', later - earlier) / 3600.0,
+        )
+    if dialect == 'sqlite':
+        # Same text format SQLAlchemy stores DateTime columns in on SQLite
+        return (
+            lambda moment: db.func.strftime('%Y-%m-%d %H:00:00.000000', moment),
+            lambda moment: db.func.strftime('%Y-%m-%d 00:00:00.000000', moment),
+            lambda later, earlier: (db.func.julianday(later) - db.func.julianday(earlier)) * 24.0,
+        )
+    return None
+
+def rebuild_usage_buckets():
+    """
+    Recompute every usage bucket from calculations + rollups (does NOT commit)
+
+    Runs as one INSERT ... SELECT on SQLite and PostgreSQL, so it stays
+    in the database even for millions of rows; other databases group by
+    timestamp in SQL and by hour in Python (_rebuild_by_timestamp).
+    Compacted days only know their date, so they land in the midnight
+    bucket and the cohort is judged at the start of that day. Also
+    run by migrate.py when it creates the usage_buckets table.
+    Returns the number of bucket rows written.
+    """
+    helpers = _sql_helpers(db.session.get_bind().dialect.name)
+    if helpers is None:
+        return _rebuild_by_timestamp()
+    hour, midnight, hours_between = helpers
+
+    def cohort(moment):
+        return db.case(
+            (db.and_(User.created_at.isnot(None), hours_between(moment, User.created_at) < USAGE_NEW_USER_HOURS), 'new'),
+            else_='returning'
+        )
+
+    live = db.select(
+        hour(Calculation.calculated_at).label('bucket'),
+        Calculation.operation.label('operation'),
+        cohort(Calculation.calculated_at).label('cohort'),
+        db.literal(1).label('count')
+    ).join(User, User.id == Calculation.user_id).where(Calculation.calculated_at.isnot(None))
+    day_start = midnight(CalculationRollup.day)
+    compacted = db.select(
+        day_start,
+        CalculationRollup.operation,
+        cohort(day_start),
+        CalculationRollup.count
+    ).join(User, User.id == CalculationRollup.user_id)
+
+    both = db.union_all(live, compacted).subquery()
+    buckets = db.select(both.c.bucket, both.c.operation, both.c.cohort, db.literal(0), db.func.sum(both.c.count)) \
+        .group_by(both.c.bucket, both.c.operation, both.c.cohort)
+
+    db.session.execute(db.delete(UsageBucket))
+    result = db.session.execute(
+        db.insert(UsageBucket).from_select(['bucket', 'operation', 'cohort', 'shard', 'count'], buckets)
+    )
+    return result.rowcount
+
+REBUILD_BATCH_SIZE = 5000
+
+def _rebuild_by_timestamp():
+    """
+    rebuild_usage_buckets() for databases without the SQL helpers
+
+    A plain GROUP BY on (timestamp, operation, signup time) keeps the
+    rows read small, the hour and cohort are worked out here, and the
+    buckets go back with batched INSERTs.
+    """
+    counts = Counter()
+    live = db.select(Calculation.calculated_at, Calculation.operation, User.created_at, db.func.count()) \
+        .join(User, User.id == Calculation.user_id) \
+        .where(Calculation.calculated_at.isnot(None)) \
+        .group_by(Calculation.calculated_at, Calculation.operation, User.created_at)
+    for calculated_at, operation, created_at, count in db.session.execute(live.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        counts[(bucket_start(calculated_at), operation, _cohort_at(created_at, calculated_at))] += count
+
+    compacted = db.select(CalculationRollup.day, CalculationRollup.operation, User.created_at,
+                          db.func.sum(CalculationRollup.count)) \
+        .join(User, User.id == CalculationRollup.user_id) \
+        .group_by(CalculationRollup.day, CalculationRollup.operation, User.created_at)
+    for day, operation, created_at, count in db.session.execute(compacted.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        midnight = datetime.combine(day, datetime.min.time())
+        counts[(midnight, operation, _cohort_at(created_at, midnight))] += count
+
+    db.session.execute(db.delete(UsageBucket))
+    rows = [
+        {'bucket': bucket, 'operation': operation, 'cohort': cohort, 'shard': 0, 'count': count}
+        for (bucket, operation, cohort), count in counts.items()
+    ]
+    for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+        db.session.execute(db.insert(UsageBucket), rows[start:start + REBUILD_BATCH_SIZE])
+    return len(rows)
+
+# ===================== READ PATH =====================
+
+def usage_series(start, end, granularity='day'):
+    """
+    Calculations per bucket in [start, end), every bucket present (zeros included)
+
+    Returns {'granularity', 'from', 'to', 'buckets': [...], 'totals': {...}}
+    where each bucket and the totals have total, new, returning and
+    operations ({operation: count}).
+    """
+    step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    start = bucket_start(start) if granularity == 'hour' else datetime.combine(start.date(), datetime.min.time())
+
+    def empty():
+        return {'total': 0, 'new': 0, 'returning': 0, 'operations': {}}
+
+    series = {}
+    moment = start
+    while moment < end:
+        series[moment] = empty()
+        moment += step
+
+    # Sums the shards (and the hours of a day in SQL when the dialect
+    # allows, so a 90-day range returns ~hundreds of rows, not ~thousands).
+    # The range is served by the primary key's leading bucket column.
+    key = UsageBucket.bucket
+    helpers = _sql_helpers(db.session.get_bind().dialect.name)
+    if granularity == 'day' and helpers:
+        key = db.type_coerce(helpers[1](UsageBucket.bucket), db.DateTime)
+    rows = db.session.execute(
+        db.select(key, UsageBucket.operation, UsageBucket.cohort, db.func.sum(UsageBucket.count))
+        .where(UsageBucket.bucket >= start, UsageBucket.bucket < end)
+        .group_by(key, UsageBucket.operation, UsageBucket.cohort)
+    )
+
+    totals = empty()
+    for bucket, operation, cohort, count in rows:
+        slot = bucket if granularity == 'hour' else bucket.replace(hour=0)
+        for entry in (series[slot], totals):
+            entry['total'] += count
+            entry[cohort] += count
+            entry['operations'][operation] = entry['operations'].get(operation, 0) + count
+
+    return {
+        'granularity': granularity,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'buckets': [dict(timestamp=moment.isoformat(), **values) for moment, values in series.items()],
+        'totals': totals,
+    }
+
+def _parse_moment(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise UsageQueryError(f"{name} must be an ISO 8601 date, e.g. 2025-01-31")
+    # Buckets are naive UTC
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+def usage_series_from_request():
+    """
+    usage_series() for the current request's query parameters
+
+    - granularity: hour or day (default day)
+    - days: range ending now (default 30), or explicit from / to
+      (ISO 8601, `to` exclusive); at most 366 days, 31 per hour
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise UsageQueryError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+
+    end = _parse_moment('to') or bucket_start(datetime.utcnow()) + timedelta(hours=1)
+    start = _parse_moment('from')
+    if start is None:
+        try:
+            days = int(request.args.get('days', USAGE_DEFAULT_DAYS))
+        except ValueError:
+            raise UsageQueryError("days must be an integer")
+        start = end - timedelta(days=days)
+
+    if start >= end:
+        raise UsageQueryError("from must be before to")
+    max_days = USAGE_MAX_HOURLY_DAYS if granularity == 'hour' else USAGE_MAX_DAYS
+    if end - start > timedelta(days=max_days):
+        raise UsageQueryError(f"range can be at most {max_days} days with granularity={granularity}")
+    return usage_series(start, end, granularity)